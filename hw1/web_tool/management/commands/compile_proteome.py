@@ -0,0 +1,23 @@
+# web_tool/management/commands/compile_proteome.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from web_tool.utils.proteome import compile_proteome, load_proteome
+from web_tool.views import HUMAN_FASTA
+
+
+class Command(BaseCommand):
+    help = "把 human.fasta 編譯成 binary proteome（human.fasta.prot/），pipeline 之後直接 memmap、不再 parse"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fasta", default=str(HUMAN_FASTA), help="來源 FASTA（預設 HUMAN_FASTA）")
+        parser.add_argument("--out", default=None, help="輸出目錄（預設 <fasta>.prot）")
+
+    def handle(self, *args, **opts):
+        t0 = time.time()
+        out = compile_proteome(opts["fasta"], opts["out"])
+        prot = load_proteome(out)
+        self.stdout.write(
+            f"✅ {out}：{prot.meta['records']} 條序列、{prot.meta['residues']} 個殘基（{time.time() - t0:.1f}s）"
+        )
@@ -0,0 +1,13 @@
+# web_tool/management/commands/rebuild_summaries.py
+from django.core.management.base import BaseCommand
+
+from web_tool.utils.summary_tables import rebuild_summaries
+from web_tool.views import DB_PATH, TABLE_ENR
+
+
+class Command(BaseCommand):
+    help = "全量重建 View by Epitope / Query / Reference 的彙總表"
+
+    def handle(self, *args, **opts):
+        n = rebuild_summaries(DB_PATH, src_table=TABLE_ENR)
+        self.stdout.write(f"✅ 彙總表已重建，處理 {n} 筆 {TABLE_ENR}")
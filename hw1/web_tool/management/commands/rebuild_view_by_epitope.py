@@ -0,0 +1,13 @@
+# web_tool/management/commands/rebuild_view_by_epitope.py
+from django.core.management.base import BaseCommand
+
+from web_tool.utils.View_by_Epitope import build_view_by_epitope
+from web_tool.views import DB_PATH, TABLE_ENR, VIEW_EPI_TABLE
+
+
+class Command(BaseCommand):
+    help = "離線全量重建 view_by_epitope（平常每次送出只做增量合併）"
+
+    def handle(self, *args, **opts):
+        out = build_view_by_epitope(DB_PATH, src_table=TABLE_ENR, dst_table=VIEW_EPI_TABLE)
+        self.stdout.write(f"✅ {VIEW_EPI_TABLE} 已重建，筆數：{len(out)}")
@@ -0,0 +1,25 @@
+# web_tool/management/commands/run_mme_worker.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from web_tool.utils.job_worker import start_pool
+from web_tool.views import HUMAN_FASTA, IEDB_CSV
+
+
+class Command(BaseCommand):
+    help = "啟動本機 MME worker pool，處理 mme_form 以 mode=async 排入的 job"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2, help="worker process 數")
+        parser.add_argument("--poll", type=float, default=1.0, help="queue 空的時候多久查一次（秒）")
+
+    def handle(self, *args, **opts):
+        procs = start_pool(opts["workers"], HUMAN_FASTA, IEDB_CSV, poll_interval=opts["poll"])
+        self.stdout.write(f"✅ {len(procs)} 個 worker 已啟動（Ctrl+C 結束）")
+        try:
+            while any(p.is_alive() for p in procs):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            for p in procs:
+                p.terminate()
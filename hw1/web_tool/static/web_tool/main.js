@@ -160,9 +160,10 @@ document.addEventListener("DOMContentLoaded", async function () {
   if (fileInput && textarea) {
     fileInput.addEventListener('change', (e) => {
       const files = Array.from(e.target.files || []);
-      const fastaFiles = files.filter(f => /\.fa(sta)?$/i.test(f.name));
-      if (fastaFiles.length !== files.length) alert('請只上傳 FASTA 檔案（.fasta 或 .fa）');
-      if (fastaFiles.length > 0) {
+      const fastaFiles = files.filter(f => /\.fa(sta)?(\.gz)?$/i.test(f.name));
+      if (fastaFiles.length !== files.length) alert('請只上傳 FASTA 檔案（.fasta / .fa，可 .gz 壓縮）');
+      // .gz 不預覽進 textarea，直接隨表單上傳由後端串流解壓
+      if (fastaFiles.length > 0 && !/\.gz$/i.test(fastaFiles[0].name)) {
         const reader = new FileReader();
         reader.onload = (ev) => { textarea.value = ev.target.result; };
         reader.readAsText(fastaFiles[0]);
@@ -185,6 +186,8 @@ document.addEventListener("DOMContentLoaded", async function () {
       const jobData = await createNewJob();
 
       const formData = new FormData(form);
+      // 結果以 job_id 分區存進 DB；之後 job 搜尋頁用同一個 ID 就只看這批
+      if (jobData) formData.set('job_id', jobData.job_id);
       try {
         const res = await fetch(form.action, {
           method: 'POST',
@@ -1,3 +1,825 @@
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase
+from contextlib import closing
+from unittest import mock
+import gzip, io, json, socket, sqlite3, subprocess, sys, tempfile
+from pathlib import Path
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+
+from . import views
+from .utils import jobs, kmer_index, kmer_refdb, protein_memo
+from .utils.bulk_load import bulk_insert
+from .utils import datatables
+from .utils.datatables import datatables_query, is_datatables_request
+from .utils.export_stream import csv_chunks, gzip_chunks, iter_query, stream_export, stream_frame
+from .utils.fasta_index import get_fasta_index
+from .utils import IEDB_pipline
+from .utils.IEDB_pipline import NameSubstringIndex, interval_counts, load_reference, overlap_pairs
+from .utils.parallel_scan import fasta_shards
+from .utils.proteome import compile_proteome
+from .utils.upload_stream import UploadTooLarge, open_upload_text
+from .utils.result_cache import cache_lookup, cache_store, link_cached_result, result_key
+from .utils.View_by_Epitope import append_view_by_epitope, build_view_by_epitope
+from .utils import summary_tables
+from .utils.summary_tables import job_summary_sql, mark_summary_dirty, refresh_summaries, try_refresh_summaries
+from .utils.job_worker import write_job_rows
+from .utils.mme_pipline import (
+    find_common_ac, find_common_df, find_mems, kmers_df, parse_fasta, parse_k_list, replace_job_rows,
+    run_pipeline, stitch_consecutive,
+)
+
+
+# 舊版（逐組 groupby + dict）的 stitch_consecutive，當作回歸測試的對照組
+def _stitch_consecutive_loop(common_df: pd.DataFrame) -> pd.DataFrame:
+    df = common_df.sort_values(
+        by=["hit_human_protein_name", "query_protein_name", "MME(hit)_start", "MME(query)_start"],
+        kind="mergesort",
+    ).reset_index(drop=True)
+
+    same_pair = (
+        df["hit_human_protein_name"].eq(df["hit_human_protein_name"].shift())
+        & df["query_protein_name"].eq(df["query_protein_name"].shift())
+    )
+    is_break = ~(same_pair & df["MME(hit)_start"].diff().eq(1) & df["MME(query)_start"].diff().eq(1))
+    group_id = is_break.cumsum()
+
+    out = []
+    for _, g in df.groupby(group_id, sort=False):
+        first = g.iloc[0]
+        if len(g) == 1:
+            length = int(first.get("length_of_MME(query)", 1))
+            out.append({
+                "MME(query)": first["MME(query)"],
+                "MME(hit)": first["MME(hit)"],
+                "query_protein_name": first["query_protein_name"],
+                "query_protein_length": int(first["query_protein_length"]),
+                "length_of_MME(query)": length,
+                "MME(query)_start": int(first["MME(query)_start"]),
+                "MME(query)_end": int(first["MME(query)_end"]),
+                "hit_human_protein_name": first["hit_human_protein_name"],
+                "hit_human_protein_length": int(first["hit_human_protein_length"]),
+                "length_of_MME(hit)": length,
+                "MME(hit)_start": int(first["MME(hit)_start"]),
+                "MME(hit)_end": int(first["MME(hit)_end"]),
+            })
+            continue
+
+        kmer0 = first["MME(query)"]
+        merged = kmer0 + "".join(mm[-1] for mm in g["MME(query)"].iloc[1:])
+        length = len(merged)
+        qs = int(first["MME(query)_start"])
+        hs = int(first["MME(hit)_start"])
+        out.append({
+            "MME(query)": merged, "MME(hit)": merged,
+            "query_protein_name": first["query_protein_name"],
+            "query_protein_length": int(first["query_protein_length"]),
+            "length_of_MME(query)": length, "MME(query)_start": qs, "MME(query)_end": qs + length - 1,
+            "hit_human_protein_name": first["hit_human_protein_name"],
+            "hit_human_protein_length": int(first["hit_human_protein_length"]),
+            "length_of_MME(hit)": length, "MME(hit)_start": hs, "MME(hit)_end": hs + length - 1,
+        })
+
+    return pd.DataFrame(out).sort_values(
+        by=["MME(query)", "MME(hit)_start"], kind="mergesort"
+    ).reset_index(drop=True)
+
+
+QUERY_FASTA = """>q1 test
+MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNLSGAEKAVQVKVKALPDAQ
+>q2 repeats
+GGGGGGGGACACACACACMKTAYIAK
+"""
+
+HUMAN_FASTA = """>sp|P00001|H1_HUMAN one
+AAAAMKTAYIAKQRQISFVKSHFSRQLWWWWWLGLIEVQAPILSRVGDGCCCC
+>sp|P00002|H2_HUMAN two
+GGGGGGGGGGGACACACACACACACQDNLSGAEKAVQVKVKALPD
+>sp|P00003|H3_HUMAN three
+YYYYYYYYYYYYYYYYYYYY
+"""
+
+
+class StitchConsecutiveTests(SimpleTestCase):
+    def _common(self, k):
+        return find_common_df(kmers_df(io.StringIO(QUERY_FASTA), k),
+                              kmers_df(io.StringIO(HUMAN_FASTA), k))
+
+    def test_matches_loop_implementation(self):
+        for k in (2, 3, 4, 6):
+            common = self._common(k)
+            expected = _stitch_consecutive_loop(common)
+            got = stitch_consecutive(common)
+            self.assertEqual(got.to_csv(index=False), expected.to_csv(index=False), msg=f"k={k}")
+
+    def test_query_seqs_slicing_matches(self):
+        seqs = {"q1 test": "MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNLSGAEKAVQVKVKALPDAQ",
+                "q2 repeats": "GGGGGGGGACACACACACMKTAYIAK"}
+        common = self._common(4)
+        pd.testing.assert_frame_equal(stitch_consecutive(common, query_seqs=seqs),
+                                      stitch_consecutive(common))
+
+    def test_empty(self):
+        out = stitch_consecutive(self._common(4).iloc[0:0])
+        self.assertTrue(out.empty)
+        self.assertIn("MME(query)", out.columns)
+
+
+class MemModeTests(SimpleTestCase):
+    def test_matches_stitched_kmers(self):
+        for k in (2, 3, 4, 6, 13):
+            expected = stitch_consecutive(find_common_df(kmers_df(io.StringIO(QUERY_FASTA), k),
+                                                         kmers_df(io.StringIO(HUMAN_FASTA), k)))
+            got = find_mems(io.StringIO(QUERY_FASTA), io.StringIO(HUMAN_FASTA), k)
+            self.assertEqual(got.to_csv(index=False), expected.to_csv(index=False), msg=f"k={k}")
+
+    def test_diagonal_mems_are_maximal(self):
+        out = find_mems(io.StringIO(QUERY_FASTA), io.StringIO(HUMAN_FASTA), 4, diagonal=True)
+        row = out[out["MME(query)"] == "MKTAYIAKQRQISFVKSHFSRQL"]
+        self.assertEqual(len(row), 1)
+        self.assertEqual(int(row["MME(hit)_start"].iloc[0]), 5)
+
+
+class PackedBackendTests(SimpleTestCase):
+    def test_matches_find_common_df_path(self):
+        # k > 12 時 packed key 只取前 12 個 residue，其餘靠 tail 驗證
+        for k in (3, 5, 12, 13, 16):
+            expected = _stitch_consecutive_loop(find_common_df(kmers_df(io.StringIO(QUERY_FASTA), k),
+                                                               kmers_df(io.StringIO(HUMAN_FASTA), k)))
+            got = run_pipeline(io.StringIO(QUERY_FASTA), io.StringIO(HUMAN_FASTA), k, backend="packed")
+            self.assertEqual(got.to_csv(index=False), expected.to_csv(index=False), msg=f"k={k}")
+
+
+class AcBackendTests(SimpleTestCase):
+    def test_repeated_kmers_keep_every_query_position(self):
+        # q2 的 GGGG / ACAC 在 query 內重複出現，每個位置都要有命中
+        for k in (3, 4):
+            expected = find_common_df(kmers_df(io.StringIO(QUERY_FASTA), k), kmers_df(io.StringIO(HUMAN_FASTA), k))
+            got = find_common_ac(io.StringIO(QUERY_FASTA), io.StringIO(HUMAN_FASTA), k)
+            self.assertEqual(stitch_consecutive(got).to_csv(index=False),
+                             stitch_consecutive(expected).to_csv(index=False), msg=f"k={k}")
+            for col in ("MME(query)", "query_protein_name", "hit_human_protein_name"):
+                cats = list(got[col].cat.categories)
+                self.assertEqual(cats, sorted(cats), msg=f"k={k} {col}")
+
+
+class NameSubstringIndexTests(SimpleTestCase):
+    def test_counts_distinct_names(self):
+        names = pd.Series(["AAAA", "KAAAK", "QISF", "AKQRQISFAKQ", "", "AAAAAAAA", "ISFVK"])
+        idx = NameSubstringIndex.build(names)
+        for epi in ("A", "AA", "AAA", "AK", "QISF", "ISF", "K", "ZZ", "AAAAAAAAA"):
+            self.assertEqual(idx.count(epi), sum(epi in n for n in names), msg=epi)
+        self.assertEqual(idx.count(""), 0)
+
+
+class ParallelScanTests(SimpleTestCase):
+    def test_matches_single_process(self):
+        with tempfile.TemporaryDirectory() as d:
+            human = Path(d) / "human.fasta"
+            human.write_text(HUMAN_FASTA)
+            shards = fasta_shards(human, 3)
+            self.assertGreater(len(shards), 1)
+            data = human.read_bytes()
+            self.assertEqual((shards[0][0], shards[-1][1]), (0, len(data)))
+            self.assertTrue(all(data[a:a + 1] == b">" for a, _ in shards))   # 不切斷 record
+            for k in (3, 5, 13):
+                expected = find_mems(io.StringIO(QUERY_FASTA), io.StringIO(HUMAN_FASTA), k)
+                for method in ("packed", "ac"):
+                    got = run_pipeline(io.StringIO(QUERY_FASTA), str(human), k, backend=method, workers=2)
+                    self.assertEqual(got.to_csv(index=False), expected.to_csv(index=False), msg=f"{method} k={k}")
+
+
+IEDB_CSV = """Name,UniProt_ID,Starting Position,Ending Position
+MKTAYIAK,P00001,5,12
+KTAYIAKQRQ,P00001,6,15
+QDNLSG,sp|P00002|H2,26,31
+AAAAMKTA,P00001,,
+LGLIEV,P99999,1,6
+"""
+
+
+class IEDBReferenceCacheTests(SimpleTestCase):
+    def _mme(self):
+        return find_mems(io.StringIO(QUERY_FASTA), io.StringIO(HUMAN_FASTA), 4)
+
+    def test_cached_reference_matches_csv_and_reloads_on_change(self):
+        with tempfile.TemporaryDirectory() as d, mock.patch.dict(IEDB_pipline._REF_CACHE, clear=True):
+            csv_path = Path(d) / "iedb.csv"
+            csv_path.write_text(IEDB_CSV)
+            expected = IEDB_pipline.process(self._mme(), pd.read_csv(csv_path))
+            self.assertGreater(int(expected["IEDB_human_positional_fully_contained"].sum()), 0)
+
+            ref = load_reference(csv_path)
+            self.assertIs(load_reference(csv_path), ref)                    # 同一個 process 不重讀
+            pd.testing.assert_frame_equal(IEDB_pipline.process(self._mme(), ref), expected)
+
+            IEDB_pipline._REF_CACHE.clear()                                 # 模擬重啟：改讀 .ref.npz
+            with mock.patch.object(IEDB_pipline.pd, "read_csv", side_effect=AssertionError("不該重讀 CSV")):
+                from_sidecar = load_reference(csv_path)
+            pd.testing.assert_frame_equal(IEDB_pipline.process(self._mme(), from_sidecar), expected)
+
+            csv_path.write_text(IEDB_CSV + "MKTAYIAKQRQISF,P00001,5,18\n")  # CSV 改了 → 重讀
+            self.assertEqual(len(load_reference(csv_path).names), 6)
+
+
+class IntervalCountTests(SimpleTestCase):
+    def test_matches_dense_matrix(self):
+        rng = np.random.default_rng(0)
+        for m, n in ((1, 1), (7, 40), (200, 150)):
+            S = rng.integers(0, 100, m).astype(float)
+            E = S + rng.integers(-3, 30, m)          # 含少數 S > E 的反向區間
+            s = rng.integers(0, 100, n).astype(float)
+            e = s + rng.integers(0, 20, n)
+            fully, part = interval_counts(S, E, s, e)
+            exp_fully, exp_part = IEDB_pipline._interval_counts_dense(S, E, s, e)
+            np.testing.assert_array_equal(fully, exp_fully)
+            np.testing.assert_array_equal(part, exp_part)
+
+
+class OverlapPairsTests(SimpleTestCase):
+    def test_matches_nested_loop(self):
+        rng = np.random.default_rng(1)
+        for n, m in ((0, 5), (12, 30), (80, 120)):
+            s = rng.integers(0, 100, n).astype(float)
+            e = s + rng.integers(0, 15, n)
+            S = rng.integers(0, 100, m).astype(float)
+            E = S + rng.integers(-2, 25, m)
+            s[::7] = np.nan                          # NaN 兩邊都要跳過
+            S[::5] = np.nan
+            expected = [(i, j) for i in range(n) for j in range(m)
+                        if not (np.isnan(s[i]) or np.isnan(e[i]) or np.isnan(S[j]) or np.isnan(E[j]))
+                        and s[i] <= E[j] and e[i] >= S[j]]
+            mi, pi = overlap_pairs(s, e, S, E)
+            self.assertEqual(list(zip(mi.tolist(), pi.tolist())), expected)
+
+
+class MultiKTests(SimpleTestCase):
+    def test_matches_single_k_runs(self):
+        ks = [2, 3, 5, 6, 13]
+        for backend in ("packed", "auto"):
+            multi = run_pipeline(io.StringIO(QUERY_FASTA), io.StringIO(HUMAN_FASTA), k=ks, backend=backend)
+            self.assertEqual(sorted(multi["k"].unique()), ks)
+            for k in ks:
+                single = run_pipeline(io.StringIO(QUERY_FASTA), io.StringIO(HUMAN_FASTA), k=k, backend="auto")
+                got = multi[multi["k"] == k].drop(columns="k").reset_index(drop=True)
+                self.assertEqual(got.to_csv(index=False), single.to_csv(index=False), msg=f"{backend} k={k}")
+
+    def test_parse_k_list(self):
+        self.assertEqual(parse_k_list("6"), [6])
+        self.assertEqual(parse_k_list("5-7, 9 9"), [5, 6, 7, 9])
+        for bad in ("", "x", "0", "9-5"):
+            with self.assertRaises(ValueError):
+                parse_k_list(bad)
+
+
+class FastaIndexTests(SimpleTestCase):
+    def test_fetch_matches_parse_fasta(self):
+        # 固定行寬、最後一行較短、CRLF、小寫、行寬不一致（退回整筆正規化）都要跟 parse_fasta 一樣
+        text = (">sp|P00001|H1_HUMAN one\nAAAAMKTAYI\nAKQRQISFVK\nSHF\n"
+                ">sp|P00002|H2_HUMAN two\r\nggggggggga\r\ncacacacaca\r\n\r\n"
+                ">irregular\nMKT\nAYIAKQRQ\nIS FV*\n")
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "human.fasta"
+            path.write_bytes(text.encode())
+            idx = get_fasta_index(path)
+            self.assertTrue((Path(d) / "human.fasta.fai").exists())
+            for name, seq in parse_fasta(path):
+                self.assertEqual(idx.fetch(name), seq, msg=name)
+                for a, b in ((0, 1), (3, 12), (9, 10), (10, 20), (5, 999)):
+                    self.assertEqual(idx.fetch(name, a, b), seq[a:b], msg=f"{name} [{a},{b})")
+            self.assertEqual(idx.fetch_accession("P00002"), "GGGGGGGGGACACACACACA")
+            self.assertIsNone(idx.fetch_accession("P99999"))
+            idx.close()
+
+
+class CompiledProteomeTests(SimpleTestCase):
+    def test_every_backend_accepts_compiled_proteome(self):
+        with tempfile.TemporaryDirectory() as d:
+            fasta = Path(d) / "human.fasta"
+            fasta.write_text(HUMAN_FASTA.lower())     # 小寫也要跟 parse_fasta 一樣被正規化
+            prot = compile_proteome(fasta)
+            for backend in ("auto", "packed", "ac", "sqlite", "pandas"):
+                expected = run_pipeline(io.StringIO(QUERY_FASTA), str(fasta), k=4, backend=backend)
+                got = run_pipeline(io.StringIO(QUERY_FASTA), str(prot), k=4, backend=backend)
+                self.assertFalse(got.empty)
+                self.assertEqual(got.to_csv(index=False), expected.to_csv(index=False), msg=backend)
+
+
+class SqliteRefDbTests(SimpleTestCase):
+    def test_persistent_reference_matches_throwaway_join(self):
+        with tempfile.TemporaryDirectory() as d:
+            fasta = Path(d) / "human.fasta"
+            fasta.write_text(HUMAN_FASTA)
+            for k in (3, 4, 13):
+                expected = run_pipeline(io.StringIO(QUERY_FASTA), io.StringIO(HUMAN_FASTA), k=k, backend="sqlite")
+                for _ in range(2):      # 第一次建表、第二次直接查
+                    got = run_pipeline(io.StringIO(QUERY_FASTA), str(fasta), k=k, backend="sqlite")
+                    self.assertEqual(got.to_csv(index=False), expected.to_csv(index=False), msg=f"k={k}")
+            self.assertTrue((Path(d) / "human.fasta.kmers.sqlite3").exists())
+
+    def test_keeps_at_most_max_ks(self):
+        with tempfile.TemporaryDirectory() as d, mock.patch.object(kmer_refdb, "MAX_REFDB_KS", 2):
+            fasta = Path(d) / "human.fasta"
+            fasta.write_text(HUMAN_FASTA)
+            for k in (3, 4, 5, 4):
+                run_pipeline(io.StringIO(QUERY_FASTA), str(fasta), k=k, backend="sqlite")
+            with closing(sqlite3.connect(Path(d) / "human.fasta.kmers.sqlite3")) as conn:
+                ks = [r[0] for r in conn.execute("SELECT DISTINCT k FROM human_kmers ORDER BY k")]
+            self.assertEqual(ks, [4, 5])
+
+
+class KmerIndexTests(SimpleTestCase):
+    def test_large_k_shares_k12_and_old_ks_are_evicted(self):
+        with tempfile.TemporaryDirectory() as d, mock.patch.object(kmer_index, "MAX_INDEX_KS", 2):
+            fasta = Path(d) / "human.fasta"
+            fasta.write_text(HUMAN_FASTA)
+            for k in (3, 13, 15, 4, 5):
+                expected = run_pipeline(io.StringIO(QUERY_FASTA), io.StringIO(HUMAN_FASTA), k=k, backend="packed")
+                got = run_pipeline(io.StringIO(QUERY_FASTA), str(fasta), k=k, backend="index")
+                self.assertEqual(got.to_csv(index=False), expected.to_csv(index=False), msg=f"k={k}")
+            idx = Path(d) / "human.fasta.kidx"
+            self.assertEqual(sorted(p.name for p in idx.glob("k*.codes.npy")), ["k4.codes.npy", "k5.codes.npy"])
+            self.assertEqual(json.loads((idx / "meta.json").read_text())["ks"], [4, 5])
+
+
+class ResultCacheTests(SimpleTestCase):
+    def _job_rows(self, db, job_ref):
+        rows, params = views._job_rows(jobs.get_job(job_ref))
+        with closing(sqlite3.connect(db)) as conn:
+            return [r[0] for r in conn.execute(f"SELECT mme_query {rows} ORDER BY rowid", params)]
+
+    def test_key_normalisation_and_lru_eviction(self):
+        with tempfile.TemporaryDirectory() as d, mock.patch.object(jobs, "DB_PATH", str(Path(d) / "db.sqlite3")):
+            human, iedb, db = Path(d) / "human.fasta", Path(d) / "iedb.csv", jobs.DB_PATH
+            human.write_text(HUMAN_FASTA)
+            iedb.write_text("x\n")
+            same = QUERY_FASTA.replace("\n", "\r\n").replace("MKTAYIAK", "mktayiak")
+            key = result_key(parse_fasta(io.StringIO(QUERY_FASTA)), 6, human, iedb)
+            self.assertEqual(key, result_key(parse_fasta(io.StringIO(same)), [6], human, iedb))
+            self.assertNotEqual(key, result_key(parse_fasta(io.StringIO(QUERY_FASTA)), 5, human, iedb))
+
+            df = pd.DataFrame({"mme_query": ["AAAA"], "query_protein_name": ["q1"]})
+            a, b = jobs.create_job({}), jobs.create_job({})
+            write_job_rows(df, a["job_id"], db_path=db)
+            write_job_rows(df, b["job_id"], db_path=db)
+            self.assertIsNone(cache_lookup(key, db))
+            cache_store(key, a["job_id"], 1, db_path=db)
+            self.assertEqual(cache_lookup(key, db), a["job_id"])
+            cache_store("other" + key, b["job_id"], 1, db_path=db, max_entries=1)   # 超過上限：最久沒用的被丟掉
+            self.assertIsNone(cache_lookup(key, db))
+            self.assertEqual(cache_lookup("other" + key, db), b["job_id"])
+            self.assertEqual(self._job_rows(db, a["job_id"]), ["AAAA"])             # 淘汰只刪登記，列還在
+
+    def test_hit_links_source_partition_and_rerun_keeps_linked_rows(self):
+        df = pd.DataFrame({"mme_query": ["AAAA", "CCCC"], "query_protein_name": ["q1", "q2"]})
+        with tempfile.TemporaryDirectory() as d, mock.patch.object(jobs, "DB_PATH", str(Path(d) / "db.sqlite3")):
+            db = jobs.DB_PATH
+            src, hit = jobs.create_job({}), jobs.create_job({})
+            cache_store("k1", src["job_id"], write_job_rows(df, src["job_id"], db_path=db), db_path=db)
+            with closing(sqlite3.connect(db)) as conn:
+                n_before = conn.execute("SELECT COUNT(*) FROM iedb_result").fetchone()[0]
+                tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+            self.assertFalse(any(t.startswith("rcache_") for t in tables))          # 沒有第二份
+            self.assertEqual(link_cached_result(src["job_id"], hit["job_id"], db_path=db), 2)
+            self.assertIsNone(link_cached_result("no-such-job", hit["job_id"], db_path=db))
+            self.assertEqual(self._job_rows(db, hit["short_id"]), ["AAAA", "CCCC"])
+
+            # 來源 job 重跑：掛在它上面的 job 留住原本的結果，快取登記作廢
+            write_job_rows(df.head(1).assign(mme_query="GGGG"), src["job_id"], db_path=db)
+            self.assertEqual(self._job_rows(db, src["short_id"]), ["GGGG"])
+            self.assertEqual(self._job_rows(db, hit["short_id"]), ["AAAA", "CCCC"])
+            self.assertIsNone(cache_lookup("k1", db))
+            with closing(sqlite3.connect(db)) as conn:
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM iedb_result").fetchone()[0], n_before + 1)
+
+
+class ProteinMemoTests(SimpleTestCase):
+    def test_incremental_resubmission_matches_full_run(self):
+        extra = ">q3 copy of q1\nMKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNLSGAEKAVQVKVKALPDAQ\n"
+        with tempfile.TemporaryDirectory() as d:
+            fasta, db = Path(d) / "human.fasta", str(Path(d) / "memo.sqlite3")
+            fasta.write_text(HUMAN_FASTA)
+            first = QUERY_FASTA.split(">q2")[0]
+            for k in (4, [3, 5]):
+                run_pipeline(io.StringIO(first), str(fasta), k=k, memo_db=db)
+                expected = run_pipeline(io.StringIO(QUERY_FASTA + extra), str(fasta), k=k)
+                got = run_pipeline(io.StringIO(QUERY_FASTA + extra), str(fasta), k=k, memo_db=db)
+                self.assertEqual(got.to_csv(index=False), expected.to_csv(index=False), msg=f"k={k}")
+                self.assertEqual((got.attrs["memo_fresh"], got.attrs["memo_cached"]), (1, 1))
+
+
+    def test_no_write_lock_held_during_scan(self):
+        with tempfile.TemporaryDirectory() as d:
+            fasta, db = Path(d) / "human.fasta", str(Path(d) / "memo.sqlite3")
+            fasta.write_text(HUMAN_FASTA)
+            with closing(sqlite3.connect(db)) as conn:
+                conn.executescript(protein_memo._DDL)
+                conn.execute("INSERT INTO protein_memo VALUES ('old-ref', 4, 'h', 0, NULL, NULL, 0)")
+                conn.commit()
+            real = protein_memo.run_pipeline
+
+            def scan(*args, **kwargs):
+                # 掃 human 的期間，別的連線要能馬上寫入（jobs / 背景 writer 共用同一顆 DB）
+                with closing(sqlite3.connect(db, timeout=0)) as other:
+                    other.execute("CREATE TABLE IF NOT EXISTS probe (x)")
+                    other.execute("INSERT INTO probe VALUES (1)")
+                    other.commit()
+                return real(*args, **kwargs)
+
+            with mock.patch.object(protein_memo, "run_pipeline", side_effect=scan):
+                got = run_pipeline(io.StringIO(QUERY_FASTA), str(fasta), k=4, memo_db=db)
+            expected = run_pipeline(io.StringIO(QUERY_FASTA), str(fasta), k=4)
+            self.assertEqual(got.to_csv(index=False), expected.to_csv(index=False))
+            with closing(sqlite3.connect(db)) as conn:
+                self.assertEqual(conn.execute("SELECT DISTINCT ref FROM protein_memo").fetchall(),
+                                 [(protein_memo.ref_key(str(fasta)),)])
+
+
+class JobPartitionTests(SimpleTestCase):
+    def test_rerun_replaces_rows_and_summary_is_job_scoped(self):
+        df = pd.DataFrame({
+            "mme_query": ["AAAA", "AAAA", "CCCC"], "query_protein_name": ["q1", "q2", "q1"],
+            "hit_human_protein_id": ["P1", "P1", "P2"], "iedb_human_epitope_substring_count": [1, 1, 0],
+        })
+        with tempfile.TemporaryDirectory() as d, closing(sqlite3.connect(Path(d) / "db.sqlite3")) as conn:
+            replace_job_rows(conn, "iedb_result", df, "job-a")
+            replace_job_rows(conn, "iedb_result", df, "job-a")       # 同一個 job 重跑：覆蓋而不是重複
+            replace_job_rows(conn, "iedb_result", df.head(1), "job-b")
+            counts = dict(conn.execute("SELECT job_id, COUNT(*) FROM iedb_result GROUP BY job_id"))
+            self.assertEqual(counts, {"job-a": 3, "job-b": 1})
+            plan = " ".join(r[-1] for r in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM iedb_result WHERE job_id = ?", ("job-a",)))
+            self.assertIn("USING INDEX", plan)
+
+            sql = job_summary_sql("query", 'FROM "iedb_result" WHERE job_id = ?')
+            got = conn.execute(sql + " ORDER BY query_protein_name", ("job-a",)).fetchall()
+            self.assertEqual(got, [("q1", 2, 2), ("q2", 1, 1)])
+
+    def test_rewritten_job_refreshes_summaries(self):
+        def rows(*epis):
+            return pd.DataFrame({"mme_query": list(epis), "query_protein_name": ["q1"] * len(epis),
+                                 "hit_human_protein_id": ["P1"] * len(epis),
+                                 "iedb_human_epitope_substring_count": [0] * len(epis),
+                                 "iedb_human_protein_data_count": [0] * len(epis),
+                                 "iedb_human_positional_fully_contained": [0] * len(epis),
+                                 "iedb_human_positional_partial_overlap": [0] * len(epis)})
+        with tempfile.TemporaryDirectory() as d, closing(sqlite3.connect(Path(d) / "db.sqlite3")) as conn:
+            replace_job_rows(conn, "iedb_result", rows("KKKK"), "job-b")
+            replace_job_rows(conn, "iedb_result", rows("AAAA", "CCCC"), "job-a")
+            refresh_summaries(conn, "iedb_result")
+            # 重跑 job-a：新列重用同樣的 rowid（不在水位線之上），舊的 AAAA / CCCC 也要消失
+            replace_job_rows(conn, "iedb_result", rows("GGGG", "TTTT"), "job-a")
+            refresh_summaries(conn, "iedb_result")
+            epis = [r[0] for r in conn.execute("SELECT Epitope FROM summary_by_epitope ORDER BY Epitope")]
+            self.assertEqual(epis, ["GGGG", "KKKK", "TTTT"])
+            self.assertEqual(conn.execute("SELECT * FROM summary_by_query").fetchall(), [("q1", 1, 1)])
+            ref = conn.execute("SELECT epitope_count FROM summary_by_reference WHERE hit_human_protein_id='P1'")
+            self.assertEqual(ref.fetchall(), [(3,)])
+
+
+class SummaryTableTests(SimpleTestCase):
+    def test_incremental_refresh_matches_full_aggregate(self):
+        rng = np.random.default_rng(2)
+
+        def batch(n):
+            return pd.DataFrame({
+                "mme_query": rng.choice(["AAAA", "CCCC", "GGGG", " TTTT", None], n),
+                "query_protein_name": rng.choice(["q1", "q2", "q3"], n),
+                "hit_human_protein_id": rng.choice(["P1", "P2", "P3", "P4"], n),
+                "iedb_human_epitope_substring_count": rng.integers(0, 3, n),
+                "iedb_human_protein_data_count": rng.integers(0, 3, n),
+                "iedb_human_positional_fully_contained": rng.integers(0, 2, n),
+                "iedb_human_positional_partial_overlap": rng.integers(0, 2, n),
+            })
+        with tempfile.TemporaryDirectory() as d, closing(sqlite3.connect(Path(d) / "db.sqlite3")) as conn:
+            for job in ("job-a", "job-b", "job-c"):
+                replace_job_rows(conn, "iedb_result", batch(25), job)
+                refresh_summaries(conn, "iedb_result")         # 每批之後只併入新列
+            for kind in ("epitope", "query", "reference"):
+                got = sorted(conn.execute(f"SELECT * FROM summary_by_{kind}"))
+                expected = sorted(conn.execute(job_summary_sql(kind, 'FROM "iedb_result"')))
+                self.assertTrue(got)
+                self.assertEqual(got, expected, msg=kind)
+
+    @staticmethod
+    def _rows(*epis):
+        return pd.DataFrame({"mme_query": list(epis), "query_protein_name": ["q1"] * len(epis),
+                             "hit_human_protein_id": ["P1"] * len(epis),
+                             "iedb_human_epitope_substring_count": [0] * len(epis),
+                             "iedb_human_protein_data_count": [0] * len(epis),
+                             "iedb_human_positional_fully_contained": [0] * len(epis),
+                             "iedb_human_positional_partial_overlap": [0] * len(epis)})
+
+    def test_dirty_key_marked_before_lock_is_not_lost(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = Path(d) / "db.sqlite3"
+            with closing(sqlite3.connect(db)) as conn:
+                replace_job_rows(conn, "iedb_result", self._rows("AAAA"), "job-a")
+                refresh_summaries(conn, "iedb_result")
+                with conn:
+                    mark_summary_dirty(conn, "iedb_result", "1")
+                    conn.execute("UPDATE iedb_result SET mme_query='CCCC'")
+                pending = summary_tables._pending
+
+                def mark_between(c, src):
+                    # 快速檢查之後、拿寫鎖之前，另一條連線記下改過之後的 key
+                    with closing(sqlite3.connect(db)) as other:
+                        with other:
+                            mark_summary_dirty(other, "iedb_result", "1")
+                    return pending(c, src)
+                with mock.patch.object(summary_tables, "_pending", mark_between):
+                    refresh_summaries(conn, "iedb_result")
+                epis = [r[0] for r in conn.execute("SELECT Epitope FROM summary_by_epitope")]
+                self.assertEqual(epis, ["CCCC"])
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM summary_dirty").fetchone()[0], 0)
+
+    def test_busy_refresh_serves_existing_summary(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = Path(d) / "db.sqlite3"
+            with closing(sqlite3.connect(db)) as conn:
+                replace_job_rows(conn, "iedb_result", self._rows("AAAA"), "job-a")
+                refresh_summaries(conn, "iedb_result")
+                replace_job_rows(conn, "iedb_result", self._rows("CCCC"), "job-b")
+            with closing(sqlite3.connect(db, isolation_level=None)) as writer, \
+                    closing(sqlite3.connect(db, timeout=0)) as reader:
+                writer.execute("BEGIN IMMEDIATE")
+                self.assertEqual(try_refresh_summaries(reader, "iedb_result"), 0)
+                epis = [r[0] for r in reader.execute("SELECT Epitope FROM summary_by_epitope")]
+                self.assertEqual(epis, ["AAAA"])
+                writer.execute("ROLLBACK")
+                self.assertGreater(try_refresh_summaries(reader, "iedb_result"), 0)
+                epis = [r[0] for r in reader.execute("SELECT Epitope FROM summary_by_epitope ORDER BY Epitope")]
+                self.assertEqual(epis, ["AAAA", "CCCC"])
+
+
+class ViewByEpitopeTests(SimpleTestCase):
+    def test_rebuild_then_append_dedups_across_jobs(self):
+        df = pd.DataFrame({"mme_query": ["AAAA", "CCCC"], "query_protein_name": ["q1", "q1"],
+                           "iedb_human_epitope_substring_count": [1, 0]})
+        with tempfile.TemporaryDirectory() as d:
+            db = str(Path(d) / "db.sqlite3")
+            with closing(sqlite3.connect(db)) as conn:
+                replace_job_rows(conn, "iedb_result", df, "job-a")
+            build_view_by_epitope(db)
+            # 另一個 job 算出同樣的列：增量路徑不能因為 job_id 不同而多出重複列
+            self.assertEqual(append_view_by_epitope(df.assign(job_id="job-b"), db), 0)
+            self.assertEqual(append_view_by_epitope(df.head(1).assign(mme_query="GGGG"), db), 1)
+            with closing(sqlite3.connect(db)) as conn:
+                cols = [r[1] for r in conn.execute("PRAGMA table_info(view_by_epitope)")]
+                n = conn.execute("SELECT COUNT(*) FROM view_by_epitope").fetchone()[0]
+            self.assertNotIn("job_id", cols)
+            self.assertEqual(n, 3)
+
+
+    def test_incremental_matches_full_rebuild(self):
+        def batch(epis, counts):
+            return pd.DataFrame({"mme_query": epis, "query_protein_name": ["q1"] * len(epis),
+                                 "mme_hit_start": [1.0] * len(epis),
+                                 "iedb_human_epitope_substring_count": counts})
+        first, second = batch(["AAAA", "CCCC"], [1, 0]), batch(["CCCC", "GGGG", "TTTT"], [0, None, 2])
+        with tempfile.TemporaryDirectory() as d:
+            db = str(Path(d) / "db.sqlite3")
+            with closing(sqlite3.connect(db)) as conn:
+                replace_job_rows(conn, "iedb_result", first, "job-a")
+            build_view_by_epitope(db)
+            with closing(sqlite3.connect(db)) as conn:
+                replace_job_rows(conn, "iedb_result", second, "job-b")
+            # 記憶體裡的 batch（float / NaN）與 DB 讀回的 int / NULL 要算出同一個 row_key
+            self.assertEqual(append_view_by_epitope(second, db), 2)
+            self.assertEqual(append_view_by_epitope(first, db), 0)
+            with closing(sqlite3.connect(db)) as conn:
+                incremental = sorted(conn.execute("SELECT * FROM view_by_epitope"))
+            build_view_by_epitope(db)
+            with closing(sqlite3.connect(db)) as conn:
+                self.assertEqual(sorted(conn.execute("SELECT * FROM view_by_epitope")), incremental)
+
+
+class BulkLoadTests(SimpleTestCase):
+    def test_matches_to_sql_and_rebuilds_deferred_indexes(self):
+        df = pd.DataFrame({
+            "name": ["a", None, "c"], "n": [1, 2, 3], "x": [0.5, float("nan"), 2.0], "flag": [True, False, True],
+        })
+        with closing(sqlite3.connect(":memory:")) as conn:
+            df.to_sql("ref", conn, index=False)
+            stats = bulk_insert(conn, "got", df, indexes={"ix_got_name": '"name"'})
+            self.assertEqual(stats["rows"], 3)
+            schema = {t: [r[1:3] for r in conn.execute(f"PRAGMA table_info({t})")] for t in ("got", "ref")}
+            self.assertEqual(schema["got"], schema["ref"])
+            self.assertEqual(conn.execute("SELECT * FROM got").fetchall(), conn.execute("SELECT * FROM ref").fetchall())
+
+            stats = bulk_insert(conn, "got", df, indexes={"ix_got_name": '"name"'}, defer_rows=1)
+            self.assertEqual(stats["deferred_indexes"], 1)       # 一批 ≥ 原有列數：先拆索引、寫完建回
+            self.assertEqual([r[1] for r in conn.execute("PRAGMA index_list(got)")], ["ix_got_name"])
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM got").fetchone()[0], 6)
+
+    def test_open_transaction_is_left_to_the_caller(self):
+        df = pd.DataFrame({"n": [1, 2]})
+        with closing(sqlite3.connect(":memory:")) as conn:
+            conn.execute("CREATE TABLE other (x INTEGER)")
+            conn.execute("INSERT INTO other VALUES (1)")          # 呼叫端的隱含交易
+            bulk_insert(conn, "got", df)
+            self.assertTrue(conn.in_transaction)
+            conn.rollback()                                       # 外層 rollback：兩邊一起撤回
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM other").fetchone()[0], 0)
+            self.assertEqual(conn.execute("SELECT name FROM sqlite_master WHERE name='got'").fetchall(), [])
+
+
+class UploadStreamTests(SimpleTestCase):
+    def test_plain_and_gzip_uploads_parse_the_same(self):
+        data = QUERY_FASTA.replace("\n", "\r\n").encode("utf-8") + b"\xff"   # CRLF + 壞掉的 UTF-8 byte
+        expected = list(parse_fasta(io.StringIO(QUERY_FASTA)))
+        for raw in (data, gzip.compress(data)):
+            up = SimpleUploadedFile("q.fasta", raw)
+            self.assertEqual(list(parse_fasta(open_upload_text(up))), expected)
+            self.assertEqual(list(parse_fasta(open_upload_text(up))), expected)    # 可以重開
+
+    def test_size_limits(self):
+        data = QUERY_FASTA.encode("utf-8")
+        with self.assertRaises(UploadTooLarge):
+            open_upload_text(SimpleUploadedFile("q.fasta", data), max_upload_bytes=len(data) - 1)
+        # gzip bomb：壓縮檔本身很小，解開後超過上限要在讀的時候擋下
+        bomb = gzip.compress(b">q\n" + b"A" * 100000)
+        text = open_upload_text(SimpleUploadedFile("q.fasta.gz", bomb),
+                                max_upload_bytes=len(bomb), max_text_bytes=50000)
+        with self.assertRaises(UploadTooLarge):
+            text.read()
+
+
+class ExportStreamTests(SimpleTestCase):
+    def _db(self, d):
+        db = str(Path(d) / "db.sqlite3")
+        with closing(sqlite3.connect(db)) as conn:
+            conn.execute("CREATE TABLE t (name TEXT, n INTEGER)")
+            conn.executemany("INSERT INTO t VALUES (?, ?)",
+                             [("人類,蛋白", 1), (None, 2), ('a"b', 3), ("x", None), ("y", 5)])
+            conn.commit()
+        return db
+
+    def test_iter_query_batches_and_csv(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = self._db(d)
+            columns, batches = iter_query(db, "SELECT * FROM t WHERE n IS NOT ? ORDER BY rowid", [99], chunk_size=2)
+            self.assertEqual(columns, ["name", "n"])
+            batches = list(batches)
+            self.assertEqual([len(b) for b in batches], [2, 2, 1])
+            text = b"".join(csv_chunks(columns, batches)).decode("utf-8")
+            got = pd.read_csv(io.StringIO(text), keep_default_na=False, dtype=str)
+            self.assertEqual(got.values.tolist(),
+                             [["人類,蛋白", "1"], ["", "2"], ['a"b', "3"], ["x", ""], ["y", "5"]])
+
+    def test_ndjson_and_gzip(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = self._db(d)
+            lines = b"".join(stream_export(db, "SELECT * FROM t", fmt="ndjson", chunk_size=2)).splitlines()
+            self.assertEqual(json.loads(lines[1]), {"name": None, "n": 2})
+            plain = b"".join(stream_export(db, "SELECT * FROM t", chunk_size=2))
+            self.assertEqual(gzip.decompress(b"".join(stream_export(db, "SELECT * FROM t", gzip=True))), plain)
+            self.assertEqual(gzip.decompress(b"".join(gzip_chunks(iter([b"ab", b"", b"cd"])))), b"abcd")
+            with self.assertRaises(ValueError):
+                stream_export(db, "SELECT * FROM t", fmt="xlsx")
+
+
+class StreamFrameTests(SimpleTestCase):
+    def test_matches_export_of_the_written_table(self):
+        # mme_form 直接回記憶體裡的結果：輸出要跟寫進 DB 再匯出的一樣
+        df = pd.DataFrame({"name": ["a", None, "c"], "n": [1, 2, 3], "x": [0.5, float("nan"), 2.0]})
+        with tempfile.TemporaryDirectory() as d:
+            db = str(Path(d) / "db.sqlite3")
+            with closing(sqlite3.connect(db)) as conn:
+                bulk_insert(conn, "t", df)
+            for fmt in ("csv", "ndjson"):
+                self.assertEqual(b"".join(stream_frame(df, fmt, chunk_size=2)),
+                                 b"".join(stream_export(db, 'SELECT * FROM "t"', fmt=fmt, chunk_size=2)))
+
+
+class JobQueueTests(SimpleTestCase):
+    def test_claim_is_fifo_and_update_is_visible(self):
+        with tempfile.TemporaryDirectory() as d, mock.patch.object(jobs, "DB_PATH", str(Path(d) / "db.sqlite3")):
+            a = jobs.enqueue_job({"k": 5}, ">a\nAAAA\n")
+            b = jobs.enqueue_job({"k": 6}, ">b\nCCCC\n")
+            first, second = jobs.claim_next_job("w1"), jobs.claim_next_job("w2")
+            self.assertEqual((first["job_id"], first["params"], first["query_fasta"]),
+                             (a["job_id"], {"k": 5}, ">a\nAAAA\n"))
+            self.assertEqual(second["job_id"], b["job_id"])
+            self.assertIsNone(jobs.claim_next_job("w3"))     # 已經被拿走的不會再被 claim
+
+            jobs.update_job(a["job_id"], progress=60, message="IEDB")
+            got = jobs.get_job(a["short_id"])
+            self.assertEqual((got["status"], got["progress"], got["message"]), ("running", 60, "IEDB"))
+            with self.assertRaises(ValueError):
+                jobs.update_job(a["job_id"], params_json="{}")
+
+            jobs.enqueue_job({"k": 7}, ">a\nGGGG\n", job_ref=a["short_id"])   # 同一個 job 重新送出
+            again = jobs.claim_next_job("w1")
+            self.assertEqual((again["job_id"], again["params"]), (a["job_id"], {"k": 7}))
+
+
+class InlineJobTests(SimpleTestCase):
+    def test_result_write_retries_then_fails_the_job(self):
+        with tempfile.TemporaryDirectory() as d, mock.patch.object(jobs, "DB_PATH", str(Path(d) / "db.sqlite3")), \
+                mock.patch.object(views, "DB_WRITE_RETRIES", 1), mock.patch.object(views.time, "sleep"):
+            job = jobs.start_inline_job({"k": 5}, worker=jobs.worker_name("web"))
+            self.assertEqual(jobs.get_job(job["short_id"])["status"], "running")
+            locked = sqlite3.OperationalError("database is locked")
+            with mock.patch.object(views, "write_job_rows", side_effect=[locked, 0]), \
+                    mock.patch.object(views, "append_view_by_epitope"), mock.patch.object(views, "refresh_summaries_at"):
+                views._persist_enriched(pd.DataFrame(), job["job_id"], None, [5])
+            self.assertEqual(jobs.get_job(job["job_id"])["status"], "done")      # 第二次成功
+
+            job = jobs.start_inline_job({"k": 5}, worker=jobs.worker_name("web"))
+            with mock.patch.object(views, "write_job_rows", side_effect=locked):
+                views._persist_enriched(pd.DataFrame(), job["job_id"], None, [5])
+            got = jobs.get_job(job["job_id"])
+            self.assertEqual((got["status"], got["message"]), ("failed", "寫入結果失敗：database is locked"))
+
+    def test_requeue_running_only_touches_dead_owners(self):
+        proc = subprocess.Popen([sys.executable, "-c", "pass"])
+        proc.wait()
+        dead = f"{socket.gethostname()}:{proc.pid}"         # 本機、已經結束的 pid
+        with tempfile.TemporaryDirectory() as d, mock.patch.object(jobs, "DB_PATH", str(Path(d) / "db.sqlite3")):
+            live_web = jobs.start_inline_job({"k": 5}, worker=jobs.worker_name("web"))
+            dead_web = jobs.start_inline_job({"k": 5}, worker=f"web:{dead}")
+            claimed = {}
+            for fasta, worker in ((">a\nAAAA\n", dead), (">b\nCCCC\n", "other-host:1"),
+                                  (">c\nGGGG\n", jobs.worker_name())):
+                jobs.enqueue_job({"k": 5}, fasta)
+                claimed[worker] = jobs.claim_next_job(worker)["job_id"]
+
+            self.assertEqual(jobs.requeue_running(), 1)
+            self.assertEqual(jobs.get_job(live_web["job_id"])["status"], "running")
+            self.assertEqual(jobs.get_job(dead_web["job_id"])["status"], "failed")      # 同步 job 沒有輸入可重跑
+            self.assertEqual(jobs.get_job(claimed["other-host:1"])["status"], "running")  # heartbeat 還新
+            self.assertEqual(jobs.get_job(claimed[jobs.worker_name()])["status"], "running")
+            self.assertEqual(jobs.claim_next_job("w")["job_id"], claimed[dead])
+
+            with mock.patch.object(jobs, "JOB_LEASE_SEC", -1):                      # lease 過期
+                self.assertEqual(jobs.requeue_running(), 2)   # 別台的與 "w"（查不到 pid）都只看 lease
+
+    def test_finished_job_drops_its_inputs(self):
+        with tempfile.TemporaryDirectory() as d, mock.patch.object(jobs, "DB_PATH", str(Path(d) / "db.sqlite3")):
+            job = jobs.enqueue_job({"k": 5}, ">a\nAAAA\n")
+            jobs.claim_next_job("w")
+            jobs.update_job(job["job_id"], status="done", progress=1.0)
+            with closing(sqlite3.connect(jobs.DB_PATH)) as conn:
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM job_inputs").fetchone()[0], 0)
+
+
+class DataTablesTests(SimpleTestCase):
+    def _conn(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE t (name TEXT, n INTEGER)")
+        conn.executemany("INSERT INTO t VALUES (?, ?)",
+                         [("AAA", 3), ("aab", 1), ("C_C", 2), ("CxC", 5), ("DDD", 4)])
+        return conn
+
+    def test_paging_order_and_search(self):
+        params = {"draw": "7", "start": "1", "length": "2",
+                  "columns[0][data]": "0", "columns[1][data]": "1",
+                  "order[0][column]": "1", "order[0][dir]": "desc"}
+        self.assertTrue(is_datatables_request(params))
+        with closing(self._conn()) as conn:
+            got = datatables_query(conn, "t", None, params)
+            self.assertEqual((got["draw"], got["recordsTotal"], got["recordsFiltered"]), (7, 5, 5))
+            self.assertEqual((got["columns"], got["data"]), (["name", "n"], [["DDD", 4], ["AAA", 3]]))
+
+            # 全域搜尋：_ 是字面字元，不是 LIKE 萬用字元
+            got = datatables_query(conn, "t", None, {**params, "start": "0", "search[value]": "c_c"})
+            self.assertEqual((got["recordsFiltered"], got["data"]), (1, [["C_C", 2]]))
+
+            # 前端精準多關鍵字 regex → IN（不分大小寫）
+            got = datatables_query(conn, "t", None, {**params, "start": "0", "length": "-1",
+                                                     "columns[0][search][value]": "^(?:aaa|AAB)$",
+                                                     "columns[0][search][regex]": "true"})
+            self.assertEqual(got["data"], [["AAA", 3], ["aab", 1]])
+
+    def test_order_column_is_whitelisted_and_length_capped(self):
+        params = {"draw": "1", "length": "100000", "columns[0][data]": "name; DROP TABLE t",
+                  "order[0][column]": "0", "order[0][dir]": "asc"}
+        with closing(self._conn()) as conn:
+            got = datatables_query(conn, "t", None, params)
+            self.assertEqual([r[0] for r in got["data"]], ["AAA", "C_C", "CxC", "DDD", "aab"])   # 退回第一欄排序
+            with mock.patch.object(datatables, "MAX_PAGE_LENGTH", 2):
+                self.assertEqual(len(datatables_query(conn, "t", None, params)["data"]), 2)
+        self.assertFalse(is_datatables_request({"limit": "10"}))
+
+
+class ExportViewTests(SimpleTestCase):
+    def test_view_query_exports_whole_summary(self):
+        df = pd.DataFrame({
+            "mme_query": [f"E{i:03d}" for i in range(30)], "query_protein_name": [f"q{i % 15}" for i in range(30)],
+            "hit_human_protein_id": ["P1"] * 30, "iedb_human_epitope_substring_count": [0] * 30,
+            "iedb_human_protein_data_count": [0] * 30, "iedb_human_positional_fully_contained": [0] * 30,
+            "iedb_human_positional_partial_overlap": [0] * 30,
+        })
+        with tempfile.TemporaryDirectory() as d:
+            db = str(Path(d) / "db.sqlite3")
+            with closing(sqlite3.connect(db)) as conn:
+                replace_job_rows(conn, "iedb_result", df, "job-a")
+            with mock.patch.object(views, "DB_PATH", db):
+                resp = views.export_results(RequestFactory().get("/api/export/", {"view": "query"}))
+                self.assertEqual(resp.status_code, 200)
+                lines = b"".join(resp.streaming_content).decode("utf-8").splitlines()
+                self.assertEqual(len(lines), 1 + 15)        # 表頭 + 全部 15 個 query，不是只有一頁
+                resp = views.export_results(RequestFactory().get("/api/export/", {"view": "query", "q": "q3"}))
+                self.assertEqual(b"".join(resp.streaming_content).decode("utf-8").splitlines()[1:], ["q3,1,1"])
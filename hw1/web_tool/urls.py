@@ -5,7 +5,8 @@ from .views import (
     View_by_Reference, View_by_Reference_data,
     View_by_Eptiope, View_by_Epitope_data,
     View_by_Query, View_by_Query_data,
-    iedb_from_sqlite, api_create_job,
+    iedb_from_sqlite, export_results, api_create_job,
+    api_job_status, api_job_result,
     job_id_search,view_by_ref_detail
 )
 
@@ -27,8 +28,11 @@ urlpatterns = [
     path("View_by_Query/data/", View_by_Query_data, name="View_by_Query_data"),
 
     path("api/iedb_from_sqlite/", iedb_from_sqlite, name="iedb_from_sqlite"),
+    path("api/export/", export_results, name="export_results"),
 
     path("api/jobs/create/", api_create_job, name="api_create_job"),
+    path("api/jobs/<str:job_ref>/status/", api_job_status, name="api_job_status"),
+    path("api/jobs/<str:job_ref>/result/", api_job_result, name="api_job_result"),
 
     path("View_by_Reference/detail/", view_by_ref_detail, name="view_by_ref_detail"),
 ]
\ No newline at end of file
@@ -6,6 +6,8 @@ import re
 import pandas as pd
 import numpy as np
 
+from .bulk_load import bulk_insert
+
 # ====== 常數：資料庫與檔案路徑 ======
 DB_PATH   = r"C:\Users\ethan\Desktop\碩班\暑假\web_hw\web_hw\hw1\hw1\db.sqlite3"
 SRC_TABLE = "mme_result"
@@ -37,43 +39,287 @@ def _normalize_uniprot(series: pd.Series) -> pd.Series:
     core = core.where(core.notna() & (core != ""), s)
     return core.str.strip()
 
-def _count_epitope_contains(iedb_names: pd.Series, epitopes: np.ndarray) -> dict[str, int]:
+def _suffix_array(text: np.ndarray) -> np.ndarray:
+    """prefix doubling（全 NumPy）：O(n log² n)，不需要額外套件"""
+    n = text.size
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    rank = text.astype(np.int64)
+    h = 1
+    while True:
+        nxt = np.full(n, -1, dtype=np.int64)
+        nxt[:n - h] = rank[h:]
+        sa = np.lexsort((nxt, rank))
+        r1, r2 = rank[sa], nxt[sa]
+        step = np.empty(n, dtype=bool)
+        step[0] = True
+        step[1:] = (r1[1:] != r1[:-1]) | (r2[1:] != r2[:-1])
+        new_rank = np.cumsum(step) - 1
+        rank = np.empty(n, dtype=np.int64)
+        rank[sa] = new_rank
+        if new_rank[-1] == n - 1:
+            return sa
+        h *= 2
+
+
+class NameSubstringIndex:
+    """
+    IEDB Name 的 suffix array（固定那一側，建一次重複用）。
+    所有 Name 以 NUL 位元組串接；某 epitope 出現在幾列 Name
+    = suffix array 上以它為前綴的區間裡，不重複的列號數。
+    每個 epitope 先用 O(|epitope| log n) 的二分搜尋找到區間 [lo, hi)。
+    prev[i] 是 suffix array 上前一個屬於同一列的位置（沒有則 -1），
+    區間內不重複的列數 = #{i in [lo, hi): prev[i] < lo}，一次向量比較就算完、不用排序。
+    最壞情況（很短、到處都出現的 epitope）仍是 O(出現次數)；
+    要做到 O(log n) 得存 O(n log n) 的結構，以 IEDB 的 Name 總長不划算。
+    """
+    SEP = 0
+
+    def __init__(self, text: np.ndarray, sa: np.ndarray):
+        self.text = np.ascontiguousarray(text, dtype=np.uint8)
+        self.sa = np.asarray(sa, dtype=np.int64)
+        self._bytes = self.text.tobytes()
+        # 每個字元屬於第幾列 Name（分隔字元算前一列，反正 epitope 不會含 '\x00'）
+        is_sep = self.text == self.SEP
+        self.row_of = (np.cumsum(is_sep) - is_sep).astype(np.int64)
+        self.prev = self._prev_same_row()
+
+    def _prev_same_row(self) -> np.ndarray:
+        rows = self.row_of[self.sa]
+        order = np.argsort(rows, kind="stable")    # 同一列內依 suffix array 位置遞增
+        dtype = np.int32 if self.sa.size < 2 ** 31 else np.int64
+        prev = np.full(self.sa.size, -1, dtype=dtype)
+        same = rows[order[1:]] == rows[order[:-1]]
+        prev[order[1:][same]] = order[:-1][same]
+        return prev
+
+    @classmethod
+    def build(cls, names: pd.Series) -> "NameSubstringIndex":
+        buf = b"".join(str(x).encode("utf-8") + b"\x00" for x in names)
+        text = np.frombuffer(buf, dtype=np.uint8)
+        return cls(text, _suffix_array(text))
+
+    def _bound(self, pat: bytes, upper: bool) -> int:
+        t, sa, m = self._bytes, self.sa, len(pat)
+        lo, hi = 0, sa.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            p = int(sa[mid])
+            cur = t[p:p + m]
+            if cur < pat or (upper and cur == pat):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def count(self, epitope: str) -> int:
+        """有幾列 Name 包含 epitope（同一列出現多次只算一次）"""
+        if not epitope:
+            return 0
+        pat = epitope.encode("utf-8")
+        lo, hi = self._bound(pat, False), self._bound(pat, True)
+        if hi <= lo:
+            return 0
+        return int(np.count_nonzero(self.prev[lo:hi] < lo))
+
+    def count_many(self, epitopes) -> dict[str, int]:
+        return {epi: self.count(epi) for epi in epitopes}
+
+
+# ---------- 區間計數：fully contained / partial overlap ----------
+def _interval_counts_dense(S: np.ndarray, E: np.ndarray, s: np.ndarray, e: np.ndarray):
+    """原本的廣播版（len(S) × len(s) 布林矩陣）；留著給 benchmark / 對照"""
+    fully_mat   = (S[:, None] <= s[None, :]) & (E[:, None] >= e[None, :])
+    overlap_mat = ~((E[:, None] < s[None, :]) | (S[:, None] > e[None, :]))
+    return fully_mat.sum(axis=0, dtype=np.int32), overlap_mat.sum(axis=0, dtype=np.int32)
+
+def _count_dominating(S: np.ndarray, E: np.ndarray, s: np.ndarray, e: np.ndarray) -> np.ndarray:
+    """
+    每個 (s, e) 有幾個 IEDB 區間滿足 S <= s 且 E >= e。
+    依 S 排序後，「S <= s」是一段前綴 [0, p)；前綴拆成 log m 個對齊區塊，
+    每層區塊內 E 先排好（merge-sort tree），整批 query 用 searchsorted 一次算完。
+    時間 O((n + m) log m)，記憶體 O(m log m)，不需要 m × n 矩陣。
+    """
+    m = S.size
+    order = np.argsort(S, kind="stable")
+    Ss, Es = S[order], E[order]
+    p = np.searchsorted(Ss, s, side="right").astype(np.int64)
+    below = np.zeros(s.size, dtype=np.int64)      # 前綴裡 E < e 的個數
+
+    base = min(Es.min(), e.min())
+    W = float(max(Es.max(), e.max()) - base + 2)   # 區塊之間的間距，確保不同區塊的 key 不交錯
+    pos = np.arange(m, dtype=np.int64)
+    j = 0
+    while (1 << j) <= m:
+        bs = 1 << j
+        keys = np.sort((pos // bs) * W + (Es - base))
+        sel = np.flatnonzero(p & bs)
+        if sel.size:
+            b = (p[sel] >> (j + 1)) << 1          # 前綴裡這一層的區塊編號
+            below[sel] += np.searchsorted(keys, b * W + (e[sel] - base), side="left") - b * bs
+        j += 1
+    return p - below
+
+def interval_counts(S: np.ndarray, E: np.ndarray, s: np.ndarray, e: np.ndarray):
+    """
+    sort-and-sweep 版的 fully / partial 計數，結果與 _interval_counts_dense 相同：
+      fully   = #(S <= s 且 E >= e)
+      partial = #(not (E < s or S > e)) = m - #(E < s) - #(S > e) + #(E < s 且 S > e)
+    最後一項只有 S > E 的反向區間才可能成立，那一小撮另外直接算。
+    """
+    m = S.size
+    if m == 0 or s.size == 0:
+        z = np.zeros(s.size, dtype=np.int32)
+        return z, z.copy()
+
+    fully = _count_dominating(S, E, s, e)
+
+    e_lt_s = np.searchsorted(np.sort(E), s, side="left")
+    s_gt_e = m - np.searchsorted(np.sort(S), e, side="right")
+    part = m - e_lt_s - s_gt_e
+    inv = S > E
+    if inv.any():
+        Si, Ei = S[inv], E[inv]
+        part += ((Ei[:, None] < s[None, :]) & (Si[:, None] > e[None, :])).sum(axis=0)
+    return fully.astype(np.int32), part.astype(np.int32)
+
+
+def overlap_pairs(s: np.ndarray, e: np.ndarray, S: np.ndarray, E: np.ndarray):
+    """
+    列出所有重疊的 (MME, IEDB) 配對：s <= E 且 e >= S（NaN 一律跳過）。
+    IEDB 依 S 排序；每個 MME 只看 S 落在 [s - 最長 IEDB 區間, e] 的候選，
+    所以成本跟結果數同階，不再是 n × m。
+    回傳 (mme_idx, iedb_idx)，依 (mme_idx, iedb_idx) 排序（與雙層迴圈的順序相同）。
+    """
+    s = np.asarray(s, dtype=float); e = np.asarray(e, dtype=float)
+    S = np.asarray(S, dtype=float); E = np.asarray(E, dtype=float)
+    qi = np.flatnonzero(~(np.isnan(s) | np.isnan(e)))
+    ri = np.flatnonzero(~(np.isnan(S) | np.isnan(E)))
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+    if qi.size == 0 or ri.size == 0:
+        return empty
+
+    order = ri[np.argsort(S[ri], kind="stable")]
+    Ss, Es = S[order], E[order]
+    span = float(np.max(Es - Ss))
+    lo = np.searchsorted(Ss, s[qi] - span, side="left")
+    hi = np.searchsorted(Ss, e[qi], side="right")
+    cnt = np.clip(hi - lo, 0, None)
+    total = int(cnt.sum())
+    if total == 0:
+        return empty
+
+    q_rep = np.repeat(qi, cnt)
+    slot = np.repeat(lo - (np.cumsum(cnt) - cnt), cnt) + np.arange(total, dtype=np.int64)
+    keep = Es[slot] >= s[q_rep]
+    mme_idx, iedb_idx = q_rep[keep], order[slot[keep]]
+    o = np.lexsort((iedb_idx, mme_idx))
+    return mme_idx[o], iedb_idx[o]
+
+
+# ---------- IEDB 參考資料快取 ----------
+class IEDBReference:
     """
-    回傳 {epitope: IEDB Name 欄位中包含它的列數}
-    若環境有 pyahocorasick 就用 Aho-Corasick，否則退回逐一 contains。
+    IEDB CSV 中跟使用者 MME 無關、可重複使用的部分：
+      names      IEDB Name（字串）
+      uid_core   正規化後的 UniProt（_normalize_uniprot）
+      uid_counts 每個 UniProt 的列數（value_counts）
+      groups     {UniProt: (Starting, Ending)}，已剔除 NaN
+      name_index Name 的 suffix array（epitope substring 計數用）
     """
+    def __init__(self, names: pd.Series, uid_core: pd.Series, starts: np.ndarray, ends: np.ndarray,
+                 name_index: NameSubstringIndex | None = None):
+        self.names = names
+        self.uid_core = uid_core
+        self.starts = starts
+        self.ends = ends
+        self.uid_counts = uid_core.value_counts()
+        self.groups = self._build_groups()
+        self.name_index = name_index if name_index is not None else NameSubstringIndex.build(names)
+
+    def _build_groups(self) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+        groups: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        for uid, grp_idx in self.uid_core.groupby(self.uid_core, sort=False).indices.items():
+            S = self.starts[grp_idx]
+            E = self.ends[grp_idx]
+            mask = ~np.isnan(S) & ~np.isnan(E)
+            groups[str(uid)] = (S[mask], E[mask])
+        return groups
+
+    @classmethod
+    def from_frame(cls, iedb_df: pd.DataFrame) -> "IEDBReference":
+        return cls(
+            names=iedb_df[COL_NAME].astype(str).reset_index(drop=True),
+            uid_core=_normalize_uniprot(iedb_df[COL_UID]).reset_index(drop=True),
+            starts=pd.to_numeric(iedb_df[COL_S], errors="coerce").to_numpy(dtype=float),
+            ends=pd.to_numeric(iedb_df[COL_E], errors="coerce").to_numpy(dtype=float),
+        )
+
+
+_REF_CACHE: dict[str, tuple[tuple[int, int], IEDBReference]] = {}
+
+def _sidecar_path(csv_path: Path) -> Path:
+    return csv_path.with_name(csv_path.name + ".ref.npz")
+
+def _load_sidecar(path: Path, fp: tuple[int, int]) -> IEDBReference | None:
     try:
-        import ahocorasick  # pip install pyahocorasick
-        A = ahocorasick.Automaton()
-        for idx, pat in enumerate(epitopes):
-            if pat:
-                A.add_word(pat, (idx, pat))
-        A.make_automaton()
-
-        counts = np.zeros(len(epitopes), dtype=np.int64)
-        for name in iedb_names.astype(str):
-            if not name:
-                continue
-            hit_once = set()
-            for _, (idx, _pat) in A.iter(name):
-                hit_once.add(idx)
-            if hit_once:
-                idxs = np.fromiter(hit_once, dtype=np.int64)
-                counts[idxs] += 1
-        return {epi: int(c) for epi, c in zip(epitopes, counts)}
+        with np.load(path, allow_pickle=False) as z:
+            if tuple(int(x) for x in z["fingerprint"]) != fp:
+                return None
+            return IEDBReference(
+                names=pd.Series(z["names"].astype(object)),
+                uid_core=pd.Series(z["uid_core"].astype(object)),
+                starts=z["starts"], ends=z["ends"],
+                name_index=NameSubstringIndex(z["name_text"], z["name_sa"]),
+            )
     except Exception:
-        names = iedb_names.astype(str)
-        out: dict[str, int] = {}
-        for epi in epitopes:
-            out[epi] = int(names.str.contains(epi, regex=False).sum()) if epi else 0
-        return out
+        return None
+
+def _save_sidecar(path: Path, fp: tuple[int, int], ref: IEDBReference) -> None:
+    tmp = path.with_name(path.name + ".tmp.npz")
+    np.savez(
+        tmp,
+        fingerprint=np.asarray(fp, dtype=np.int64),
+        names=ref.names.to_numpy(dtype=str),
+        uid_core=ref.uid_core.to_numpy(dtype=str),
+        starts=ref.starts, ends=ref.ends,
+        name_text=ref.name_index.text, name_sa=ref.name_index.sa,
+    )
+    tmp.replace(path)
+
+def load_reference(iedb_csv: str | Path = IEDB_CSV, persist: bool = True) -> IEDBReference:
+    """
+    取得 IEDB 參考資料（process 內快取，CSV 的 mtime / size 變了才重讀）。
+    persist=True 時另外存一份 .ref.npz 在 CSV 旁邊，重啟後不必再 parse CSV。
+    """
+    path = Path(iedb_csv)
+    st = path.stat()
+    fp = (int(st.st_size), int(st.st_mtime_ns))
+    key = str(path.resolve())
+
+    cached = _REF_CACHE.get(key)
+    if cached is not None and cached[0] == fp:
+        return cached[1]
+
+    sidecar = _sidecar_path(path)
+    ref = _load_sidecar(sidecar, fp) if persist and sidecar.exists() else None
+    if ref is None:
+        ref = IEDBReference.from_frame(pd.read_csv(path, encoding="utf-8-sig"))
+        if persist:
+            try:
+                _save_sidecar(sidecar, fp, ref)
+            except OSError as e:
+                print(f"⚠️ 寫入 IEDB sidecar 失敗：{e}", flush=True)
+
+    _REF_CACHE[key] = (fp, ref)
+    return ref
 
 
 # ---------- IEDB 核心運算 ----------
-def process(match_df: pd.DataFrame, iedb_df: pd.DataFrame) -> pd.DataFrame:
+def process(match_df: pd.DataFrame, iedb_df: pd.DataFrame | IEDBReference) -> pd.DataFrame:
     """
     傳入：MME 結果 DataFrame（含 MME(query)、MME(hit)_start/_end、hit_human_protein_name 等）
-          與 IEDB CSV 的 DataFrame
+          與 IEDB CSV 的 DataFrame（或 load_reference() 快取好的 IEDBReference）
     回傳：在 match_df 上加入 4 個 IEDB 指標欄位
     """
     # (1) 正規化 MME 欄位
@@ -86,30 +332,21 @@ def process(match_df: pd.DataFrame, iedb_df: pd.DataFrame) -> pd.DataFrame:
     match_df[COL_HIT_ID] = match_df[COL_HIT_ID].astype(str).str.strip()
     match_df[COL_QNAME]  = match_df[COL_QNAME].astype(str).str.strip()
 
-    # (2) IEDB 清理
-    iedb_df = iedb_df.copy()
-    iedb_df["_UID_CORE"] = _normalize_uniprot(iedb_df[COL_UID])
-    iedb_names = iedb_df[COL_NAME].astype(str)
+    # (2) IEDB 清理（已快取的 IEDBReference 直接用）
+    ref = iedb_df if isinstance(iedb_df, IEDBReference) else IEDBReference.from_frame(iedb_df)
 
     # (3) epitope substring 計數
     unique_epi = pd.Index(match_df[COL_EPI].unique())
-    epi2cnt = _count_epitope_contains(iedb_names, unique_epi.values)
+    epi2cnt = ref.name_index.count_many(unique_epi.values)
     match_df[COL_SUBSTR] = match_df[COL_EPI].map(epi2cnt).fillna(0).astype(int)
 
     # (4) human_protein_data_count（依 UniProt 匹配）
-    uid_counts = iedb_df["_UID_CORE"].value_counts()
+    uid_counts = ref.uid_counts
     match_df["_HIT_CORE"] = _normalize_uniprot(match_df[COL_HIT_ID])
     match_df[COL_DATAC] = match_df["_HIT_CORE"].map(uid_counts).fillna(0).astype(int)
 
-    # (5) fully / partial overlap（以座標廣播）
-    iedb_groups: dict[str, tuple[np.ndarray, np.ndarray]] = {}
-    ss_all = pd.to_numeric(iedb_df[COL_S], errors="coerce")
-    ee_all = pd.to_numeric(iedb_df[COL_E], errors="coerce")
-    for uid, grp_idx in iedb_df.groupby("_UID_CORE", sort=False).groups.items():
-        S = ss_all.iloc[grp_idx].to_numpy(dtype=float, copy=False)
-        E = ee_all.iloc[grp_idx].to_numpy(dtype=float, copy=False)
-        mask = ~np.isnan(S) & ~np.isnan(E)
-        iedb_groups[str(uid)] = (S[mask], E[mask])
+    # (5) fully / partial overlap（排序 + searchsorted，不建 m × n 矩陣）
+    iedb_groups = ref.groups
 
     s_all = pd.to_numeric(match_df["MME(hit)_start"], errors="coerce").to_numpy(dtype=float, copy=False)
     e_all = pd.to_numeric(match_df["MME(hit)_end"],   errors="coerce").to_numpy(dtype=float, copy=False)
@@ -131,11 +368,7 @@ def process(match_df: pd.DataFrame, iedb_df: pd.DataFrame) -> pd.DataFrame:
         if S is None or S.size == 0:
             continue
 
-        fully_mat   = (S[:, None] <= s[None, :]) & (E[:, None] >= e[None, :])
-        overlap_mat = ~((E[:, None] < s[None, :]) | (S[:, None] > e[None, :]))
-
-        fully[tgt_idx] = fully_mat.sum(axis=0, dtype=np.int32)
-        part[tgt_idx]  = overlap_mat.sum(axis=0, dtype=np.int32)
+        fully[tgt_idx], part[tgt_idx] = interval_counts(S, E, s, e)
 
     match_df[COL_FULLY] = fully
     match_df[COL_PART]  = part
@@ -185,9 +418,9 @@ def save_iedb_back_to_sqlite(df: pd.DataFrame, db_path: str = DB_PATH, table: st
 
     conn = sqlite3.connect(db_path)
     try:
-        with conn:
-            sdf.to_sql(table, conn, if_exists="append", index=False)
-            total = pd.read_sql(f'SELECT COUNT(*) AS cnt FROM "{table}"', conn)["cnt"][0]
+        # 一個交易 + executemany（新欄位自動 ALTER TABLE 補上），見 bulk_load
+        bulk_insert(conn, table, sdf)
+        total = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
     finally:
         conn.close()
 
@@ -204,8 +437,7 @@ def run_iedb_from_sqlite(
     limit: int | None = None,
 ) -> pd.DataFrame:
     match_df = load_mme_for_iedb(db_path=db_path, table=src_table, limit=limit)
-    iedb_df  = pd.read_csv(iedb_csv, encoding="utf-8-sig")
-    enriched = process(match_df, iedb_df)
+    enriched = process(match_df, load_reference(iedb_csv))
     save_iedb_back_to_sqlite(enriched, db_path=db_path, table=dst_table)
     return enriched
 
@@ -4,10 +4,56 @@ import sqlite3
 from pathlib import Path
 import pandas as pd
 
+from .bulk_load import bulk_insert
+
 # === 你的 SQLite 設定（照你提供）===
 DB_PATH        = r"C:\Users\ethan\Desktop\碩班\暑假\web_hw\web_hw\hw1\hw1\iedb_result.sqlite3"
 TABLE_ENR      = "iedb_result"      # 來源：IEDB enriched 後的表
 VIEW_EPI_TABLE = "view_by_epitope"  # 目的地：要給頁面讀的表
+KEY_COL        = "row_key"          # 整列內容的 hash，配 UNIQUE INDEX 做去重
+# 來源表的分區欄不進 view：不同 job 的同一列要被 row_key 去重成一列
+EXCLUDE_COLS   = ("job_id",)
+
+# 常用欄位排前面（注意：DB 內通常已經是 snake_case）
+PREFER_COLS = [
+    "query_protein_name",
+    "mme_query", "mme_query_start", "mme_query_end",
+    "hit_human_protein_id", "hit_human_protein_name",
+    "mme_hit_start", "mme_hit_end",
+    "iedb_human_epitope_substring_count",
+    "iedb_human_protein_data_count",
+    "iedb_human_positional_fully_contained",
+    "iedb_human_positional_partial_overlap",
+]
+
+def _reorder(df: pd.DataFrame) -> pd.DataFrame:
+    keep = [c for c in PREFER_COLS if c in df.columns]
+    if keep:
+        df = df[keep + [c for c in df.columns if c not in keep]]
+    return df
+
+def _canon(col: pd.Series) -> pd.Series:
+    """
+    把一欄轉成穩定的字串再 hash：從 SQLite 讀回來的 int 可能變 float、NULL 變 NaN，
+    直接 hash 原 dtype 會讓同一列在全量重建與增量寫入時算出不同 key。
+    """
+    if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        v = pd.to_numeric(col, errors="coerce")
+        out = v.astype(object).astype(str)
+        is_int = v.notna() & (v == v.round())
+        out[is_int] = v[is_int].astype("int64").astype(str)
+        out[v.isna()] = ""
+        return out
+    return col.astype(object).where(col.notna(), "").astype(str)
+
+def _row_keys(df: pd.DataFrame) -> pd.Series:
+    canon = pd.DataFrame({c: _canon(df[c]) for c in df.columns})
+    return pd.util.hash_pandas_object(canon, index=False).astype("uint64").astype("int64")
+
+def _ensure_key_index(conn: sqlite3.Connection, dst_table: str) -> None:
+    conn.execute(
+        f'CREATE UNIQUE INDEX IF NOT EXISTS "ux_{dst_table}_{KEY_COL}" ON "{dst_table}"("{KEY_COL}")'
+    )
 
 def build_view_by_epitope(
     db_path: str = DB_PATH,
@@ -16,8 +62,9 @@ def build_view_by_epitope(
     limit: int | None = None,
 ) -> pd.DataFrame:
     """
-    從 IEDB enriched 表 (src_table) 讀資料，做必要整理，寫成 view_by_epitope（覆蓋）。
-    目前預設做「直拷貝＋欄位排序＋去重」；你要做彙總或重整，只要改這裡。
+    全量重建（離線用）：從 IEDB enriched 表 (src_table) 讀全部資料，
+    欄位排序＋去重後覆蓋寫成 view_by_epitope，並建 row_key 的 UNIQUE INDEX。
+    平常每次送出只要呼叫 append_view_by_epitope 做增量即可。
     """
     sql = f'SELECT * FROM "{src_table}"'
     if limit is not None:
@@ -26,32 +73,62 @@ def build_view_by_epitope(
     with sqlite3.connect(db_path) as conn:
         df = pd.read_sql(sql, conn)
 
-        # 你可以在這裡做「轉欄位」「彙總」「刪除多餘欄位」等操作
-        # 例：只保留常用欄位（如果欄位存在就保留）
-        prefer_cols = [
-            # MME/IEDB 常見欄位（注意：DB 內通常已經是 snake_case）
-            "query_protein_name",
-            "mme_query", "mme_query_start", "mme_query_end",
-            "hit_human_protein_id", "hit_human_protein_name",
-            "mme_hit_start", "mme_hit_end",
-            "iedb_human_epitope_substring_count",
-            "iedb_human_protein_data_count",
-            "iedb_human_positional_fully_contained",
-            "iedb_human_positional_partial_overlap",
-        ]
-        keep = [c for c in prefer_cols if c in df.columns]
-        if keep:
-            df = df[keep + [c for c in df.columns if c not in keep]]
-
+        df = _reorder(df.drop(columns=[c for c in EXCLUDE_COLS if c in df.columns]))
         # 去重（保守做法）
         df = df.drop_duplicates().reset_index(drop=True)
 
         # 覆蓋寫回 view 表
-        df.to_sql(dst_table, conn, if_exists="replace", index=False)
+        out = df.copy()
+        out[KEY_COL] = _row_keys(df)
+        out = out.drop_duplicates(subset=[KEY_COL])
+        bulk_insert(conn, dst_table, out, replace=True)
+        _ensure_key_index(conn, dst_table)
 
         # 回傳給呼叫端（可選）
         return df
 
+def append_view_by_epitope(
+    batch: pd.DataFrame,
+    db_path: str = DB_PATH,
+    src_table: str = TABLE_ENR,
+    dst_table: str = VIEW_EPI_TABLE,
+) -> int:
+    """
+    增量維護：只把本批（已 snake_case 的 enriched 資料）去重後 INSERT OR IGNORE 進 view。
+    view 表不存在、還是舊格式（沒有 row_key / 帶著 job_id）、或本批出現新欄位時，才退回全量重建。
+    回傳本次實際新增的列數。
+    """
+    with sqlite3.connect(db_path) as conn:
+        cols = [r[1] for r in conn.execute(f'PRAGMA table_info("{dst_table}")')]
+        data_cols = [c for c in cols if c != KEY_COL]
+        batch_cols = set(batch.columns) - set(EXCLUDE_COLS)
+        rebuild = (KEY_COL not in cols or not batch_cols <= set(data_cols)
+                   or any(c in cols for c in EXCLUDE_COLS))
+
+    if rebuild:
+        before = 0
+        with sqlite3.connect(db_path) as conn:
+            if cols:
+                before = conn.execute(f'SELECT COUNT(*) FROM "{dst_table}"').fetchone()[0]
+        return len(build_view_by_epitope(db_path, src_table=src_table, dst_table=dst_table)) - before
+
+    df = batch.reindex(columns=data_cols).drop_duplicates()
+    if df.empty:
+        return 0
+    keys = _row_keys(df)
+    rows = df.astype(object).where(df.notna(), None)
+    placeholders = ",".join("?" * (len(data_cols) + 1))
+    col_sql = ",".join(f'"{c}"' for c in data_cols + [KEY_COL])
+
+    with sqlite3.connect(db_path) as conn:
+        _ensure_key_index(conn, dst_table)
+        before = conn.total_changes
+        conn.executemany(
+            f'INSERT OR IGNORE INTO "{dst_table}" ({col_sql}) VALUES ({placeholders})',
+            (tuple(r) + (int(k),) for r, k in zip(rows.itertuples(index=False, name=None), keys)),
+        )
+        return conn.total_changes - before
+
 if __name__ == "__main__":
     out = build_view_by_epitope()
-    print(f"✅ view_by_epitope 已更新，筆數：{len(out)}")
\ No newline at end of file
+    print(f"✅ view_by_epitope 已更新，筆數：{len(out)}")
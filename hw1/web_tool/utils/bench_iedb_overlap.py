@@ -0,0 +1,34 @@
+# web_tool/utils/bench_iedb_overlap.py
+# 比較 IEDB fully / partial 計數：原本的廣播矩陣 vs sort-and-sweep
+# 用法：python -m web_tool.utils.bench_iedb_overlap [IEDB 筆數] [MME 筆數]
+import sys, time
+import numpy as np
+
+from web_tool.utils.IEDB_pipline import _interval_counts_dense, interval_counts
+
+def make_case(m: int, n: int, protein_len: int = 3000, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    S = rng.integers(1, protein_len, m).astype(float)
+    E = S + rng.integers(7, 30, m)
+    s = rng.integers(1, protein_len, n).astype(float)
+    e = s + rng.integers(4, 20, n)
+    return S, E, s, e
+
+def bench(m: int, n: int) -> None:
+    S, E, s, e = make_case(m, n)
+    t0 = time.perf_counter()
+    f1, p1 = _interval_counts_dense(S, E, s, e)
+    t1 = time.perf_counter()
+    f2, p2 = interval_counts(S, E, s, e)
+    t2 = time.perf_counter()
+    same = np.array_equal(f1, f2) and np.array_equal(p1, p2)
+    dense_mb = 2 * m * n / 2**20   # 兩個 bool 矩陣
+    print(f"m={m:>6} n={n:>6}  dense {t1 - t0:7.3f}s (~{dense_mb:7.1f} MB)  "
+          f"sweep {t2 - t1:7.3f}s  same={same}")
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        bench(int(sys.argv[1]), int(sys.argv[2]))
+    else:
+        for m, n in [(100, 100), (1000, 1000), (5000, 5000), (10000, 10000)]:
+            bench(m, n)
@@ -0,0 +1,37 @@
+# web_tool/utils/bench_parallel_scan.py
+# human proteome 平行掃描：workers = 1, 2, 4 ... 到 CPU 核心數的耗時與加速比
+# 用法：python -m web_tool.utils.bench_parallel_scan <query.fasta> <human.fasta> [k] [packed|ac]
+import io, os, sys, time
+
+from web_tool.utils.mme_pipline import find_mems
+from web_tool.utils.parallel_scan import find_mems_parallel
+
+def bench(query_path: str, human_path: str, k: int = 6, method: str = "packed") -> None:
+    q_text = open(query_path, encoding="utf-8", errors="ignore").read()
+
+    t0 = time.perf_counter()
+    base = find_mems(io.StringIO(q_text), human_path, k, use_index=False)
+    t_serial = time.perf_counter() - t0
+    print(f"serial        {t_serial:7.2f}s  rows={len(base)}")
+
+    n_cpu = os.cpu_count() or 1
+    workers, w = [], 1
+    while w <= n_cpu:
+        workers.append(w)
+        w *= 2
+    if workers[-1] != n_cpu:
+        workers.append(n_cpu)
+
+    for w in workers:
+        t0 = time.perf_counter()
+        out = find_mems_parallel(io.StringIO(q_text), human_path, k, w, method=method)
+        dt = time.perf_counter() - t0
+        same = out.to_csv(index=False) == base.to_csv(index=False)
+        print(f"{method:6} w={w:<3} {dt:7.2f}s  speedup {t_serial / dt:5.2f}x  same={same}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit("用法：python -m web_tool.utils.bench_parallel_scan <query.fasta> <human.fasta> [k] [packed|ac]")
+    bench(sys.argv[1], sys.argv[2],
+          int(sys.argv[3]) if len(sys.argv) > 3 else 6,
+          sys.argv[4] if len(sys.argv) > 4 else "packed")
@@ -0,0 +1,205 @@
+# web_tool/utils/bulk_load.py
+# -*- coding: utf-8 -*-
+"""
+結果表的批次寫入（取代 pandas.to_sql）。
+
+to_sql 的問題：method="multi" 會組出超大的多列 INSERT（很快撞到 SQLite 參數上限、每個 chunk 重新 prepare），
+預設 method 則是逐列 INSERT；每次呼叫後面還跟著一串 CREATE INDEX IF NOT EXISTS。
+這裡的作法：
+  1) 依 DataFrame 的 dtype 一次備好有型別的 schema（INTEGER / REAL / TEXT）：表不存在就 CREATE，
+     有新欄位就 ALTER TABLE ADD COLUMN（舊列是 NULL）
+  2) 同一條 INSERT 用 executemany 吃「欄位 list 的 zip」，不產生逐列的 tuple / dict 中間物
+  3) 刪舊列（例如同一個 job 重跑）+ 寫入 + 索引全部包在一個交易裡；cache_size / mmap_size 調大
+  4) 索引只補「還不存在」的；一批很大（≥ DEFER_INDEX_ROWS 且不少於表裡原有的列數）時，
+     先把既有索引拿掉、寫完再一次建回來，比邊寫邊維護 B-tree 快
+每次寫入印出 rows/sec，也放在回傳的 dict 裡。
+"""
+from __future__ import annotations
+from typing import Iterable, Mapping, Optional, Sequence
+import sqlite3, time
+
+import pandas as pd
+
+from .summary_tables import mark_summary_dirty
+
+DB_PATH = r"C:\Users\ethan\Desktop\碩班\暑假\web_hw\web_hw\hw1\hw1\iedb_result.sqlite3"
+
+DEFER_INDEX_ROWS = 200_000          # 一批超過這個列數才考慮「先拆索引、寫完再建」
+CACHE_SIZE_KIB   = 64 * 1024        # PRAGMA cache_size（負值 = KiB）
+MMAP_SIZE        = 256 * 1024 * 1024
+
+# 結果表常用的查詢欄位：共用表（有 job_id 欄）建 (job_id, 欄位) 複合索引，
+# 每個 job 自己的表（iedb_<id>）整張就是一個 job，直接建單欄索引
+RESULT_INDEX_COLS = ("query_protein_name", "mme_query", "hit_human_protein_id")
+
+
+# ---------- schema ----------
+def sqlite_type(s: pd.Series) -> str:
+    """與 to_sql 的 SQLite fallback 相同的型別對應"""
+    if pd.api.types.is_bool_dtype(s) or pd.api.types.is_integer_dtype(s):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(s):
+        return "REAL"
+    return "TEXT"
+
+def table_columns(conn: sqlite3.Connection, table: str) -> list[str]:
+    return [r[1] for r in conn.execute(f'PRAGMA table_info("{table}")')]
+
+def prepare_table(conn: sqlite3.Connection, table: str, df: pd.DataFrame, replace: bool = False) -> bool:
+    """建表 / 補欄位；回傳這次是不是新建的表（新表的索引自然就是寫完才建）"""
+    if replace:
+        conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+    have = table_columns(conn, table)
+    if not have:
+        cols = ", ".join(f'"{c}" {sqlite_type(df[c])}' for c in df.columns)
+        conn.execute(f'CREATE TABLE "{table}" ({cols})')
+        return True
+    for c in df.columns:
+        if c not in have:
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{c}" {sqlite_type(df[c])}')
+    return False
+
+def result_indexes(table: str, columns: Iterable[str]) -> dict[str, str]:
+    """RESULT_INDEX_COLS 的索引定義 {索引名: 欄位}；表裡沒有的欄位跳過"""
+    columns = set(columns)
+    out = {}
+    for c in RESULT_INDEX_COLS:
+        if c not in columns:
+            continue
+        if "job_id" in columns:
+            out[f"ix_{table}_job_{c}"] = f'job_id, "{c}"'
+        else:
+            out[f"ix_{table}_{c}"] = f'"{c}"'
+    return out
+
+def ensure_result_indexes(conn: sqlite3.Connection, table: str) -> list[str]:
+    """依表的實際欄位補上 RESULT_INDEX_COLS 的索引，回傳索引名稱"""
+    specs = result_indexes(table, table_columns(conn, table))
+    _create_missing_indexes(conn, table, specs)
+    return list(specs)
+
+def _index_sql(conn: sqlite3.Connection, table: str) -> dict[str, str]:
+    """表上既有的（使用者建的）索引 {名稱: CREATE INDEX 原文}"""
+    return dict(conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL", (table,)
+    ).fetchall())
+
+def _create_missing_indexes(conn: sqlite3.Connection, table: str, specs: Mapping[str, str]) -> list[str]:
+    have = _index_sql(conn, table)
+    made = []
+    for name, cols in specs.items():
+        if name not in have:
+            conn.execute(f'CREATE INDEX "{name}" ON "{table}"({cols})')
+            made.append(name)
+    return made
+
+
+# ---------- 寫入 ----------
+def tune_connection(conn: sqlite3.Connection) -> None:
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB};")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE};")
+
+def _column_values(s: pd.Series) -> list:
+    """整欄轉成 Python 原生值（numpy 純量 sqlite3 綁不了）；缺值 → None（float 的 NaN 綁定時 SQLite 本來就當 NULL）"""
+    if pd.api.types.is_bool_dtype(s) or pd.api.types.is_integer_dtype(s) or pd.api.types.is_float_dtype(s):
+        if not pd.api.types.is_extension_array_dtype(s):
+            return s.tolist()
+    return s.astype(object).where(s.notna(), None).tolist()
+
+def bulk_insert(conn: sqlite3.Connection, table: str, df: pd.DataFrame,
+                delete_where: Optional[tuple[str, Sequence]] = None,
+                indexes: Optional[Mapping[str, str]] = None,
+                replace: bool = False, defer_rows: int = DEFER_INDEX_ROWS) -> dict:
+    """
+    在一個交易裡把 df 寫進 table（欄名要是合法的 SQL 識別字，例如 _sanitize_columns 之後）。
+      delete_where：寫入前先刪的列，例如 ("job_id = ?", (job_id,))
+      indexes     ：寫完要有的索引 {名稱: 欄位}（已存在的跳過）
+      replace     ：整張表換掉（同 to_sql 的 if_exists="replace"）
+    呼叫端已經開著交易時改用 SAVEPOINT：不替呼叫端 commit，成敗跟著外層交易走。
+    回傳 {"rows", "elapsed_sec", "rows_per_sec", "deferred_indexes"}。
+    """
+    t0 = time.time()
+    n = len(df)
+    own = not conn.in_transaction
+    if own:
+        tune_connection(conn)     # journal_mode 不能在交易裡改，只在自己開交易時調
+        conn.execute("BEGIN IMMEDIATE")
+    else:
+        conn.execute("SAVEPOINT bulk_insert")
+    try:
+        created = prepare_table(conn, table, df, replace=replace)
+        if delete_where is not None:
+            conn.execute(f'DELETE FROM "{table}" WHERE {delete_where[0]}', tuple(delete_where[1]))
+
+        # 大批寫進既有的表：先拆掉索引，寫完再從原本的 CREATE INDEX 建回來
+        dropped: dict[str, str] = {}
+        if not created and n >= defer_rows:
+            existing = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{table}"').fetchone()[0]
+            if n >= existing:
+                dropped = _index_sql(conn, table)
+                for name in dropped:
+                    conn.execute(f'DROP INDEX "{name}"')
+
+        if n:
+            cols = list(df.columns)
+            col_sql = ", ".join(f'"{c}"' for c in cols)
+            sql = f'INSERT INTO "{table}" ({col_sql}) VALUES ({", ".join("?" * len(cols))})'
+            conn.executemany(sql, zip(*(_column_values(df[c]) for c in cols)))
+
+        for ddl in dropped.values():
+            conn.execute(ddl)
+        _create_missing_indexes(conn, table, indexes or {})
+        conn.execute("COMMIT" if own else "RELEASE SAVEPOINT bulk_insert")
+    except BaseException:
+        if own:
+            conn.execute("ROLLBACK")
+        else:
+            conn.execute("ROLLBACK TO SAVEPOINT bulk_insert")
+            conn.execute("RELEASE SAVEPOINT bulk_insert")
+        raise
+
+    elapsed = time.time() - t0
+    stats = {"rows": n, "elapsed_sec": elapsed, "rows_per_sec": n / elapsed if elapsed > 0 else float(n),
+             "deferred_indexes": len(dropped)}
+    print(f"📥 {table}: {n} 筆 / {elapsed:.2f}s（{stats['rows_per_sec']:,.0f} rows/s）", flush=True)
+    return stats
+
+def replace_job_rows(conn: sqlite3.Connection, table: str, sdf: pd.DataFrame, job_id: str,
+                     indexes: Optional[Mapping[str, str]] = None) -> int:
+    """
+    共用結果表以 job_id 分區：同一個交易裡先清掉這個 job 之前寫過的列（同一個 job 重跑），再寫入本批。
+    sdf 已是 snake_case 欄位；之後讀「這個 job」只要 WHERE job_id = ?，走 (job_id, …) 索引。
+    indexes 是 RESULT_INDEX_COLS 以外還要有的索引。
+    刪掉的舊列與新列碰到的彙總 key 都記進 summary_dirty（rowid 會被重用，水位線看不到這些變化）。
+    """
+    sdf = sdf.assign(job_id=job_id)
+    have = table_columns(conn, table)
+    specs = result_indexes(table, set(have) | set(sdf.columns))
+    specs.update(indexes or {})
+    own = not conn.in_transaction
+    if own:
+        tune_connection(conn)
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        if "job_id" in have:
+            mark_summary_dirty(conn, table, "job_id = ?", (job_id,))
+        bulk_insert(conn, table, sdf, delete_where=("job_id = ?", (job_id,)), indexes=specs)
+        mark_summary_dirty(conn, table, "job_id = ?", (job_id,))
+        if own:
+            conn.execute("COMMIT")
+    except BaseException:
+        if own:
+            conn.execute("ROLLBACK")
+        raise
+    return int(len(sdf))
+
+def bulk_load(df: pd.DataFrame, table: str, db_path: str = DB_PATH, **kwargs) -> dict:
+    """自己開連線的版本（其餘參數同 bulk_insert）"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        return bulk_insert(conn, table, df, **kwargs)
+    finally:
+        conn.close()
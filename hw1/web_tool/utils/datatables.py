@@ -0,0 +1,126 @@
+# web_tool/utils/datatables.py
+# -*- coding: utf-8 -*-
+"""
+DataTables server-side protocol（draw / start / length / order / search）的共用實作。
+前端設定 serverSide: true 後，每次翻頁 / 排序 / 搜尋只取回一頁資料。
+"""
+from __future__ import annotations
+import re
+import sqlite3
+
+MAX_PAGE_LENGTH = 5000   # length=-1（全部）或過大的 length 一律截到這裡
+
+# 前端多關鍵字精準比對會送 ^(?:A|B|C)$ 這種 regex；翻成 SQL 的 IN (...)
+_EXACT_ANY = re.compile(r"^\^\(\?:(.*)\)\$$")
+_UNESCAPE = re.compile(r"\\(.)")
+
+
+def is_datatables_request(params) -> bool:
+    return "draw" in params
+
+def source_columns(conn: sqlite3.Connection, source: str, source_params: list | None = None) -> list[str]:
+    cur = conn.execute(f"SELECT * FROM {source} LIMIT 0", list(source_params or []))
+    return [d[0] for d in cur.description]
+
+def _int(params, key: str, default: int) -> int:
+    try:
+        return int(params.get(key, default))
+    except (TypeError, ValueError):
+        return default
+
+def _column_for(params, i: int, columns: list[str]) -> str | None:
+    """columns[i][data] 可能是欄位索引（data: i）或欄位名（data: 'name'）"""
+    data = params.get(f"columns[{i}][data]", str(i))
+    if str(data).isdigit():
+        j = int(data)
+        return columns[j] if 0 <= j < len(columns) else None
+    return data if data in columns else None
+
+def _like(value: str) -> str:
+    return "%" + value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def _column_filter(col: str, value: str, regex: bool) -> tuple[str, list]:
+    m = _EXACT_ANY.match(value) if regex else None
+    if m:
+        tokens = [_UNESCAPE.sub(r"\1", t) for t in m.group(1).split("|") if t]
+        if tokens:
+            return (f'LOWER("{col}") IN ({",".join("?" * len(tokens))})',
+                    [t.lower() for t in tokens])
+    return f'CAST("{col}" AS TEXT) LIKE ? ESCAPE \'\\\'', [_like(value)]
+
+def datatables_query(
+    conn: sqlite3.Connection,
+    source: str,
+    columns: list[str] | None,
+    params,
+    source_params: list | None = None,
+    default_order: str | None = None,
+    search_cols: list[str] | None = None,
+) -> dict:
+    """
+    source：表名（已加引號）或 "(子查詢) AS src"；columns：source 的欄位（回傳 data 的欄位順序；None = 全部）。
+    排序欄位由白名單 columns 對應，不會把使用者輸入直接拼進 SQL。
+    ORDER BY + LIMIT/OFFSET 會走 source 上對應的索引（彙總表都有預設排序的索引）。
+    """
+    source_params = list(source_params or [])
+    if columns is None:
+        columns = source_columns(conn, source, source_params)
+    draw   = _int(params, "draw", 0)
+    start  = max(0, _int(params, "start", 0))
+    length = _int(params, "length", 10)
+    if length < 0 or length > MAX_PAGE_LENGTH:
+        length = MAX_PAGE_LENGTH
+
+    # 搜尋：全域（任一欄 LIKE）+ 個別欄位
+    where, where_params = [], []
+    gval = (params.get("search[value]") or "").strip()
+    if gval:
+        cols = search_cols or columns
+        where.append("(" + " OR ".join(f'CAST("{c}" AS TEXT) LIKE ? ESCAPE \'\\\'' for c in cols) + ")")
+        where_params += [_like(gval)] * len(cols)
+    i = 0
+    while f"columns[{i}][data]" in params:
+        val = (params.get(f"columns[{i}][search][value]") or "").strip()
+        col = _column_for(params, i, columns)
+        if val and col:
+            sql, p = _column_filter(col, val, params.get(f"columns[{i}][search][regex]") == "true")
+            where.append(sql)
+            where_params += p
+        i += 1
+    where_sql = ("WHERE " + " AND ".join(where)) if where else ""
+
+    # 排序：order[n][column] / order[n][dir]
+    order = []
+    n = 0
+    while f"order[{n}][column]" in params:
+        col = _column_for(params, _int(params, f"order[{n}][column]", -1), columns)
+        direction = "DESC" if params.get(f"order[{n}][dir]") == "desc" else "ASC"
+        if col:
+            order.append(f'"{col}" {direction}')
+        n += 1
+    if not order and default_order:
+        order.append(default_order)
+    order.append(f'"{columns[0]}" ASC')   # 固定 tie-break，翻頁才穩定
+    order_sql = "ORDER BY " + ", ".join(order)
+
+    total = conn.execute(f"SELECT COUNT(*) FROM {source}", source_params).fetchone()[0]
+    if where:
+        filtered = conn.execute(
+            f"SELECT COUNT(*) FROM {source} {where_sql}", source_params + where_params
+        ).fetchone()[0]
+    else:
+        filtered = total
+
+    col_sql = ", ".join(f'"{c}"' for c in columns)
+    rows = conn.execute(
+        f"SELECT {col_sql} FROM {source} {where_sql} {order_sql} LIMIT ? OFFSET ?",
+        source_params + where_params + [length, start],
+    ).fetchall()
+
+    return {
+        "draw": draw,
+        "recordsTotal": total,
+        "recordsFiltered": filtered,
+        "columns": columns,
+        "data": [list(r) for r in rows],
+    }
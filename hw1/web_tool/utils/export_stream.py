@@ -0,0 +1,98 @@
+# web_tool/utils/export_stream.py
+# -*- coding: utf-8 -*-
+"""
+大量結果匯出：SQLite cursor 分批 fetchmany → 逐批產生 CSV / NDJSON（可選 gzip），
+搭配 Django StreamingHttpResponse，server 端記憶體只跟 chunk_size 有關，跟總筆數無關。
+結果已經在記憶體裡（剛算完的 DataFrame）時用 stream_frame，不必先寫進 SQLite 再讀回來。
+"""
+from __future__ import annotations
+import csv, io, json, sqlite3, zlib
+from typing import Iterable, Iterator
+
+import pandas as pd
+
+CHUNK_ROWS = 5000
+
+FORMATS = {
+    "csv":    ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson; charset=utf-8", "ndjson"),
+}
+
+
+def iter_query(db_path: str, sql: str, params: list | tuple = (),
+               chunk_size: int = CHUNK_ROWS) -> tuple[list[str], Iterator[list[tuple]]]:
+    """
+    先執行 SQL 拿欄位名，回傳 (columns, 分批 rows 的 generator)。
+    連線由 generator 持有，讀完（或 client 中斷、generator 被關掉）時才關閉。
+    """
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    try:
+        cur = conn.execute(sql, list(params))
+    except Exception:
+        conn.close()
+        raise
+    columns = [d[0] for d in cur.description]
+
+    def batches() -> Iterator[list[tuple]]:
+        try:
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    return columns, batches()
+
+def frame_batches(df: pd.DataFrame, chunk_size: int = CHUNK_ROWS) -> Iterator[list[tuple]]:
+    """DataFrame 分批轉成 rows；缺值 → None（與從 SQLite 讀出來的 NULL 一樣，CSV 是空欄、JSON 是 null）"""
+    for i in range(0, len(df), chunk_size):
+        part = df.iloc[i:i + chunk_size]
+        yield list(part.astype(object).where(part.notna(), None).itertuples(index=False, name=None))
+
+def csv_chunks(columns: list[str], batches: Iterable[list[tuple]]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow(columns)
+    for rows in batches:
+        w.writerows(rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+def ndjson_chunks(columns: list[str], batches: Iterable[list[tuple]]) -> Iterator[bytes]:
+    for rows in batches:
+        yield "".join(
+            json.dumps(dict(zip(columns, r)), ensure_ascii=False) + "\n" for r in rows
+        ).encode("utf-8")
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """wbits=31 → 輸出標準 gzip 檔頭，下載後 gunzip / pandas 都能直接讀"""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for c in chunks:
+        out = z.compress(c)
+        if out:
+            yield out
+    yield z.flush()
+
+def stream_export(db_path: str, sql: str, params: list | tuple = (), fmt: str = "csv",
+                  gzip: bool = False, chunk_size: int = CHUNK_ROWS) -> Iterator[bytes]:
+    """組合上面幾步：回傳 bytes 的 generator，直接丟給 StreamingHttpResponse"""
+    if fmt not in FORMATS:
+        raise ValueError(f"不支援的格式：{fmt}（可用：{', '.join(FORMATS)}）")
+    columns, batches = iter_query(db_path, sql, params, chunk_size)
+    return _encode(columns, batches, fmt, gzip)
+
+def stream_frame(df: pd.DataFrame, fmt: str = "csv", gzip: bool = False,
+                 chunk_size: int = CHUNK_ROWS) -> Iterator[bytes]:
+    """stream_export 的記憶體版：直接把 DataFrame 分批輸出，不經過 SQLite"""
+    if fmt not in FORMATS:
+        raise ValueError(f"不支援的格式：{fmt}（可用：{', '.join(FORMATS)}）")
+    return _encode([str(c) for c in df.columns], frame_batches(df, chunk_size), fmt, gzip)
+
+def _encode(columns: list[str], batches: Iterable[list[tuple]], fmt: str, gzip: bool) -> Iterator[bytes]:
+    chunks = csv_chunks(columns, batches) if fmt == "csv" else ndjson_chunks(columns, batches)
+    return gzip_chunks(chunks) if gzip else chunks
@@ -0,0 +1,217 @@
+# web_tool/utils/fasta_index.py
+# -*- coding: utf-8 -*-
+"""
+FASTA 的 byte-offset 索引（samtools .fai 風格）+ mmap 隨機讀取。
+索引檔 <fasta>.fai，每行一筆 record，tab 分隔：
+    name  length  offset  line_bases  line_bytes  end
+  - name       ：'>' 後整行（與 parse_fasta 的 record 名稱相同）
+  - length     ：正規化後（大寫、只留 A-Z）的殘基數
+  - offset     ：第一行序列的 byte 位置
+  - line_bases / line_bytes：每行殘基數 / 每行 byte 數（含換行）；行寬不一致時記 0
+  - end        ：下一個 '>' 的 byte 位置（或檔尾），record 的序列一定落在 [offset, end)
+建一次就好（FASTA 的 size / mtime 變了才重建）；之後取單一蛋白只要查 dict + 切 mmap，
+不用從頭 parse 整個 human.fasta。
+"""
+from __future__ import annotations
+from pathlib import Path
+from threading import Lock
+from typing import Iterator, NamedTuple, Optional, Union
+import mmap, os, re
+
+FAI_SUFFIX = ".fai"
+
+_NON_AA = re.compile(rb"[^A-Z]")
+
+
+class FaiRecord(NamedTuple):
+    name: str
+    length: int
+    offset: int
+    line_bases: int
+    line_bytes: int
+    end: int
+
+
+def _normalize(raw: bytes) -> str:
+    """與 parse_fasta 相同：轉大寫、只留 A-Z"""
+    return _NON_AA.sub(b"", raw.upper()).decode("ascii")
+
+def accession_of(name: str) -> str:
+    """'sp|P00001|H1_HUMAN ...' → 'P00001'；沒有 '|' 就回傳整個名稱（與 IEDB_pipline 相同規則）"""
+    s = name.strip()
+    parts = s.split("|", 2)
+    core = parts[1].strip() if len(parts) > 1 else ""
+    return core or s
+
+def default_fai_path(fasta_path: Union[str, Path]) -> Path:
+    p = Path(fasta_path)
+    return p.with_name(p.name + FAI_SUFFIX)
+
+
+# ---------- 建索引 ----------
+def _scan(fasta: Path) -> Iterator[FaiRecord]:
+    """整份 FASTA 只掃一次（binary），逐 record 算出 offset / 行寬 / 殘基數"""
+    name: Optional[str] = None
+    length = offset = line_bases = line_bytes = 0
+    regular = True
+    last_short = False      # 已經出現過比較短的行（只允許是最後一行）
+
+    def _record(end: int) -> FaiRecord:
+        ok = regular and line_bases > 0
+        return FaiRecord(name, length, offset, line_bases if ok else 0, line_bytes if ok else 0, end)
+
+    pos = 0
+    with fasta.open("rb") as f:
+        for line in f:
+            n = len(line)
+            if line.startswith(b">"):
+                if name is not None:
+                    yield _record(pos)
+                name = line[1:].decode("utf-8", errors="ignore").strip()
+                length, offset, line_bases, line_bytes = 0, pos + n, 0, 0
+                regular, last_short = True, False
+            elif name is not None:
+                body = line.rstrip(b"\r\n")
+                bases = len(_NON_AA.sub(b"", body.upper()))
+                length += bases
+                if not body.strip():
+                    last_short = True              # 空行之後不能再有序列
+                elif regular:
+                    if bases != len(body):         # 行內有空白 / 數字等，無法用行寬換算位置
+                        regular = False
+                    elif line_bases == 0:
+                        line_bases, line_bytes = bases, n
+                    elif last_short or bases > line_bases or (bases == line_bases and n != line_bytes):
+                        regular = False
+                    elif bases < line_bases:
+                        last_short = True
+            pos += n
+    if name is not None:
+        yield _record(pos)
+
+def build_fai(fasta_path: Union[str, Path], fai_path: Union[str, Path, None] = None) -> Path:
+    fasta = Path(fasta_path)
+    out = Path(fai_path) if fai_path is not None else default_fai_path(fasta)
+    tmp = out.with_name(out.name + ".tmp")
+    with tmp.open("w", encoding="utf-8", newline="\n") as f:
+        for r in _scan(fasta):
+            f.write("\t".join([r.name.replace("\t", " "), *map(str, r[1:])]) + "\n")
+    os.replace(tmp, out)
+    return out
+
+def read_fai(fai_path: Union[str, Path]) -> list[FaiRecord]:
+    recs: list[FaiRecord] = []
+    with Path(fai_path).open("r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 6:
+                continue
+            recs.append(FaiRecord(parts[0], *map(int, parts[1:6])))
+    return recs
+
+
+# ---------- 讀取 ----------
+class FastaIndex:
+    """mmap 整份 FASTA，依 .fai 直接切出單一 record；查名稱 / UniProt accession 都是 O(1)"""
+
+    def __init__(self, fasta_path: Union[str, Path], records: list[FaiRecord]):
+        self.path = Path(fasta_path)
+        self.records = records
+        self._by_name = {r.name: i for i, r in enumerate(records)}
+        self._by_acc: dict[str, int] = {}
+        for i, r in enumerate(records):
+            self._by_acc.setdefault(accession_of(r.name), i)
+        self._f = self.path.open("rb")
+        size = os.fstat(self._f.fileno()).st_size
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._by_name
+
+    def record(self, name: str) -> Optional[FaiRecord]:
+        i = self._by_name.get(name)
+        return None if i is None else self.records[i]
+
+    def record_by_accession(self, acc: str) -> Optional[FaiRecord]:
+        i = self._by_acc.get(acc.strip())
+        return None if i is None else self.records[i]
+
+    def header_offset(self, i: int) -> int:
+        """第 i 筆 record 的 '>' 所在 byte（= 前一筆的 end）"""
+        if i == 0:
+            return self._mm.rfind(b">", 0, self.records[0].offset) if self.records else 0
+        return self.records[i - 1].end
+
+    def _slice(self, r: FaiRecord, start: int, stop: int) -> str:
+        if r.line_bases:
+            # 行寬固定：直接換算 byte 位置，只讀需要的那幾行
+            a = r.offset + (start // r.line_bases) * r.line_bytes + start % r.line_bases
+            b = r.offset + (stop // r.line_bases) * r.line_bytes + stop % r.line_bases
+            return _normalize(self._mm[a:min(b, r.end)])
+        return _normalize(self._mm[r.offset:r.end])[start:stop]
+
+    def fetch_record(self, r: FaiRecord, start: int = 0, stop: Optional[int] = None) -> str:
+        """0-based、半開區間 [start, stop)；預設整條序列"""
+        stop = r.length if stop is None else min(stop, r.length)
+        start = max(0, start)
+        if start >= stop:
+            return ""
+        return self._slice(r, start, stop)
+
+    def fetch(self, name: str, start: int = 0, stop: Optional[int] = None) -> Optional[str]:
+        r = self.record(name)
+        return None if r is None else self.fetch_record(r, start, stop)
+
+    def fetch_accession(self, acc: str, start: int = 0, stop: Optional[int] = None) -> Optional[str]:
+        r = self.record_by_accession(acc)
+        return None if r is None else self.fetch_record(r, start, stop)
+
+    def close(self) -> None:
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._f.close()
+
+
+# ---------- 快取 ----------
+_open: dict[str, tuple[tuple[int, int], FastaIndex]] = {}
+_lock = Lock()
+
+def get_fasta_index(fasta_path: Union[str, Path], fai_path: Union[str, Path, None] = None) -> FastaIndex:
+    """
+    取得 FastaIndex（每個 process 依 FASTA 的 size / mtime 快取一份）。
+    .fai 不存在或比 FASTA 舊就重建。
+    """
+    fasta = Path(fasta_path)
+    fai = Path(fai_path) if fai_path is not None else default_fai_path(fasta)
+    st = fasta.stat()
+    fp = (int(st.st_size), int(st.st_mtime_ns))
+    key = str(fasta.resolve())
+
+    with _lock:
+        cached = _open.get(key)
+        if cached is not None and cached[0] == fp:
+            return cached[1]
+
+        if not fai.exists() or fai.stat().st_mtime_ns < st.st_mtime_ns:
+            try:
+                build_fai(fasta, fai)
+            except OSError as e:
+                # 目錄唯讀時不落地，直接用記憶體裡的結果
+                print(f"⚠️ 寫入 FASTA 索引失敗（{fai}）：{e}", flush=True)
+                idx = FastaIndex(fasta, list(_scan(fasta)))
+                _open[key] = (fp, idx)
+                return idx
+
+        recs = read_fai(fai)
+        if recs and recs[-1].end != fp[0]:
+            # .fai 跟 FASTA 對不起來（例如 cp -p 保留舊 mtime），重建一次
+            build_fai(fasta, fai)
+            recs = read_fai(fai)
+        idx = FastaIndex(fasta, recs)
+        if cached is not None:
+            cached[1].close()
+        _open[key] = (fp, idx)
+        return idx
@@ -0,0 +1,128 @@
+# web_tool/utils/job_worker.py
+# -*- coding: utf-8 -*-
+"""
+本機背景 worker pool：從 SQLite jobs 表撈 queued job → 跑 MME + IEDB → 寫結果。
+不需要外部 broker；用 `python manage.py run_mme_worker --workers 2` 啟動。
+"""
+from __future__ import annotations
+from pathlib import Path
+import io, multiprocessing as mp, sqlite3, time, traceback
+
+import pandas as pd
+
+from .mme_pipline import run_pipeline, save_append, parse_fasta, _sanitize_columns
+from .bulk_load import replace_job_rows
+from .proteome import resolve_human_source
+from .result_cache import result_key, cache_lookup, cache_store, link_cached_result, release_source
+from .IEDB_pipline import process as iedb_process, load_reference
+from .View_by_Epitope import append_view_by_epitope
+from .summary_tables import refresh_summaries_at
+from . import jobs
+from .jobs import claim_next_job, update_job, register_artifact, utc_now, worker_name
+
+TABLE_RAW = "mme_result"
+TABLE_ENR = "iedb_result"
+VIEW_EPI_TABLE = "view_by_epitope"
+
+
+def write_job_rows(sdf: pd.DataFrame, job_id: str, db_path: str | None = None) -> int:
+    """
+    把單一 job 的 enriched 結果（已 snake_case）以 job_id 分區寫進共用的 iedb_result，並登記到 job_artifacts。
+    同步（mme_form）與背景 worker 都走這裡：結果只存這一份，讀取端一律 WHERE job_id = ?。
+    這個分區若是別的 job 的快取來源，覆蓋前先讓它們各自留一份（release_source，同一個交易）。
+    """
+    db_path = db_path or jobs.DB_PATH
+    jobs.ensure_job_artifacts_schema()
+    with sqlite3.connect(db_path, timeout=30) as conn:
+        conn.execute("PRAGMA foreign_keys=ON;")
+        conn.execute("BEGIN IMMEDIATE")
+        release_source(conn, job_id)
+        n = replace_job_rows(conn, TABLE_ENR, sdf, job_id)
+        register_artifact(conn, job_id, TABLE_ENR, n)
+    return n
+
+
+def run_job(job: dict, human_fasta: str, iedb_csv: str, db_path: str | None = None) -> None:
+    """執行單一 job；每個階段更新 progress，失敗時 status='failed' 並記下 message"""
+    db_path = db_path or jobs.DB_PATH
+    job_id = job["job_id"]
+    try:
+        k = job["params"].get("k", 6)
+        k = [int(x) for x in k] if isinstance(k, list) else int(k)
+        human_src = resolve_human_source(human_fasta)
+
+        # 結果快取命中：job 直接指向來源 job 的分區，不重跑也不重複寫 mme_result / iedb_result
+        # （key 邊 parse 邊 hash，不另外留一份 records）
+        cache_key = None
+        try:
+            cache_key = result_key(parse_fasta(io.StringIO(job["query_fasta"])), k, human_src, iedb_csv)
+            src_job = cache_lookup(cache_key, db_path)
+            if src_job and link_cached_result(src_job, job_id, db_path=db_path) is not None:
+                update_job(job_id, status="done", progress=1.0, finished_at=utc_now(),
+                           message=f"完成（結果快取）→ job {src_job}")
+                return
+        except Exception as e:
+            print(f"⚠️ 讀取結果快取失敗：{e}", flush=True)
+
+        update_job(job_id, progress=0.05, message="MME 比對中")
+        df_raw = run_pipeline(io.StringIO(job["query_fasta"]), human_src, k=k, memo_db=db_path)
+
+        update_job(job_id, progress=0.5, message="寫入原始 MME")
+        try:
+            save_append(df_raw, db_path=db_path, table=TABLE_RAW, job_id=job_id)
+        except Exception as e:
+            print(f"⚠️ 寫入 {TABLE_RAW} 失敗：{e}", flush=True)
+
+        update_job(job_id, progress=0.6, message="IEDB enrich 中")
+        df_enr = iedb_process(df_raw.copy(), load_reference(iedb_csv))
+
+        update_job(job_id, progress=0.85, message="寫入結果")
+        sdf = _sanitize_columns(df_enr)
+        n = write_job_rows(sdf, job_id, db_path=db_path)
+        if cache_key:
+            try:
+                cache_store(cache_key, job_id, n, params={"k": k}, db_path=db_path)
+            except Exception as e:
+                print(f"⚠️ 寫入結果快取失敗：{e}", flush=True)
+        try:
+            append_view_by_epitope(sdf, db_path, src_table=TABLE_ENR, dst_table=VIEW_EPI_TABLE)
+        except Exception as e:
+            print(f"⚠️ 更新 {VIEW_EPI_TABLE} 失敗：{e}", flush=True)
+        try:
+            refresh_summaries_at(db_path, src_table=TABLE_ENR)
+        except Exception as e:
+            print(f"⚠️ 更新彙總表失敗：{e}", flush=True)
+
+        update_job(job_id, status="done", progress=1.0, finished_at=utc_now(),
+                   message=f"完成：{n} 筆 → {TABLE_ENR}")
+    except Exception as e:
+        traceback.print_exc()
+        update_job(job_id, status="failed", finished_at=utc_now(), message=f"運行失敗：{e}")
+
+
+def worker_loop(human_fasta: str, iedb_csv: str, poll_interval: float = 1.0,
+                max_jobs: int | None = None) -> None:
+    """單一 worker process：一直輪詢 queue；沒事做就睡 poll_interval 秒"""
+    name = worker_name()
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        job = claim_next_job(name)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        run_job(job, human_fasta, iedb_csv)
+        done += 1
+
+
+def start_pool(n_workers: int, human_fasta: str | Path, iedb_csv: str | Path,
+               poll_interval: float = 1.0) -> list[mp.Process]:
+    """開 n_workers 個 process 跑 worker_loop（先把 owner 已經不在、卡在 running 的 job 撿回來）"""
+    n = jobs.requeue_running()
+    if n:
+        print(f"↩️ 重新排入 {n} 筆中斷的 job", flush=True)
+    procs = []
+    for _ in range(max(1, n_workers)):
+        p = mp.Process(target=worker_loop, args=(str(human_fasta), str(iedb_csv), poll_interval), daemon=True)
+        p.start()
+        procs.append(p)
+    return procs
@@ -1,7 +1,10 @@
-import sqlite3, uuid, json, datetime
+import sqlite3, uuid, json, datetime, re, os, socket
 
 DB_PATH = r"C:\Users\ethan\Desktop\碩班\暑假\web_hw\web_hw\hw1\hw1\iedb_result.sqlite3"
 
+# running job 的 owner 在別台機器（沒辦法查 pid）時，heartbeat 超過這麼久沒更新才當它死了
+JOB_LEASE_SEC = 6 * 3600
+
 def utc_now():
     return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
@@ -30,6 +33,9 @@ def ensure_jobs_schema():
         add_col("finished_at","TEXT")
         add_col("params_json","TEXT")
         add_col("message",    "TEXT")
+        add_col("progress",   "REAL")
+        add_col("worker",     "TEXT")
+        add_col("heartbeat_at","TEXT")
 
         # 3) 建唯一索引（避免 short_id 重複）
         idx = [r[1] for r in conn.execute("PRAGMA index_list('jobs')")]
@@ -48,6 +54,19 @@ def ensure_job_artifacts_schema():
             FOREIGN KEY (job_id) REFERENCES jobs(job_id) ON DELETE CASCADE
         )
         """)
+        # 結果快取命中的 job：列在 iedb_result 裡另一個 job（src_job_id）的分區
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(job_artifacts)")}
+        if "src_job_id" not in cols:
+            conn.execute("ALTER TABLE job_artifacts ADD COLUMN src_job_id TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_job_artifacts_src ON job_artifacts(src_job_id)")
+        # 背景 worker 用：排隊中的 job 的輸入（query FASTA 原文）
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS job_inputs (
+            job_id TEXT PRIMARY KEY,
+            query_fasta TEXT NOT NULL,
+            FOREIGN KEY (job_id) REFERENCES jobs(job_id) ON DELETE CASCADE
+        )
+        """)
 
 def _gen_short_id(conn) -> str:
     while True:
@@ -67,4 +86,205 @@ def create_job(params: dict) -> dict:
             INSERT INTO jobs (job_id, short_id, status, created_at, params_json)
             VALUES (?, ?, 'queued', ?, ?)
         """, (job_uuid, short_id, utc_now(), json.dumps(params, ensure_ascii=False)))
-    return {"job_id": job_uuid, "short_id": short_id}
\ No newline at end of file
+    return {"job_id": job_uuid, "short_id": short_id}
+
+# ---------------------------------------------------------
+# 背景 job queue（SQLite 當 queue，不需要外部 broker）
+# ---------------------------------------------------------
+_SAFE_TABLE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+def _assert_safe_table(name: str) -> None:
+    """表名會直接拼進 SQL，只允許英數與底線"""
+    if not _SAFE_TABLE.match(name or ""):
+        raise ValueError(f"不合法的表名：{name!r}")
+
+def job_table_name(job_id: str) -> str:
+    """每個 job 自己的結果表：iedb_<uuid 前 10 碼>（同 smoke_test_job）"""
+    table = "iedb_" + job_id.replace("-", "")[:10]
+    _assert_safe_table(table)
+    return table
+
+def enqueue_job(params: dict, query_fasta: str, job_ref: str | None = None) -> dict:
+    """
+    把一個 MME job 放進 queue（status='queued'）。
+    job_ref 是前端先前用 api_create_job 拿到的 job_id / short_id；沒給就新建一個。
+    """
+    job = get_job(job_ref) if job_ref else None
+    if job is None:
+        job = create_job(params)
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("""
+            UPDATE jobs SET status='queued', params_json=?, progress=0,
+                   started_at=NULL, finished_at=NULL, message=NULL, worker=NULL
+            WHERE job_id=?
+        """, (json.dumps(params, ensure_ascii=False), job["job_id"]))
+        conn.execute("INSERT OR REPLACE INTO job_inputs (job_id, query_fasta) VALUES (?, ?)",
+                     (job["job_id"], query_fasta))
+    return {"job_id": job["job_id"], "short_id": job["short_id"], "status": "queued"}
+
+def worker_name(role: str | None = None) -> str:
+    """jobs.worker 的值：[role:]host:pid，requeue_running 靠它判斷 owner 還在不在"""
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    return f"{role}:{name}" if role else name
+
+def start_inline_job(params: dict, worker: str, job_ref: str | None = None) -> dict:
+    """
+    同步（mme_form）跑的 job：直接標成 running（owner = worker），不留輸入。
+    結果寫進 DB 前 process 就掛了 → owner 的 pid 已不在，requeue_running 會把它標成 failed。
+    """
+    job = get_job(job_ref) if job_ref else None
+    if job is None:
+        job = create_job(params)
+    now = utc_now()
+    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("""
+            UPDATE jobs SET status='running', params_json=?, progress=0, started_at=?, heartbeat_at=?,
+                   finished_at=NULL, message=NULL, worker=?
+            WHERE job_id=?
+        """, (json.dumps(params, ensure_ascii=False), now, now, worker, job["job_id"]))
+        conn.execute("DELETE FROM job_inputs WHERE job_id=?", (job["job_id"],))
+    return {"job_id": job["job_id"], "short_id": job["short_id"], "status": "running"}
+
+def claim_next_job(worker: str) -> dict | None:
+    """
+    原子地取出最舊的一筆 queued job 並改成 running。
+    BEGIN IMMEDIATE 先拿寫鎖，多個 worker process 同時搶也不會拿到同一筆。
+    """
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, timeout=30)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("""
+            SELECT j.job_id, j.short_id, j.params_json, i.query_fasta
+            FROM jobs j JOIN job_inputs i ON i.job_id = j.job_id
+            WHERE j.status = 'queued'
+            ORDER BY j.created_at, j.rowid
+            LIMIT 1
+        """).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        now = utc_now()
+        conn.execute("""
+            UPDATE jobs SET status='running', started_at=?, heartbeat_at=?, progress=0, worker=?
+            WHERE job_id=?
+        """, (now, now, worker, row[0]))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return {
+        "job_id": row[0], "short_id": row[1],
+        "params": json.loads(row[2] or "{}"), "query_fasta": row[3],
+    }
+
+def update_job(job_id: str, **fields) -> None:
+    """
+    更新 jobs 的欄位（status / progress / message / finished_at …），順便更新 heartbeat。
+    status 變成 done / failed 時 job_inputs 已經用不到，一起刪掉。
+    """
+    if not fields:
+        return
+    allowed = {"status", "progress", "message", "started_at", "finished_at", "worker"}
+    bad = set(fields) - allowed
+    if bad:
+        raise ValueError(f"不能更新的欄位：{sorted(bad)}")
+    fields = {**fields, "heartbeat_at": utc_now()}
+    sets = ", ".join(f"{k}=?" for k in fields)
+    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+        conn.execute(f"UPDATE jobs SET {sets} WHERE job_id=?", (*fields.values(), job_id))
+        if fields.get("status") in ("done", "failed"):
+            conn.execute("DELETE FROM job_inputs WHERE job_id=?", (job_id,))
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        import ctypes
+        k32 = ctypes.windll.kernel32
+        h = k32.OpenProcess(0x1000, False, pid)     # PROCESS_QUERY_LIMITED_INFORMATION
+        if not h:
+            return k32.GetLastError() == 5          # ACCESS_DENIED：process 在，只是沒權限
+        try:
+            code = ctypes.c_ulong()
+            return bool(k32.GetExitCodeProcess(h, ctypes.byref(code))) and code.value == 259  # STILL_ACTIVE
+        finally:
+            k32.CloseHandle(h)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _owner_dead(worker: str | None, heartbeat_at: str | None) -> bool:
+    """
+    owner 在本機：看 pid 還在不在；在別台（或舊格式查不到 pid）：heartbeat 超過 JOB_LEASE_SEC 才算死。
+    """
+    parts = (worker or "").rsplit(":", 2)
+    if len(parts) >= 2 and parts[-1].isdigit() and parts[-2] == socket.gethostname():
+        return not _pid_alive(int(parts[-1]))
+    if not heartbeat_at:
+        return True
+    try:
+        beat = datetime.datetime.strptime(heartbeat_at, "%Y-%m-%dT%H:%M:%SZ")
+    except ValueError:
+        return True
+    return (datetime.datetime.utcnow() - beat).total_seconds() > JOB_LEASE_SEC
+
+def requeue_running() -> int:
+    """
+    worker pool 啟動時撿回上次中斷、卡在 running 的 job（回傳放回 queue 幾筆）。
+    只處理 owner 確定已經不在的 job（_owner_dead）：還活著的 web / worker process 手上的 job 不動，
+    不然同一個 job 會被跑兩次、結果寫兩次。
+    有輸入（job_inputs）的放回 queue；沒有輸入的（同步跑的 job）沒辦法重跑，標成 failed。
+    """
+    ensure_jobs_schema()
+    ensure_job_artifacts_schema()
+    with sqlite3.connect(DB_PATH, timeout=30) as conn:
+        rows = conn.execute("""
+            SELECT j.job_id, j.worker, COALESCE(j.heartbeat_at, j.started_at), i.job_id IS NOT NULL
+            FROM jobs j LEFT JOIN job_inputs i ON i.job_id = j.job_id
+            WHERE j.status = 'running'
+        """).fetchall()
+        dead = [(job_id, has_input) for job_id, worker, beat, has_input in rows if _owner_dead(worker, beat)]
+        requeue = [(job_id,) for job_id, has_input in dead if has_input]
+        conn.executemany("""
+            UPDATE jobs SET status='queued', started_at=NULL, progress=0, worker=NULL
+            WHERE job_id=? AND status='running'
+        """, requeue)
+        conn.executemany("""
+            UPDATE jobs SET status='failed', finished_at=?, worker=NULL, message='中斷且沒有可重跑的輸入'
+            WHERE job_id=? AND status='running'
+        """, [(utc_now(), job_id) for job_id, has_input in dead if not has_input])
+    return len(requeue)
+
+def register_artifact(conn: sqlite3.Connection, job_id: str, table: str, row_count: int,
+                      src_job_id: str | None = None) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO job_artifacts (job_id, iedb_table, row_count, created_at, src_job_id) "
+        "VALUES (?,?,?,?,?)",
+        (job_id, table, row_count, utc_now(), src_job_id),
+    )
+
+def get_job(job_ref: str) -> dict | None:
+    """用 job_id 或 short_id 查 job（含結果表登記）"""
+    ensure_jobs_schema()
+    ensure_job_artifacts_schema()
+    with sqlite3.connect(DB_PATH) as conn:
+        conn.row_factory = sqlite3.Row
+        row = conn.execute("""
+            SELECT j.job_id, j.short_id, j.status, j.progress, j.message,
+                   j.created_at, j.started_at, j.finished_at, j.params_json,
+                   a.iedb_table, a.row_count, a.src_job_id
+            FROM jobs j LEFT JOIN job_artifacts a ON a.job_id = j.job_id
+            WHERE j.job_id = ? OR j.short_id = ?
+            LIMIT 1
+        """, (job_ref, job_ref)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job["params"] = json.loads(job.pop("params_json") or "{}")
+    return job
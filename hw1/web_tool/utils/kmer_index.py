@@ -0,0 +1,303 @@
+# web_tool/utils/kmer_index.py
+# -*- coding: utf-8 -*-
+"""
+human.fasta 的預建 k-mer 索引（落地成 .npy，可 memmap）。
+
+目錄結構（預設放在 FASTA 旁邊：human.fasta.kidx/）：
+    meta.json        FASTA 指紋（size / mtime_ns / sha256）與已建的 k（依最近使用排序）
+    residues.npy     全部序列串接的 uint8（A=1 … Z=26）
+    offsets.npy      每條序列在 residues 的起點（長度 n+1）
+    names.json       序列名稱（與 parse_fasta 的 name 一致）
+    k{k}.codes.npy   排序後的 k-mer packed code（uint64）
+    k{k}.pos.npy     對應的全域位置（uint32，指向 residues）
+    .lock            建索引 / 改 meta 時的跨 process 檔案鎖
+
+FASTA 的 size / mtime 變了就比對 sha256，內容真的變了才整包重建。
+k > 12 的 code 跟 12-mer 一模一樣（只 pack 前 12 碼），所以共用 k12 的檔案：查詢時再篩序列邊界、
+verify_tail 比對第 12 碼以後。每份參考最多留 MAX_INDEX_KS 組 k 檔，超過就刪最久沒用的。
+來源若是 compiled proteome（proteome.py，同樣的 residues / offsets / names），
+k-mer 檔直接建在 proteome 目錄裡，不用再 parse FASTA。
+"""
+from __future__ import annotations
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Iterable, Optional, Tuple, Union
+import hashlib, json, os, threading
+import numpy as np
+
+PACK_BITS  = 5     # A-Z 用 5 bits 就裝得下
+MAX_PACK_K = 12    # 5 × 12 = 60 bits，塞得進 uint64；k 更大時只用前 12 碼當 key 再驗證
+
+INDEX_SUFFIX = ".kidx"
+MAX_INDEX_KS = 4   # 每份參考最多留幾組 k{k}.*.npy（每組約 residues 數 × 12 bytes）
+
+
+# ---------- 編碼 ----------
+def encode_seq(seq: str) -> np.ndarray:
+    """'ACD' -> uint8 [1, 3, 4]（parse_fasta 已保證只剩 A-Z）"""
+    return np.frombuffer(seq.encode("ascii"), dtype=np.uint8) - np.uint8(64)
+
+def decode_residues(res: np.ndarray) -> str:
+    return (np.asarray(res, dtype=np.uint8) + np.uint8(64)).tobytes().decode("ascii")
+
+def kmer_codes(res: np.ndarray, k: int) -> np.ndarray:
+    """
+    對 residue 陣列取所有起點的 k-mer code（長度 len(res)-k+1）。
+    k <= 12 時 code 唯一對應 k-mer；k > 12 時只 pack 前 12 碼，呼叫端要再驗證。
+    """
+    kk = min(k, MAX_PACK_K)
+    n = res.size - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint64)
+    r = res.astype(np.uint64, copy=False)
+    codes = np.zeros(n, dtype=np.uint64)
+    shift = np.uint64(PACK_BITS)
+    for j in range(kk):
+        codes <<= shift
+        codes |= r[j:j + n]
+    return codes
+
+def verify_tail(q_res: np.ndarray, q_pos: np.ndarray,
+                h_res: np.ndarray, h_pos: np.ndarray, k: int) -> np.ndarray:
+    """k > 12 時逐欄比對第 12..k-1 碼，回傳真正相同的 mask"""
+    ok = np.ones(q_pos.size, dtype=bool)
+    for j in range(MAX_PACK_K, k):
+        if not ok.any():
+            break
+        ok &= q_res[q_pos + j] == h_res[h_pos + j]
+    return ok
+
+
+# ---------- 指紋 ----------
+def _stat_fingerprint(path: Path) -> dict:
+    st = path.stat()
+    return {"size": int(st.st_size), "mtime_ns": int(st.st_mtime_ns)}
+
+def _sha256(path: Path, chunk: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _save_npy(path: Path, arr: np.ndarray) -> None:
+    # 先寫暫存檔再 replace，避免別的 process 讀到寫一半的檔
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+def _save_json(path: Path, obj) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(obj, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+@contextmanager
+def _file_lock(path: Path):
+    """同一台機器上跨 process 的互斥鎖（threading.Lock 只擋得住同一個 process）"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                f.seek(0)
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue   # LK_LOCK 最多等 10 秒就放棄，繼續等
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+# ---------- 索引本體 ----------
+def index_k(k: int) -> int:
+    """k 實際用哪一組檔：k > 12 共用 k12"""
+    return min(k, MAX_PACK_K)
+
+class KmerIndex:
+    """單一 k 的索引（residues / codes / pos 皆為 memmap，唯讀）"""
+
+    def __init__(self, index_dir: Path, k: int):
+        self.index_dir = Path(index_dir)
+        self.k = k
+        self.file_k = index_k(k)
+        self.residues = np.load(self.index_dir / "residues.npy", mmap_mode="r")
+        self.offsets  = np.load(self.index_dir / "offsets.npy", mmap_mode="r")
+        self.names    = json.loads((self.index_dir / "names.json").read_text(encoding="utf-8"))
+        self.lengths  = np.diff(np.asarray(self.offsets)).astype(np.int64)
+        self.codes    = np.load(self.index_dir / f"k{self.file_k}.codes.npy", mmap_mode="r")
+        self.pos      = np.load(self.index_dir / f"k{self.file_k}.pos.npy", mmap_mode="r")
+
+    def probe(self, q_codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        對一批 query code 查表。
+        回傳 (q_idx, h_pos)：q_codes[q_idx] 與 residues[h_pos:h_pos+k] 的 code 相同。
+        成本只跟 query 大小與命中數有關。
+        """
+        lo = np.searchsorted(self.codes, q_codes, side="left")
+        hi = np.searchsorted(self.codes, q_codes, side="right")
+        cnt = hi - lo
+        total = int(cnt.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        q_idx = np.repeat(np.arange(q_codes.size, dtype=np.int64), cnt)
+        # 每個命中在 codes 裡的位置 = lo[q] + (第幾個)
+        starts = np.repeat(lo - (np.cumsum(cnt) - cnt), cnt)
+        h_slot = starts + np.arange(total, dtype=np.int64)
+        h_pos = np.asarray(self.pos[h_slot], dtype=np.int64)
+        if self.k > self.file_k:
+            # 共用 k12 的檔：12-mer 沒跨序列邊界不代表 k-mer 沒跨，補篩 pos + k <= 序列終點
+            offs = np.asarray(self.offsets)
+            keep = h_pos + self.k <= offs[np.searchsorted(offs, h_pos, side="right")]
+            q_idx, h_pos = q_idx[keep], h_pos[keep]
+        return q_idx, h_pos
+
+    def locate(self, h_pos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """全域位置 -> (序列編號, 0-based 序列內位置)"""
+        offs = np.asarray(self.offsets)
+        rec = np.searchsorted(offs, h_pos, side="right") - 1
+        return rec, h_pos - offs[rec]
+
+
+def default_index_dir(fasta_path: Union[str, Path]) -> Path:
+    p = Path(fasta_path)
+    return p.with_name(p.name + INDEX_SUFFIX)
+
+def _build_residues(index_dir: Path, records: Iterable[Tuple[str, str]]) -> Tuple[int, int]:
+    """寫 residues / offsets / names（compiled proteome 也用同一套格式），回傳 (record 數, 殘基數)"""
+    names: list[str] = []
+    chunks: list[np.ndarray] = []
+    offsets = [0]
+    for name, seq in records:
+        names.append(name)
+        chunks.append(encode_seq(seq))
+        offsets.append(offsets[-1] + len(seq))
+    residues = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.uint8)
+    _save_npy(index_dir / "residues.npy", residues)
+    _save_npy(index_dir / "offsets.npy", np.asarray(offsets, dtype=np.int64))
+    _save_json(index_dir / "names.json", names)
+    return len(names), int(residues.size)
+
+def _build_k(index_dir: Path, k: int) -> None:
+    """k <= 12（更大的 k 共用 k12，見 index_k）"""
+    residues = np.load(index_dir / "residues.npy", mmap_mode="r")
+    offsets  = np.load(index_dir / "offsets.npy")
+    codes = kmer_codes(np.asarray(residues), k)
+    if codes.size:
+        # 跨越兩條序列邊界的 k-mer 要剔除
+        pos = np.arange(codes.size, dtype=np.int64)
+        rec = np.searchsorted(offsets, pos, side="right") - 1
+        keep = pos + k <= offsets[rec + 1]
+        codes, pos = codes[keep], pos[keep]
+        order = np.argsort(codes, kind="stable")
+        codes, pos = codes[order], pos[order].astype(np.uint32)
+    else:
+        pos = np.empty(0, dtype=np.uint32)
+    _save_npy(index_dir / f"k{k}.codes.npy", codes)
+    _save_npy(index_dir / f"k{k}.pos.npy", pos)
+
+
+def _ensure_k(index_dir: Path, meta: dict, k: int) -> dict:
+    """
+    （拿著檔案鎖）k 的檔案沒有就建；meta["ks"] 依最近使用排序，超過 MAX_INDEX_KS 就刪最久沒用的。
+    別的 process 還 memmap 著的檔案在 POSIX 上照樣能用；Windows 刪不掉就留到下次再清。
+    """
+    fk = index_k(k)
+    ks = [x for x in meta.get("ks", []) if x != fk]
+    if fk not in meta.get("ks", []):
+        _build_k(index_dir, fk)
+    ks.append(fk)
+    while len(ks) > max(1, MAX_INDEX_KS):
+        old = ks[0]
+        try:
+            for part in ("codes", "pos"):
+                (index_dir / f"k{old}.{part}.npy").unlink(missing_ok=True)
+        except OSError:
+            break
+        ks.pop(0)
+    return {**meta, "ks": ks}
+
+
+_lock = threading.Lock()
+_open: dict[tuple[str, int], tuple[dict, KmerIndex]] = {}
+
+def get_index(fasta_path: Union[str, Path], k: int, index_dir: Optional[Union[str, Path]] = None) -> KmerIndex:
+    """
+    取得（必要時建立）fasta_path 在 k 下的索引。
+    同一 process 內會快取已開啟的索引；FASTA 有變動才重建。
+    建索引與改 meta.json 都拿著 .lock 檔案鎖，多個 worker process 同時要同一個索引時排隊。
+    """
+    from .mme_pipline import parse_fasta  # 避免循環 import
+    from .proteome import is_proteome
+
+    fasta = Path(fasta_path)
+    if is_proteome(fasta) and index_dir is None:
+        return _get_proteome_index(fasta, k)
+    idx_dir = Path(index_dir) if index_dir is not None else default_index_dir(fasta)
+    stat_fp = _stat_fingerprint(fasta)
+    key = (str(idx_dir.resolve()), k)
+
+    with _lock:
+        cached = _open.get(key)
+        if cached is not None and cached[0] == stat_fp:
+            return cached[1]
+
+        with _file_lock(idx_dir / ".lock"):
+            meta_path = idx_dir / "meta.json"
+            meta = json.loads(meta_path.read_text(encoding="utf-8")) if meta_path.exists() else {}
+            if meta.get("size") != stat_fp["size"] or meta.get("mtime_ns") != stat_fp["mtime_ns"]:
+                sha = _sha256(fasta)
+                if meta.get("sha256") == sha:
+                    # 只是被 touch，內容沒變：更新指紋即可
+                    meta.update(stat_fp)
+                else:
+                    for old in idx_dir.glob("k*.npy"):
+                        old.unlink()
+                    _build_residues(idx_dir, parse_fasta(fasta))
+                    meta = {"fasta": fasta.name, "sha256": sha, "ks": [], **stat_fp}
+
+            meta = _ensure_k(idx_dir, meta, k)
+            _save_json(meta_path, meta)
+            index = KmerIndex(idx_dir, k)     # 鎖還在：別的 process 不會在開檔前把它刪掉
+
+        _open[key] = (stat_fp, index)
+        return index
+
+def _get_proteome_index(prot_dir: Path, k: int) -> KmerIndex:
+    """
+    來源是 compiled proteome（見 proteome.py）時，residues / offsets / names 已經在目錄裡，
+    k{k}.*.npy 直接建在同一個目錄；建過哪些 k 記在 kmers.json（proteome 重新編譯就全部作廢）。
+    """
+    stat_fp = _stat_fingerprint(prot_dir / "residues.npy")
+    key = (str(prot_dir.resolve()), k)
+
+    with _lock:
+        cached = _open.get(key)
+        if cached is not None and cached[0] == stat_fp:
+            return cached[1]
+
+        with _file_lock(prot_dir / "kmers.lock"):
+            kmeta_path = prot_dir / "kmers.json"
+            kmeta = json.loads(kmeta_path.read_text(encoding="utf-8")) if kmeta_path.exists() else {}
+            if kmeta.get("size") != stat_fp["size"] or kmeta.get("mtime_ns") != stat_fp["mtime_ns"]:
+                for old in prot_dir.glob("k*.npy"):
+                    old.unlink()
+                kmeta = {"ks": [], **stat_fp}
+
+            kmeta = _ensure_k(prot_dir, kmeta, k)
+            _save_json(kmeta_path, kmeta)
+            index = KmerIndex(prot_dir, k)
+
+        _open[key] = (stat_fp, index)
+        return index
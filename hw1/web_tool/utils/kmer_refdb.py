@@ -0,0 +1,122 @@
+# web_tool/utils/kmer_refdb.py
+# -*- coding: utf-8 -*-
+"""
+SQLite backend 用的常駐 human k-mer 參考庫（建一次、之後每次只 join）。
+
+預設檔案：FASTA 旁邊的 <fasta>.kmers.sqlite3（compiled proteome 則放在目錄裡的 kmers.sqlite3）
+    ref_meta(key, value)                     來源指紋（size / mtime_ns）與已建好的 k（依最近使用排序）
+    proteins(pid, name, length)              human 序列名稱 / 長度（順序與 parse_fasta 相同）
+    human_kmers(k, kmer, pid, kmer_start)    WITHOUT ROWID，主鍵 (k, kmer, pid, kmer_start)
+                                             → 資料本身就依 (k, kmer) 叢集，join 時直接走主鍵
+來源的 size / mtime 變了就整份清掉重建；某個 k 第一次被用到時才建那個 k。
+多個 worker 同時要建同一個 k 時靠 BEGIN IMMEDIATE 排隊，拿到寫鎖後再確認一次。
+最多留 MAX_REFDB_KS 個 k，建新的 k 時刪掉最久沒用的（刪掉的頁留給之後的 k 重用，檔案不會再長）。
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Iterable, Optional, Union
+import json, sqlite3
+
+from .kmer_index import _stat_fingerprint
+from .proteome import is_proteome
+
+REFDB_SUFFIX = ".kmers.sqlite3"
+INSERT_CHUNK = 50_000
+MAX_REFDB_KS = 4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ref_meta(key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS proteins(pid INTEGER PRIMARY KEY, name TEXT NOT NULL, length INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS human_kmers(
+    k INTEGER NOT NULL, kmer TEXT NOT NULL, pid INTEGER NOT NULL, kmer_start INTEGER NOT NULL,
+    PRIMARY KEY (k, kmer, pid, kmer_start)
+) WITHOUT ROWID;
+"""
+
+
+def default_refdb_path(human_src: Union[str, Path]) -> Path:
+    p = Path(human_src)
+    if is_proteome(p):
+        return p / "kmers.sqlite3"
+    return p.with_name(p.name + REFDB_SUFFIX)
+
+def _source_fingerprint(human_src: Path) -> dict:
+    return _stat_fingerprint(human_src / "residues.npy" if is_proteome(human_src) else human_src)
+
+def _get_meta(conn: sqlite3.Connection, key: str, default=None):
+    row = conn.execute("SELECT value FROM ref_meta WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+def _set_meta(conn: sqlite3.Connection, key: str, value) -> None:
+    conn.execute("INSERT OR REPLACE INTO ref_meta(key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+def _insert_chunks(conn: sqlite3.Connection, sql: str, rows: Iterable[tuple], chunk: int = INSERT_CHUNK) -> None:
+    buf = []
+    for r in rows:
+        buf.append(r)
+        if len(buf) >= chunk:
+            conn.executemany(sql, buf)
+            buf.clear()
+    if buf:
+        conn.executemany(sql, buf)
+
+def _build(conn: sqlite3.Connection, human_src: Path, k: int, fp: dict) -> None:
+    """在已取得寫鎖的交易裡：來源變了就重建 proteins，再補上這個 k 的 k-mer"""
+    from .mme_pipline import parse_fasta  # 避免循環 import
+
+    if _get_meta(conn, "source") != fp:
+        conn.execute("DELETE FROM human_kmers")
+        conn.execute("DELETE FROM proteins")
+        _set_meta(conn, "ks", [])
+        _insert_chunks(conn, "INSERT INTO proteins(pid, name, length) VALUES (?,?,?)",
+                       ((pid, name, len(seq)) for pid, (name, seq) in enumerate(parse_fasta(human_src))))
+        _set_meta(conn, "source", fp)
+
+    rows = (
+        (k, seq[s:s + k], pid, s + 1)
+        for pid, (_, seq) in enumerate(parse_fasta(human_src))
+        for s in range(max(0, len(seq) - k + 1))
+    )
+    ks = [x for x in _get_meta(conn, "ks", []) if x != k]
+    # 先清掉最久沒用的 k，讓新的 k 重用那些頁
+    while len(ks) >= max(1, MAX_REFDB_KS):
+        conn.execute("DELETE FROM human_kmers WHERE k = ?", (ks.pop(0),))
+    conn.execute("DELETE FROM human_kmers WHERE k = ?", (k,))
+    _insert_chunks(conn, "INSERT INTO human_kmers(k, kmer, pid, kmer_start) VALUES (?,?,?,?)", rows)
+    _set_meta(conn, "ks", ks + [k])
+
+def _ready(conn: sqlite3.Connection, k: int, fp: dict) -> bool:
+    return _get_meta(conn, "source") == fp and k in _get_meta(conn, "ks", [])
+
+def open_refdb(human_src: Union[str, Path], k: int, db_path: Optional[Union[str, Path]] = None) -> sqlite3.Connection:
+    """
+    開啟（必要時建立）human_src 在 k 下的參考庫，回傳連線（呼叫端負責 close）。
+    human_src 必須是 FASTA 檔或 compiled proteome 目錄。
+    """
+    src = Path(human_src)
+    db = Path(db_path) if db_path is not None else default_refdb_path(src)
+    fp = _source_fingerprint(src)
+
+    conn = sqlite3.connect(db, timeout=600, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA temp_store=MEMORY;")
+        conn.executescript(_SCHEMA)
+        if not _ready(conn, k, fp) or _get_meta(conn, "ks", [])[-1] != k:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if not _ready(conn, k, fp):   # 等鎖期間別的 worker 可能已經建好
+                    print(f"⚠️ 建立 SQLite k-mer 參考庫（k={k}）：{db}", flush=True)
+                    _build(conn, src, k, fp)
+                else:
+                    # 已經有了：只把 k 移到最近使用（淘汰順序用）
+                    _set_meta(conn, "ks", [x for x in _get_meta(conn, "ks", []) if x != k] + [k])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    except BaseException:
+        conn.close()
+        raise
+    return conn
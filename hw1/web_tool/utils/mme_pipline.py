@@ -4,11 +4,18 @@ from __future__ import annotations
 from pathlib import Path
 from typing import Iterable, Tuple, Union, IO, Optional
 from io import StringIO
+from array import array
 import time, sqlite3, re
+import numpy as np
 import pandas as pd
 
-# 型別：路徑或已開啟的文字檔
-LineSource = Union[str, Path, IO[str]]
+from .kmer_index import MAX_PACK_K, encode_seq, decode_residues, kmer_codes, verify_tail, get_index
+from .proteome import CompiledProteome, is_proteome, load_proteome
+from .kmer_refdb import _insert_chunks, open_refdb
+from .bulk_load import bulk_insert, ensure_result_indexes, replace_job_rows
+
+# 型別：路徑（FASTA 或 compiled proteome 目錄）、已開啟的文字檔、或 CompiledProteome
+LineSource = Union[str, Path, IO[str], CompiledProteome]
 
 # ---------- 共用：支援 path 或 file-like ----------
 def _iter_lines(src: LineSource) -> Iterable[str]:
@@ -21,11 +28,58 @@ def _iter_lines(src: LineSource) -> Iterable[str]:
         for line in f:
             yield line.rstrip("\r\n")
 
-def find_common_sqlite(query_src: LineSource, human_src: LineSource, k: int, tmp_db=":memory:") -> pd.DataFrame:
+def _kmer_rows(query_src: LineSource, k: int):
+    return (
+        (name, L, s+1, s+k, seq[s:s+k], k)
+        for name, seq in parse_fasta(query_src)
+        for L in (len(seq),)
+        for s in range(max(0, L-k+1))
+    )
+
+def _find_common_refdb(query_src: LineSource, human_src: Union[str, Path], k: int,
+                       ref_db: Optional[Union[str, Path]] = None) -> pd.DataFrame:
+    """human 端查常駐參考庫（kmer_refdb.py）；每次只把 query k-mer 塞進 TEMP 表再 join"""
+    conn = open_refdb(human_src, k, db_path=ref_db)
+    try:
+        conn.execute("""CREATE TEMP TABLE query_kmers(
+            query_protein_name TEXT, query_protein_length INT,
+            kmer_start INT, kmer_end INT, kmer TEXT, k INT
+        );""")
+        conn.execute("BEGIN")
+        _insert_chunks(conn, "INSERT INTO temp.query_kmers VALUES (?,?,?,?,?,?)", _kmer_rows(query_src, k))
+        conn.execute("COMMIT")
+
+        # human_kmers 的主鍵就是 (k, kmer, ...)，每個 query k-mer 直接走主鍵查
+        sql = """
+        SELECT
+            q.kmer AS "MME(query)",
+            h.kmer AS "MME(hit)",
+            q.query_protein_name, q.query_protein_length,
+            q.k AS "length_of_MME(query)",
+            q.kmer_start AS "MME(query)_start", q.kmer_end AS "MME(query)_end",
+            p.name AS hit_human_protein_name, p.length AS hit_human_protein_length,
+            h.k AS "length_of_MME(hit)",
+            h.kmer_start AS "MME(hit)_start", h.kmer_start + h.k - 1 AS "MME(hit)_end"
+        FROM temp.query_kmers q
+        JOIN human_kmers h ON h.k = q.k AND h.kmer = q.kmer
+        JOIN proteins p    ON p.pid = h.pid;
+        """
+        return pd.read_sql(sql, conn)
+    finally:
+        conn.close()
+
+def find_common_sqlite(query_src: LineSource, human_src: LineSource, k: int, tmp_db=":memory:",
+                       ref_db: Optional[Union[str, Path]] = None) -> pd.DataFrame:
     """
-    在 SQLite 內建兩張暫存表 (query_kmers, human_kmers)，建立索引後用 SQL join 取交集。
+    human 是檔案路徑（FASTA 或 compiled proteome）時：human k-mer 表常駐在參考庫（建一次），
+    這裡只插入 query k-mer 再 join（ref_db 可指定參考庫位置）。
+    human 是 file-like 時沒地方落地，照舊在 tmp_db 內建兩張暫存表 (query_kmers, human_kmers) 再 join。
     適合大型 FASTA，省 RAM。
     """
+    human_src = _as_path(human_src)
+    if isinstance(human_src, (str, Path)):
+        return _find_common_refdb(query_src, human_src, k, ref_db=ref_db)
+
     conn = sqlite3.connect(tmp_db)
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
@@ -42,36 +96,9 @@ def find_common_sqlite(query_src: LineSource, human_src: LineSource, k: int, tmp
         );""")
 
         # 分批插入（避免一次塞爆記憶體）
-        def _insert_kmers(cur, table, rows, chunk=50_000):
-            buf = []
-            for r in rows:
-                buf.append(r)
-                if len(buf) >= chunk:
-                    cur.executemany(
-                        f"INSERT INTO {table} VALUES (?,?,?,?,?,?)", buf)
-                    buf.clear()
-            if buf:
-                cur.executemany(
-                    f"INSERT INTO {table} VALUES (?,?,?,?,?,?)", buf)
-
-        # 產 query k-mers → insert
-        q_rows = (
-            (name, L, s+1, s+k, seq[s:s+k], k)
-            for name, seq in parse_fasta(query_src)
-            for L in (len(seq),)
-            for s in range(max(0, L-k+1))
-        )
         cur = conn.cursor()
-        _insert_kmers(cur, "query_kmers", q_rows)
-
-        # 產 human k-mers → insert
-        h_rows = (
-            (name, L, s+1, s+k, seq[s:s+k], k)
-            for name, seq in parse_fasta(human_src)
-            for L in (len(seq),)
-            for s in range(max(0, L-k+1))
-        )
-        _insert_kmers(cur, "human_kmers", h_rows)
+        _insert_chunks(cur, "INSERT INTO query_kmers VALUES (?,?,?,?,?,?)", _kmer_rows(query_src, k))
+        _insert_chunks(cur, "INSERT INTO human_kmers VALUES (?,?,?,?,?,?)", _kmer_rows(human_src, k))
 
         # 索引（關鍵：kmer + k）
         cur.execute("CREATE INDEX IF NOT EXISTS ix_q ON query_kmers(kmer, k);")
@@ -97,6 +124,11 @@ def find_common_sqlite(query_src: LineSource, human_src: LineSource, k: int, tmp
     finally:
         conn.close()
 
+def _categorical(names: list[str], idx: np.ndarray) -> pd.Categorical:
+    """名稱只存一次：codes + 排序過的 categories（排序 / 比較結果與字串欄位相同）"""
+    uniq, inv = np.unique(np.asarray(names, dtype=object).astype(str), return_inverse=True)
+    return pd.Categorical.from_codes(inv[idx] if idx.size else idx, categories=uniq)
+
 def find_common_ac(query_src: LineSource, human_src: LineSource, k: int) -> pd.DataFrame:
     try:
         import ahocorasick  # pip install pyahocorasick
@@ -105,33 +137,148 @@ def find_common_ac(query_src: LineSource, human_src: LineSource, k: int) -> pd.D
         return find_common_sqlite(query_src, human_src, k)
 
     # 1) 建 AC：只用查詢序列的所有長度 k 的 k-mer
-    A = ahocorasick.Automaton()
-    # value: (kmer_str, query_protein_name, query_protein_length, start, end)
-    for q_name, q_seq in parse_fasta(query_src):
+    #    value: (k-mer 編號, ((query 編號, start), ...))；同一個 k-mer 出現多次時全部保留
+    q_names: list[str] = []
+    q_lens = array("i")
+    occ: dict[str, list[tuple[int, int]]] = {}
+    for qi, (q_name, q_seq) in enumerate(parse_fasta(query_src)):
         Lq = len(q_seq)
+        q_names.append(q_name)
+        q_lens.append(Lq)
         for s in range(max(0, Lq - k + 1)):
-            km = q_seq[s:s+k]
-            # 允許多重鍵，value 用 list
-            A.add_word(km, (km, q_name, Lq, s+1, s+k))
+            occ.setdefault(q_seq[s:s+k], []).append((qi, s + 1))
+    kmers = list(occ)
+    A = ahocorasick.Automaton()
+    for kid, km in enumerate(kmers):
+        A.add_word(km, (kid, tuple(occ[km])))
+    del occ
     A.make_automaton()
 
-    # 2) 掃人類序列；命中即輸出
-    rows = []
-    for h_name, h_seq in parse_fasta(human_src):
-        Lh = len(h_seq)
-        for end_idx, (km, q_name, Lq, qs, qe) in A.iter(h_seq):
-            he = end_idx + 1           # 1-based
-            hs = he - k + 1
-            rows.append({
-                "MME(query)": km, "MME(hit)": km,
-                "query_protein_name": q_name, "query_protein_length": Lq,
-                "length_of_MME(query)": k, "MME(query)_start": qs, "MME(query)_end": qe,
-                "hit_human_protein_name": h_name, "hit_human_protein_length": Lh,
-                "length_of_MME(hit)": k, "MME(hit)_start": hs, "MME(hit)_end": he,
-            })
-    return pd.DataFrame(rows)
+    # 2) 掃人類序列；命中只記整數（typed array），名稱 / 長度各存一份在查表
+    h_names: list[str] = []
+    h_lens = array("i")
+    kid_col, qi_col, qs_col, hi_col, hs_col = (array("i") for _ in range(5))
+    for hi, (h_name, h_seq) in enumerate(parse_fasta(human_src)):
+        h_names.append(h_name)
+        h_lens.append(len(h_seq))
+        for end_idx, (kid, hits) in A.iter(h_seq):
+            hs = end_idx - k + 2       # 1-based
+            for qi, qs in hits:
+                kid_col.append(kid); qi_col.append(qi); qs_col.append(qs)
+                hi_col.append(hi); hs_col.append(hs)
+
+    if not kid_col:
+        return pd.DataFrame(columns=MME_COLUMNS)
+
+    # 3) 最後才由欄位組 DataFrame（protein 名稱 / k-mer 用 categorical）
+    kid, qi, qs, hi, hs, q_len, h_len = (
+        np.frombuffer(a, dtype=np.int32) for a in (kid_col, qi_col, qs_col, hi_col, hs_col, q_lens, h_lens)
+    )
+    kmer = _categorical(kmers, kid)
+    k_col = np.full(kid.size, k, dtype=np.int32)
+    return pd.DataFrame({
+        "MME(query)": kmer, "MME(hit)": kmer.copy(),
+        "query_protein_name": _categorical(q_names, qi),
+        "query_protein_length": q_len[qi],
+        "length_of_MME(query)": k_col, "MME(query)_start": qs, "MME(query)_end": qs + (k - 1),
+        "hit_human_protein_name": _categorical(h_names, hi),
+        "hit_human_protein_length": h_len[hi],
+        "length_of_MME(hit)": k_col.copy(), "MME(hit)_start": hs, "MME(hit)_end": hs + (k - 1),
+    })
+
+def _as_path(src: LineSource) -> LineSource:
+    """CompiledProteome 物件換回它的目錄路徑（才能走預建索引 / 平行掃描的判斷）"""
+    return src.path if isinstance(src, CompiledProteome) else src
+
+def _encode_records(src: LineSource):
+    """把 FASTA 讀成 (names, 串接的 residues, offsets)，給 packed / index 兩條路共用"""
+    if is_proteome(src):
+        # 編譯好的 proteome：直接拿 memmap，不 parse
+        prot = load_proteome(src)
+        return prot.names, prot.residues, np.asarray(prot.offsets, dtype=np.int64)
+    names: list[str] = []
+    chunks: list[np.ndarray] = []
+    offsets = [0]
+    for name, seq in parse_fasta(src):
+        names.append(name)
+        chunks.append(encode_seq(seq))
+        offsets.append(offsets[-1] + len(seq))
+    res = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.uint8)
+    return names, res, np.asarray(offsets, dtype=np.int64)
+
+def _record_kmer_codes(res: np.ndarray, offsets: np.ndarray, k: int):
+    """每條序列各自取 k-mer code（不跨序列），回傳 (codes, 全域起點)"""
+    codes = kmer_codes(res, k)
+    if codes.size == 0:
+        return codes, np.empty(0, dtype=np.int64)
+    pos = np.arange(codes.size, dtype=np.int64)
+    rec = np.searchsorted(offsets, pos, side="right") - 1
+    keep = pos + k <= offsets[rec + 1]
+    return codes[keep], pos[keep]
+
+def _probe_index(q_res: np.ndarray, q_offsets: np.ndarray, human_path: Union[str, Path], k: int,
+                 index_dir: Optional[Union[str, Path]] = None):
+    """query 的每個 k-mer 查 human 索引，回傳 (q_pos, h_pos, index)"""
+    index = get_index(human_path, k, index_dir=index_dir)
+    q_codes, q_gpos = _record_kmer_codes(q_res, q_offsets, k)
+
+    q_idx, h_pos = index.probe(q_codes)
+    q_pos = q_gpos[q_idx]
+    if k > MAX_PACK_K and q_pos.size:
+        ok = verify_tail(q_res, q_pos, index.residues, h_pos, k)
+        q_pos, h_pos = q_pos[ok], h_pos[ok]
+    return q_pos, h_pos, index
+
+def _probe_packed(q_res: np.ndarray, q_offsets: np.ndarray,
+                  h_res: np.ndarray, h_offsets: np.ndarray, k: int):
+    """兩邊都是記憶體裡的 residues：human code 排序後 searchsorted join，回傳 (q_pos, h_pos)"""
+    q_codes, q_gpos = _record_kmer_codes(q_res, q_offsets, k)
+    h_codes, h_gpos = _record_kmer_codes(h_res, h_offsets, k)
+
+    order = np.argsort(h_codes, kind="stable")
+    h_codes, h_gpos = h_codes[order], h_gpos[order]
+    lo = np.searchsorted(h_codes, q_codes, side="left")
+    cnt = np.searchsorted(h_codes, q_codes, side="right") - lo
+    total = int(cnt.sum())
+    q_pos = np.repeat(q_gpos, cnt)
+    h_slot = np.repeat(lo - (np.cumsum(cnt) - cnt), cnt) + np.arange(total, dtype=np.int64)
+    h_pos = h_gpos[h_slot]
+    if k > MAX_PACK_K and q_pos.size:
+        ok = verify_tail(q_res, q_pos, h_res, h_pos, k)
+        q_pos, h_pos = q_pos[ok], h_pos[ok]
+    return q_pos, h_pos
+
+def _diagonal_run_lengths(q_pos: np.ndarray, h_pos: np.ndarray,
+                          q_offsets: np.ndarray, h_offsets: np.ndarray) -> np.ndarray:
+    """
+    每個 k-mer 命中 (q, h) 沿對角線往後連續命中的個數（含自己）：
+    r 個連續 k-mer 命中 ⇔ 從 (q, h) 開始有長度 k + r - 1 的完全匹配，
+    所以 (q, h) 也是 k' 命中 ⇔ r >= k' - k + 1。
+    """
+    n = q_pos.size
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    q_rec = np.searchsorted(q_offsets, q_pos, side="right") - 1
+    h_rec = np.searchsorted(h_offsets, h_pos, side="right") - 1
+    diag = h_pos - q_pos
+    order = np.lexsort((q_pos, diag, h_rec, q_rec))
+    q, d = q_pos[order], diag[order]
+    qr, hr = q_rec[order], h_rec[order]
+
+    brk = np.ones(n, dtype=bool)
+    brk[1:] = (qr[1:] != qr[:-1]) | (hr[1:] != hr[:-1]) | (d[1:] != d[:-1]) | (q[1:] != q[:-1] + 1)
+    starts = np.flatnonzero(brk)
+    run_end = np.append(starts[1:], n)[np.cumsum(brk) - 1]
+    out = np.empty(n, dtype=np.int64)
+    out[order] = run_end - np.arange(n)
+    return out
+
 # ---------- 1) FASTA 讀取 + 產生 k-mer ----------
 def parse_fasta(src: LineSource) -> Iterable[Tuple[str, str]]:
+    if is_proteome(src):
+        # 已正規化過，逐筆 decode 即可
+        yield from load_proteome(src).iter_records()
+        return
     name: Optional[str] = None
     seq_chunks: list[str] = []
     for s in _iter_lines(src):
@@ -196,7 +343,23 @@ def find_common_df(query_df: pd.DataFrame, human_df: pd.DataFrame) -> pd.DataFra
     return m
 
 # ---------- 3) 將連續 (+1,+1) 的 match 串接 ----------
-def stitch_consecutive(common_df: pd.DataFrame) -> pd.DataFrame:
+MME_COLUMNS = [
+    "MME(query)", "MME(hit)",
+    "query_protein_name", "query_protein_length",
+    "length_of_MME(query)", "MME(query)_start", "MME(query)_end",
+    "hit_human_protein_name", "hit_human_protein_length",
+    "length_of_MME(hit)", "MME(hit)_start", "MME(hit)_end",
+]
+
+def stitch_consecutive(common_df: pd.DataFrame, query_seqs: Optional[dict[str, str]] = None) -> pd.DataFrame:
+    """
+    全欄位化（columnar）的串接：每組只取 first / last / size，不再逐組建 dict。
+    query_seqs（{query_protein_name: 序列}）有給就直接用 start/end 切原序列；
+    沒給就用「第一個 k-mer + 後續每列的最後一個字」還原，結果相同。
+    """
+    if common_df.empty:
+        return pd.DataFrame(columns=MME_COLUMNS)
+
     df = common_df.sort_values(
         by=["hit_human_protein_name", "query_protein_name", "MME(hit)_start", "MME(query)_start"],
         kind="mergesort",
@@ -207,55 +370,194 @@ def stitch_consecutive(common_df: pd.DataFrame) -> pd.DataFrame:
         & df["query_protein_name"].eq(df["query_protein_name"].shift())
     )
     is_break = ~(same_pair & df["MME(hit)_start"].diff().eq(1) & df["MME(query)_start"].diff().eq(1))
-    group_id = is_break.cumsum()
-
-    out = []
-    for _, g in df.groupby(group_id, sort=False):
-        first = g.iloc[0]
-        if len(g) == 1:
-            length = int(first.get("length_of_MME(query)", 1))
-            out.append({
-                "MME(query)": first["MME(query)"],
-                "MME(hit)": first["MME(hit)"],
-                "query_protein_name": first["query_protein_name"],
-                "query_protein_length": int(first["query_protein_length"]),
-                "length_of_MME(query)": length,
-                "MME(query)_start": int(first["MME(query)_start"]),
-                "MME(query)_end": int(first["MME(query)_end"]),
-                "hit_human_protein_name": first["hit_human_protein_name"],
-                "hit_human_protein_length": int(first["hit_human_protein_length"]),
-                "length_of_MME(hit)": length,
-                "MME(hit)_start": int(first["MME(hit)_start"]),
-                "MME(hit)_end": int(first["MME(hit)_end"]),
-            })
-            continue
 
-        kmer0 = first["MME(query)"]
-        merged = kmer0 + "".join(mm[-1] for mm in g["MME(query)"].iloc[1:])
-        length = len(merged)
-        qs = int(first["MME(query)_start"])
-        hs = int(first["MME(hit)_start"])
-        out.append({
-            "MME(query)": merged, "MME(hit)": merged,
-            "query_protein_name": first["query_protein_name"],
-            "query_protein_length": int(first["query_protein_length"]),
-            "length_of_MME(query)": length, "MME(query)_start": qs, "MME(query)_end": qs + length - 1,
-            "hit_human_protein_name": first["hit_human_protein_name"],
-            "hit_human_protein_length": int(first["hit_human_protein_length"]),
-            "length_of_MME(hit)": length, "MME(hit)_start": hs, "MME(hit)_end": hs + length - 1,
-        })
-
-    out_df = pd.DataFrame(out).sort_values(
+    # 每組的 first / last / size
+    first = np.flatnonzero(is_break.to_numpy())
+    last  = np.append(first[1:], len(df)) - 1
+    size  = last - first + 1
+    multi = size > 1
+
+    kmer  = df["MME(query)"].to_numpy(dtype=object)
+    qname = df["query_protein_name"].to_numpy(dtype=object)[first]
+    qs = df["MME(query)_start"].to_numpy(dtype=np.int64)[first]
+    hs = df["MME(hit)_start"].to_numpy(dtype=np.int64)[first]
+
+    # 單列組沿用原本的長度 / end；多列組長度 = 第一個 k-mer 長度 + (size - 1)
+    length = df["length_of_MME(query)"].to_numpy(dtype=np.int64)[first].copy()
+    q_end  = df["MME(query)_end"].to_numpy(dtype=np.int64)[first].copy()
+    h_end  = df["MME(hit)_end"].to_numpy(dtype=np.int64)[first].copy()
+    mme_q  = kmer[first].copy()
+    mme_h  = df["MME(hit)"].to_numpy(dtype=object)[first].copy()
+
+    if multi.any():
+        m_first, m_last = first[multi], last[multi]
+        k0 = np.fromiter((len(x) for x in kmer[m_first]), dtype=np.int64, count=m_first.size)
+        m_len = k0 + size[multi] - 1
+        if query_seqs is not None:
+            merged = [query_seqs[n][q - 1:q - 1 + L]
+                      for n, q, L in zip(qname[multi], qs[multi].tolist(), m_len.tolist())]
+        else:
+            tails = "".join(df["MME(query)"].str[-1].tolist())
+            merged = [kmer[f] + tails[f + 1:l + 1]
+                      for f, l in zip(m_first.tolist(), m_last.tolist())]
+        merged = np.asarray(merged, dtype=object)
+        length[multi] = m_len
+        q_end[multi] = qs[multi] + m_len - 1
+        h_end[multi] = hs[multi] + m_len - 1
+        mme_q[multi] = merged
+        mme_h[multi] = merged
+
+    out_df = pd.DataFrame({
+        "MME(query)": mme_q, "MME(hit)": mme_h,
+        "query_protein_name": qname,
+        "query_protein_length": df["query_protein_length"].to_numpy(dtype=np.int64)[first],
+        "length_of_MME(query)": length, "MME(query)_start": qs, "MME(query)_end": q_end,
+        "hit_human_protein_name": df["hit_human_protein_name"].to_numpy(dtype=object)[first],
+        "hit_human_protein_length": df["hit_human_protein_length"].to_numpy(dtype=np.int64)[first],
+        "length_of_MME(hit)": length.copy(), "MME(hit)_start": hs, "MME(hit)_end": h_end,
+    }).sort_values(
         by=["MME(query)", "MME(hit)_start"], kind="mergesort"
     ).reset_index(drop=True)
     return out_df
 
+# ---------- 3b) MEM 模式：整數 seed 直接延伸，不產生逐 k-mer 的 common DataFrame ----------
+def _name_ranks(names) -> np.ndarray:
+    """每筆 record 名稱在「排序後唯一名稱」中的名次；整數比較等同名稱字串比較"""
+    if not len(names):
+        return np.empty(0, dtype=np.int64)
+    _, inv = np.unique(np.asarray(names, dtype=object).astype(str), return_inverse=True)
+    return inv.astype(np.int64)
+
+def _extend_seeds(
+    k: int,
+    q_names, q_res, q_offsets, q_pos,
+    h_names, h_offsets, h_pos,
+    diagonal: bool = False,
+) -> pd.DataFrame:
+    """
+    把長度 k 的 seed（query / human 全域位置）延伸成最長匹配，直接輸出 stitch_consecutive 的欄位。
+    預設（diagonal=False）的延伸規則與 stitch_consecutive 完全相同：依
+    (hit 名, query 名, hit 起點, query 起點) 排序後，相鄰且兩邊都 +1 才接起來，
+    所以在重複序列區（同一個 hit 位置對到多個 query 位置）也會切成一樣的列。
+    diagonal=True 則沿對角線延伸，得到真正的 maximal exact match（重複區的列會比較少、比較長）。
+    """
+    n = q_pos.size
+    if n == 0:
+        return pd.DataFrame(columns=MME_COLUMNS)
+
+    q_rec = np.searchsorted(q_offsets, q_pos, side="right") - 1
+    h_rec = np.searchsorted(h_offsets, h_pos, side="right") - 1
+    qs = q_pos - q_offsets[q_rec] + 1
+    hs = h_pos - h_offsets[h_rec] + 1
+
+    if diagonal:
+        order = np.lexsort((qs, hs - qs, q_rec, h_rec))
+        g1, g2 = h_rec[order], q_rec[order]
+    else:
+        hn, qn = _name_ranks(h_names)[h_rec], _name_ranks(q_names)[q_rec]
+        order = np.lexsort((qs, hs, qn, hn))
+        g1, g2 = hn[order], qn[order]
+    o_qs, o_hs = qs[order], hs[order]
+
+    brk = np.ones(n, dtype=bool)
+    brk[1:] = ~((g1[1:] == g1[:-1]) & (g2[1:] == g2[:-1])
+                & (o_hs[1:] == o_hs[:-1] + 1) & (o_qs[1:] == o_qs[:-1] + 1))
+    first = np.flatnonzero(brk)
+    size = np.diff(np.append(first, n))
+    f = order[first]
+    length = (k + size - 1).astype(np.int64)
+
+    # 同一個 (query 位置, 長度) 只 decode 一次（k 小時大多是重複的單一 k-mer）
+    key = q_pos[f] * (int(length.max()) + 1) + length
+    uniq, inv = np.unique(key, return_inverse=True)
+    u_pos, u_len = np.divmod(uniq, int(length.max()) + 1)
+    mme = np.array([decode_residues(q_res[p:p + L]) for p, L in zip(u_pos.tolist(), u_len.tolist())],
+                   dtype=object)[inv]
+    q_len = np.diff(q_offsets)
+    h_len = np.diff(h_offsets)
+    f_qs, f_hs = qs[f].astype(np.int64), hs[f].astype(np.int64)
+
+    return pd.DataFrame({
+        "MME(query)": mme, "MME(hit)": mme.copy(),
+        "query_protein_name": np.asarray(q_names, dtype=object)[q_rec[f]],
+        "query_protein_length": q_len[q_rec[f]].astype(np.int64),
+        "length_of_MME(query)": length, "MME(query)_start": f_qs, "MME(query)_end": f_qs + length - 1,
+        "hit_human_protein_name": np.asarray(h_names, dtype=object)[h_rec[f]],
+        "hit_human_protein_length": h_len[h_rec[f]].astype(np.int64),
+        "length_of_MME(hit)": length.copy(), "MME(hit)_start": f_hs, "MME(hit)_end": f_hs + length - 1,
+    }).sort_values(
+        by=["MME(query)", "MME(hit)_start"], kind="mergesort"
+    ).reset_index(drop=True)
+
+def find_mems(query_src: LineSource, human_src: LineSource, min_len: int, diagonal: bool = False,
+              use_index: Optional[bool] = None, index_dir: Optional[Union[str, Path]] = None) -> pd.DataFrame:
+    """
+    長度 >= min_len 的完全匹配（MEM 模式）：以 min_len 的 k-mer 命中當 seed（只有整數位置），
+    直接延伸成 stitched 列；不建逐 k-mer 的 common DataFrame、也不產生 k-mer 字串。
+    use_index=None 時 human 是檔案路徑就查預建索引，否則 packed join。
+    預設輸出與 stitch_consecutive(find_common_*(..., k=min_len)) 相同（見 _extend_seeds）。
+    """
+    q_names, q_res, q_offsets = _encode_records(query_src)
+    human_src = _as_path(human_src)
+    if use_index is None:
+        use_index = isinstance(human_src, (str, Path))
+    if use_index:
+        q_pos, h_pos, index = _probe_index(q_res, q_offsets, human_src, min_len, index_dir=index_dir)
+        h_names, h_offsets = index.names, np.asarray(index.offsets)
+    else:
+        h_names, h_res, h_offsets = _encode_records(human_src)
+        q_pos, h_pos = _probe_packed(q_res, q_offsets, h_res, h_offsets, min_len)
+    return _extend_seeds(min_len, q_names, q_res, q_offsets, q_pos,
+                         h_names, h_offsets, h_pos, diagonal=diagonal)
+
 # ---------- 4) 一條龍：完全不落地 ----------
-def run_pipeline(query_src: LineSource, human_src: LineSource, k: int = 6, backend: str = "auto") -> pd.DataFrame:
-    assert isinstance(k, int) and k > 0, "k 必須是正整數"
+def run_pipeline(query_src: LineSource, human_src: LineSource, k: Union[int, Iterable[int]] = 6,
+                 backend: str = "auto", workers: int = 1, memo_db: Optional[str] = None) -> pd.DataFrame:
+    """
+    backend：
+      auto    human 是檔案路徑（FASTA / compiled proteome）→ 同 index；file-like → pandas（記憶體不夠退 sqlite）
+      index   find_mems + 預建的 human k-mer 索引（kmer_index.py；human 不是路徑時退回 packed join）
+      mem     同 index（舊名稱）
+      packed  find_mems + 記憶體內 packed join（不建 / 不查索引）
+      ac      Aho-Corasick 掃 human（find_common_ac）→ stitch_consecutive
+      sqlite  SQLite join（human 是路徑時查常駐參考庫 kmer_refdb.py）→ stitch_consecutive
+      pandas  kmers_df + find_common_df → stitch_consecutive
+    各 backend 輸出相同。
+    workers > 1 且 backend 是 packed / ac、human 是檔案路徑時，human 依 record 切段平行掃描
+    （見 parallel_scan.py）；預建索引那條路本身就不掃 human，workers 不影響。
+    memo_db 給了、human 是檔案路徑時，逐蛋白記住結果（見 protein_memo.py），只算沒看過的序列。
+    """
+    if memo_db is not None and isinstance(_as_path(human_src), (str, Path)):
+        from .protein_memo import memo_run
+        try:
+            return memo_run(query_src, _as_path(human_src), k, backend=backend, workers=workers, db_path=memo_db)
+        except sqlite3.Error as e:
+            # memo 庫壞了 / 打不開：照常整份算
+            print(f"⚠️ 逐蛋白快取無法使用：{e}", flush=True)
+            if hasattr(query_src, "seek"):
+                query_src.seek(0)
+    if not isinstance(k, (int, np.integer)):
+        # 一次給多個 k → 走 multi-k（回傳多一欄 k）
+        return run_pipeline_multi_k(query_src, human_src, k, backend=backend)
+    k = int(k)
+    assert k > 0, "k 必須是正整數"
     t0 = time.time()
+    human_src = _as_path(human_src)
+
+    # compiled proteome 本身就不用 parse，不必再切段平行
+    if (workers > 1 and backend in ("packed", "ac") and isinstance(human_src, (str, Path))
+            and not is_proteome(human_src)):
+        from .parallel_scan import find_mems_parallel
+        stitched = find_mems_parallel(query_src, human_src, k, workers, method=backend)
+        stitched.attrs["elapsed_sec"] = time.time() - t0
+        return stitched
 
-    if backend == "ac":
+    if backend in ("index", "packed", "mem") or (backend == "auto" and isinstance(human_src, (str, Path))):
+        # 整數 seed 直接延伸（MEM 模式）；human 是檔案路徑時查預建索引（第一次會建好並落地）
+        stitched = find_mems(query_src, human_src, k, use_index=None if backend != "packed" else False)
+        stitched.attrs["elapsed_sec"] = time.time() - t0
+        return stitched
+    elif backend == "ac":
         common = find_common_ac(query_src, human_src, k)
     elif backend == "sqlite":
         common = find_common_sqlite(query_src, human_src, k)
@@ -272,6 +574,71 @@ def run_pipeline(query_src: LineSource, human_src: LineSource, k: int = 6, backe
     stitched.attrs["elapsed_sec"] = time.time() - t0
     return stitched
 
+def run_pipeline_multi_k(query_src: LineSource, human_src: LineSource, ks: Iterable[int],
+                         backend: str = "auto") -> pd.DataFrame:
+    """
+    一次算多個 k：兩邊 FASTA 只讀 / 編碼一次，只對最小的 k 做一次 join。
+    每個 (k+1)-mer 命中都是兩個相鄰 k-mer 命中，所以較大的 k' 直接由
+    最小 k 命中的對角線連續長度篩出（_diagonal_run_lengths），再各自延伸（_extend_seeds）；
+    結果與逐一用單一 k 跑完全相同。
+    human 是檔案路徑時查預建索引，否則用 packed join（ac / sqlite 在這裡也走 packed）。
+    回傳各 k 的結果依 k 由小到大串接，最前面多一欄 k。
+    """
+    ks = sorted({int(x) for x in ks})
+    assert ks and ks[0] > 0, "k 必須是正整數"
+    k0 = ks[0]
+    t0 = time.time()
+
+    q_names, q_res, q_offsets = _encode_records(query_src)
+    human_src = _as_path(human_src)
+    if backend in ("auto", "index", "mem") and isinstance(human_src, (str, Path)):
+        q_pos, h_pos, index = _probe_index(q_res, q_offsets, human_src, k0)
+        h_names, h_res, h_offsets = index.names, index.residues, np.asarray(index.offsets)
+    else:
+        h_names, h_res, h_offsets = _encode_records(human_src)
+        q_pos, h_pos = _probe_packed(q_res, q_offsets, h_res, h_offsets, k0)
+    run = _diagonal_run_lengths(q_pos, h_pos, q_offsets, h_offsets)
+
+    parts = []
+    for k in ks:
+        keep = run >= k - k0 + 1
+        part = _extend_seeds(k, q_names, q_res, q_offsets, q_pos[keep],
+                             h_names, h_offsets, h_pos[keep])
+        part.insert(0, "k", k)
+        parts.append(part)
+    out = pd.concat(parts, ignore_index=True)
+    out.attrs["elapsed_sec"] = time.time() - t0
+    return out
+
+def parse_k_list(text: str, max_k: int = 1000, max_count: int = 50) -> list[int]:
+    """
+    解析表單的 k：'6'、'5,6,7'、'5 7 9'、'5-9' 都可以。
+    格式錯誤或超出範圍丟 ValueError（訊息可直接回給使用者）。
+    """
+    ks: set[int] = set()
+    for tok in re.split(r"[\s,，;；]+", (text or "").strip()):
+        if not tok:
+            continue
+        m = re.fullmatch(r"(\d+)\s*-\s*(\d+)", tok)
+        if m:
+            lo, hi = int(m.group(1)), int(m.group(2))
+            if lo > hi:
+                raise ValueError(f"k 範圍寫反了：{tok}")
+            if hi - lo + 1 > max_count:
+                raise ValueError(f"一次最多 {max_count} 個 k")
+            ks.update(range(lo, hi + 1))
+        elif tok.isdigit():
+            ks.add(int(tok))
+        else:
+            raise ValueError("k-mer 必須是整數（多個可用逗號分隔，或寫成 5-9）")
+    if not ks:
+        raise ValueError("請輸入 k-mer 長度")
+    if len(ks) > max_count:
+        raise ValueError(f"一次最多 {max_count} 個 k")
+    if min(ks) < 1 or max(ks) > max_k:
+        raise ValueError(f"k-mer 必須介於 1 到 {max_k} 之間")
+    return sorted(ks)
+
 # ---------- 輔助：DataFrame -> JSON / CSV ----------
 def df_to_records(df: pd.DataFrame, limit: Optional[int] = None):
     if limit is not None:
@@ -301,20 +668,22 @@ def _sanitize_columns(df: pd.DataFrame) -> pd.DataFrame:
     out.columns = [re.sub(r'[^0-9a-zA-Z_]+', '_', c).strip('_').lower() for c in out.columns]
     return out
 
-def save_append(df: pd.DataFrame, db_path="results.sqlite3", table="mme_result", chunksize=50_000) -> int:
+def save_append(df: pd.DataFrame, db_path="results.sqlite3", table="mme_result", chunksize=50_000,
+                job_id: Optional[str] = None) -> int:
+    """
+    append 到 table（走 bulk_load：一個交易 + executemany，不用 to_sql）。
+    給 job_id 時以 job_id 分區（同一個 job 重跑會先清掉舊列）；chunksize 只為相容舊呼叫保留。
+    """
     t0 = time.time()
     sdf = _sanitize_columns(df)
+    # 常用索引：寫完才補、已存在就跳過
+    indexes = {name: f'"{c}"' for name, c in ((f"ix_{table}_kmer_q", "mme_query"), (f"ix_{table}_kmer_h", "mme_hit"))
+               if c in sdf.columns}
     with sqlite3.connect(db_path) as conn:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA synchronous=NORMAL;")
-        conn.execute("PRAGMA foreign_keys=ON;")
-        sdf.to_sql(table, conn, if_exists="append", index=False, chunksize=chunksize, method="multi")
-        # 可選：建立常用索引（只建立一次即可；失敗忽略）
-        try:
-            conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_kmer_q ON {table}("mme_query");')
-            conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_kmer_h ON {table}("mme_hit");')
-        except Exception:
-            pass
+        if job_id is not None:
+            replace_job_rows(conn, table, sdf, job_id, indexes=indexes)
+        else:
+            bulk_insert(conn, table, sdf, indexes=indexes)
     added = int(len(sdf))
     df.attrs["save_elapsed_sec"] = time.time() - t0
     return added
@@ -0,0 +1,146 @@
+# web_tool/utils/parallel_scan.py
+# -*- coding: utf-8 -*-
+"""
+human proteome 平行掃描：human FASTA 依 record 切成幾段 byte 範圍，分給 ProcessPoolExecutor。
+query 端（排序好的 k-mer code，或 AC automaton）只在 worker 啟動時給一次：
+fork 下直接共用父行程記憶體，spawn（Windows）下每個 worker 反序列化一次。
+各段回傳整數命中 (query 全域位置, human 段內位置)，父行程合併後交給 _extend_seeds。
+"""
+from __future__ import annotations
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Union
+import io, multiprocessing as mp, os
+
+import numpy as np
+import pandas as pd
+
+from .fasta_index import get_fasta_index
+from .kmer_index import MAX_PACK_K, decode_residues, verify_tail
+from .mme_pipline import LineSource, _encode_records, _record_kmer_codes, _extend_seeds
+
+SHARDS_PER_WORKER = 4   # 切細一點，長短不一的 record 才不會讓某個 worker 拖到最後
+
+_STATE: dict = {}
+
+
+def fasta_shards(path: Union[str, Path], n: int) -> list[tuple[int, int]]:
+    """
+    把 FASTA 切成約 n 段 [start, end) byte 範圍，每段都從 '>' 開頭（不會切斷 record）。
+    切點直接取 .fai 裡的 record 邊界，並依殘基數（而不是 byte 數）平均分配工作量。
+    """
+    idx = get_fasta_index(path)
+    recs = idx.records
+    if not recs:
+        return []
+    lens = np.array([r.length for r in recs], dtype=np.int64)
+    cum = np.cumsum(lens)
+    total = int(cum[-1])
+    cut_recs = {0}
+    if total > 0:
+        targets = total * np.arange(1, max(1, n), dtype=np.int64) // max(1, n)
+        cut_recs.update(np.searchsorted(cum, targets, side="right").tolist())
+    edges = sorted({idx.header_offset(i) for i in cut_recs if i < len(recs)} | {recs[-1].end})
+    return [(a, b) for a, b in zip(edges, edges[1:]) if b > a]
+
+def _concat(xs: list[np.ndarray]) -> np.ndarray:
+    return np.concatenate(xs) if xs else np.empty(0, dtype=np.int64)
+
+def _read_range(path: str, start: int, end: int) -> io.StringIO:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return io.StringIO(f.read(end - start).decode("utf-8", errors="ignore"))
+
+def _init_worker(state: dict) -> None:
+    global _STATE
+    _STATE = state
+
+def _scan_shard(rng: tuple[int, int]):
+    """掃一段 human：回傳 (names, lengths, q_pos, 段內 h_pos)"""
+    st = _STATE
+    k = st["k"]
+    names, h_res, h_offsets = _encode_records(_read_range(st["path"], *rng))
+
+    if st["method"] == "ac":
+        q_hits, h_hits = array("q"), array("q")
+        A = st["automaton"]
+        for r in range(len(names)):
+            seq = decode_residues(h_res[h_offsets[r]:h_offsets[r + 1]])
+            base = int(h_offsets[r]) - k + 1
+            for end_idx, q_list in A.iter(seq):
+                q_hits.extend(q_list)
+                h_hits.extend([base + end_idx] * len(q_list))
+        q_pos = np.frombuffer(q_hits, dtype=np.int64) if q_hits else np.empty(0, dtype=np.int64)
+        h_pos = np.frombuffer(h_hits, dtype=np.int64) if h_hits else np.empty(0, dtype=np.int64)
+    else:
+        q_codes, q_sorted_pos = st["q_codes"], st["q_pos"]
+        h_codes, h_gpos = _record_kmer_codes(h_res, h_offsets, k)
+        lo = np.searchsorted(q_codes, h_codes, side="left")
+        cnt = np.searchsorted(q_codes, h_codes, side="right") - lo
+        total = int(cnt.sum())
+        h_pos = np.repeat(h_gpos, cnt)
+        q_slot = np.repeat(lo - (np.cumsum(cnt) - cnt), cnt) + np.arange(total, dtype=np.int64)
+        q_pos = q_sorted_pos[q_slot]
+
+    if k > MAX_PACK_K and q_pos.size:
+        ok = verify_tail(st["q_res"], q_pos, h_res, h_pos, k)
+        q_pos, h_pos = q_pos[ok], h_pos[ok]
+    return names, np.diff(h_offsets), q_pos, h_pos
+
+def _query_state(q_res: np.ndarray, q_offsets: np.ndarray, k: int, method: str) -> dict:
+    state = {"k": k, "q_res": q_res, "method": method}
+    codes, gpos = _record_kmer_codes(q_res, q_offsets, k)
+    if method == "ac":
+        import ahocorasick  # pip install pyahocorasick
+        # 同一個 k-mer 在 query 出現多次時，value 放全部位置（不會互相覆蓋）
+        order = np.argsort(codes, kind="stable")
+        codes, gpos = codes[order], gpos[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if codes.size else np.empty(0, np.int64)
+        A = ahocorasick.Automaton()
+        for a, b in zip(starts.tolist(), np.append(starts[1:], codes.size).tolist()):
+            p = int(gpos[a])
+            A.add_word(decode_residues(q_res[p:p + k]), tuple(gpos[a:b].tolist()))
+        A.make_automaton()
+        state["automaton"] = A
+    else:
+        order = np.argsort(codes, kind="stable")
+        state["q_codes"], state["q_pos"] = codes[order], gpos[order]
+    return state
+
+def parallel_seeds(q_res: np.ndarray, q_offsets: np.ndarray, human_path: Union[str, Path], k: int,
+                   workers: int, method: str = "packed"):
+    """回傳 (q_pos, h_pos, h_names, h_offsets)，h_* 為合併後整份 human 的全域座標"""
+    if method == "ac":
+        try:
+            import ahocorasick  # noqa: F401
+        except ImportError:
+            method = "packed"
+    state = _query_state(q_res, q_offsets, k, method)
+    state["path"] = str(human_path)
+    shards = fasta_shards(human_path, max(1, workers) * SHARDS_PER_WORKER)
+
+    ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(state,)) as ex:
+        parts = list(ex.map(_scan_shard, shards))
+
+    names: list[str] = []
+    lens, q_all, h_all = [], [], []
+    base = 0
+    for p_names, p_lens, q_pos, h_pos in parts:
+        names.extend(p_names)
+        lens.append(p_lens)
+        q_all.append(q_pos)
+        h_all.append(h_pos + base)
+        base += int(p_lens.sum())
+    h_offsets = np.concatenate([[0], np.cumsum(_concat(lens))]).astype(np.int64)
+    return _concat(q_all), _concat(h_all), names, h_offsets
+
+def find_mems_parallel(query_src: LineSource, human_path: Union[str, Path], k: int, workers: int,
+                       method: str = "packed", diagonal: bool = False) -> pd.DataFrame:
+    """find_mems 的平行版（human 必須是檔案路徑）；輸出與單一 process 相同"""
+    q_names, q_res, q_offsets = _encode_records(query_src)
+    q_pos, h_pos, h_names, h_offsets = parallel_seeds(q_res, q_offsets, human_path, k, workers, method)
+    return _extend_seeds(k, q_names, q_res, q_offsets, q_pos,
+                         h_names, h_offsets, h_pos, diagonal=diagonal)
@@ -0,0 +1,229 @@
+# web_tool/utils/protein_memo.py
+# -*- coding: utf-8 -*-
+"""
+以「單一 query 蛋白」為單位記住 MME 結果，跨 job 共用。
+
+stitched 結果的每一列只跟「一條 query 序列 × 整份 human」有關，所以可以拆開存：
+    protein_memo(ref, k, seq_hash, n_rows, hits, hit_names)
+      hits      ：zlib 壓縮的 int64 陣列 (n_rows, 4) = (MME 長度, query 起點, hit 名稱編號, hit 起點)
+      hit_names ：JSON [[名稱, 長度], ...]，hits 第三欄指向這裡
+    沒有命中的序列也記（n_rows = 0），下次就不用再算；MME 字串由 query 序列切回來，不另外存。
+ref 是 human 參考的指紋（FASTA 與它編譯出的 proteome 相同）+ MEMO_VERSION；參考換了舊資料全部作廢。
+
+memo_run：query 依序列 hash 去重 → 只把沒算過的序列丟給 run_pipeline →
+cached + 新算的結果依原本的 query 名稱組回來，排序與直接跑 run_pipeline 相同。
+"""
+from __future__ import annotations
+from contextlib import closing
+from io import StringIO
+from pathlib import Path
+from typing import Iterable, Optional, Union
+import hashlib, json, sqlite3, time, zlib
+
+import numpy as np
+import pandas as pd
+
+from .mme_pipline import LineSource, MME_COLUMNS, parse_fasta, run_pipeline
+from .proteome import source_fingerprint
+
+DB_PATH = r"C:\Users\ethan\Desktop\碩班\暑假\web_hw\web_hw\hw1\hw1\iedb_result.sqlite3"
+
+MEMO_VERSION = 1
+_IN_CHUNK = 500     # SQLite 參數上限內，一次查幾個 hash
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS protein_memo (
+    ref TEXT NOT NULL, k INTEGER NOT NULL, seq_hash TEXT NOT NULL,
+    n_rows INTEGER NOT NULL, hits BLOB, hit_names TEXT, created_at REAL NOT NULL,
+    UNIQUE (ref, k, seq_hash)
+);
+"""
+
+_HIT_COLS = 4   # (MME 長度, query 起點, hit 名稱編號, hit 起點)
+
+
+def seq_hash(seq: str) -> str:
+    return hashlib.sha256(seq.encode("ascii")).hexdigest()[:32]
+
+def ref_key(human_src: Union[str, Path]) -> str:
+    payload = {"v": MEMO_VERSION, "human": source_fingerprint(human_src)}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def _chunks(xs: list, n: int = _IN_CHUNK) -> Iterable[list]:
+    for i in range(0, len(xs), n):
+        yield xs[i:i + n]
+
+
+# ---------- 讀 / 寫 ----------
+def _pack(part: pd.DataFrame) -> tuple[bytes, str]:
+    """單一序列的 stitched 列 → (hits blob, hit_names JSON)"""
+    names = part["hit_human_protein_name"].astype(str).to_numpy(object)
+    uniq, first, inv = np.unique(names, return_index=True, return_inverse=True)
+    h_len = part["hit_human_protein_length"].to_numpy(np.int64)[first]
+    arr = np.column_stack([
+        part["length_of_MME(query)"].to_numpy(np.int64),
+        part["MME(query)_start"].to_numpy(np.int64),
+        inv.astype(np.int64),
+        part["MME(hit)_start"].to_numpy(np.int64),
+    ])
+    hit_names = json.dumps([[n, int(L)] for n, L in zip(uniq.tolist(), h_len.tolist())], ensure_ascii=False)
+    return zlib.compress(np.ascontiguousarray(arr).tobytes(), 1), hit_names
+
+def _unpack(n_rows: int, blob: Optional[bytes], hit_names: Optional[str]):
+    if not n_rows:
+        return np.empty((0, _HIT_COLS), dtype=np.int64), []
+    arr = np.frombuffer(zlib.decompress(blob), dtype=np.int64).reshape(n_rows, _HIT_COLS)
+    return arr, json.loads(hit_names)
+
+def _rows(ref: str, k: int, hashes: list[str], stitched: pd.DataFrame) -> list[tuple]:
+    """stitched 的 query_protein_name 是 seq_hash（memo_run 丟進 run_pipeline 時換掉的名稱）"""
+    groups = dict(tuple(stitched.groupby(stitched["query_protein_name"].astype(str), sort=False))) \
+        if len(stitched) else {}
+    now = time.time()
+    rows = []
+    for h in hashes:
+        part = groups.get(h)
+        if part is None:
+            rows.append((ref, k, h, 0, None, None, now))
+        else:
+            blob, names = _pack(part)
+            rows.append((ref, k, h, len(part), blob, names, now))
+    return rows
+
+def _store(conn: sqlite3.Connection, rows: list[tuple]) -> None:
+    conn.executemany(
+        "INSERT OR REPLACE INTO protein_memo (ref, k, seq_hash, n_rows, hits, hit_names, created_at) "
+        "VALUES (?,?,?,?,?,?,?)", rows)
+
+def _load(conn: sqlite3.Connection, ref: str, k: int, hashes: list[str]) -> dict:
+    out = {}
+    for part in _chunks(hashes):
+        marks = ",".join("?" * len(part))
+        for h, n, blob, names in conn.execute(
+                "SELECT seq_hash, n_rows, hits, hit_names FROM protein_memo "
+                f"WHERE ref = ? AND k = ? AND seq_hash IN ({marks})", (ref, k, *part)):
+            out[h] = _unpack(n, blob, names)
+    return out
+
+
+# ---------- 組回 stitched ----------
+def _ranks(values) -> np.ndarray:
+    """每個值在「排序後唯一值」中的名次；整數名次比較等同字串比較（只對少量唯一值做字串排序）"""
+    if not len(values):
+        return np.empty(0, dtype=np.int64)
+    _, inv = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return inv.astype(np.int64).ravel()
+
+def _assemble(recs: list[tuple[str, str]], hashes: list[str], memo: dict) -> pd.DataFrame:
+    """依 query record 順序展開（同一條序列出現在多筆 record 時各自展開），再用整數 key 排序"""
+    # hit 名稱：各序列各自的小表 → 全域名次 / 名稱 / 長度
+    all_names = sorted({n for arr, names in memo.values() for n, _ in names})
+    g_id = {n: i for i, n in enumerate(all_names)}
+    g_len = np.zeros(len(all_names), dtype=np.int64)
+    local = {}
+    for h, (arr, names) in memo.items():
+        ids = np.asarray([g_id[n] for n, _ in names], dtype=np.int64)
+        if len(names):
+            g_len[ids] = [L for _, L in names]
+        local[h] = ids
+
+    rec_idx, arrs, hit_id = [], [], []
+    for i, h in enumerate(hashes):
+        arr, _ = memo[h]
+        if not len(arr):
+            continue
+        rec_idx.append(np.full(len(arr), i, dtype=np.int64))
+        arrs.append(arr)
+        hit_id.append(local[h][arr[:, 2]])
+    if not arrs:
+        return pd.DataFrame(columns=MME_COLUMNS)
+
+    ri = np.concatenate(rec_idx)
+    arr = np.concatenate(arrs)
+    length, qs, hs = arr[:, 0], arr[:, 1], arr[:, 3]
+    hid = np.concatenate(hit_id)             # all_names 已排序：編號就是名次
+    q_names = np.asarray([n for n, _ in recs], dtype=object)
+    q_lens = np.asarray([len(seq) for _, seq in recs], dtype=np.int64)
+
+    # MME 字串由 query 序列切回來；同一條序列（重複序列共用）的同一段只切一次
+    first_rec: dict[str, int] = {}
+    for i, h in enumerate(hashes):
+        first_rec.setdefault(h, i)
+    seq_id = np.asarray([first_rec[h] for h in hashes], dtype=np.int64)[ri]
+    key = np.ravel_multi_index((seq_id, qs, length), (len(recs), int(qs.max()) + 1, int(length.max()) + 1))
+    _, first, key_inv = np.unique(key, return_index=True, return_inverse=True)
+    key_inv = key_inv.ravel()
+    uniq_mme = np.array([recs[ri[j]][1][qs[j] - 1:qs[j] - 1 + length[j]] for j in first.tolist()], dtype=object)
+    mme_rank = _ranks(uniq_mme)[key_inv]
+
+    order = np.lexsort((qs, _ranks(q_names)[ri], hid, hs, mme_rank))
+    ri, length, qs, hs, hid = ri[order], length[order], qs[order], hs[order], hid[order]
+    mme = uniq_mme[key_inv[order]]
+    return pd.DataFrame({
+        "MME(query)": mme, "MME(hit)": mme,
+        "query_protein_name": q_names[ri], "query_protein_length": q_lens[ri],
+        "length_of_MME(query)": length, "MME(query)_start": qs, "MME(query)_end": qs + length - 1,
+        "hit_human_protein_name": np.asarray(all_names, dtype=object)[hid], "hit_human_protein_length": g_len[hid],
+        "length_of_MME(hit)": length.copy(), "MME(hit)_start": hs, "MME(hit)_end": hs + length - 1,
+    })
+
+def memo_run(query_src: LineSource, human_src: Union[str, Path], k, backend: str = "auto",
+             workers: int = 1, db_path: str = DB_PATH) -> pd.DataFrame:
+    """
+    run_pipeline 的逐蛋白記憶版（human 必須是 FASTA 或 compiled proteome 的路徑）。
+    只重算沒看過的序列；輸出與 run_pipeline(query_src, human_src, k) 相同。
+    """
+    t0 = time.time()
+    multi = not isinstance(k, (int, np.integer))
+    ks = sorted({int(x) for x in k}) if multi else [int(k)]
+
+    recs = list(parse_fasta(query_src))
+    hashes = [seq_hash(seq) for _, seq in recs]
+    uniq = dict(zip(hashes, (seq for _, seq in recs)))
+    todo = list(uniq)
+    ref = ref_key(human_src)
+
+    # 寫鎖只拿一下子：跑 run_pipeline（整份 human 掃描）的時候不能握著共用 DB 的寫入交易
+    # 1) 清掉舊 ref、讀出已經記住的序列，commit
+    with closing(sqlite3.connect(db_path, timeout=30)) as conn:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.executescript(_DDL)
+        with conn:
+            # 參考資料換了：舊 ref 的記錄已經不會再命中，直接清掉
+            conn.execute("DELETE FROM protein_memo WHERE ref <> ?", (ref,))
+        memo = {kk: _load(conn, ref, kk, todo) for kk in ks}
+
+    # 2) 不開連線，只算差集；名稱換成 seq_hash，存的時候才知道是哪條序列
+    missing = sorted({h for kk in ks for h in todo if h not in memo[kk]})
+    if missing:
+        fasta = StringIO("".join(f">{h}\n{uniq[h]}\n" for h in missing))
+        fresh = run_pipeline(fasta, human_src, k=ks if multi else ks[0], backend=backend, workers=workers)
+        rows = []
+        for kk in ks:
+            part_rows = _rows(ref, kk, missing, fresh[fresh["k"] == kk] if multi else fresh)
+            memo[kk].update({h: _unpack(n, blob, names) for _, _, h, n, blob, names, _ in part_rows})
+            rows += part_rows
+
+        # 3) 新結果用另一個短的 BEGIN IMMEDIATE 交易寫回
+        with closing(sqlite3.connect(db_path, timeout=30, isolation_level=None)) as conn:
+            conn.execute("PRAGMA synchronous=NORMAL;")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                _store(conn, rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    pieces = []
+    for kk in ks:
+        part = _assemble(recs, hashes, memo[kk])
+        if multi:
+            part.insert(0, "k", kk)
+        pieces.append(part)
+
+    out = pd.concat(pieces, ignore_index=True) if multi else pieces[0]
+    out.attrs["elapsed_sec"] = time.time() - t0
+    out.attrs["memo_fresh"] = len(missing)
+    out.attrs["memo_cached"] = len(todo) - len(missing)
+    return out
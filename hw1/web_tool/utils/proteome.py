@@ -0,0 +1,142 @@
+# web_tool/utils/proteome.py
+# -*- coding: utf-8 -*-
+"""
+編譯好的參考蛋白體（compiled proteome）：FASTA 先正規化（大寫、只留 A-Z）再存成 binary，
+之後每次跑 pipeline 直接 np.load(mmap_mode="r")，不用再 decode / strip / regex 整個 human.fasta。
+
+目錄結構（預設放在 FASTA 旁邊：human.fasta.prot/，由 manage.py compile_proteome 產生）：
+    meta.json      format / 來源 FASTA 指紋（size / mtime_ns / sha256）/ record 數 / 殘基數
+    residues.npy   全部序列串接的 uint8（A=1 … Z=26，與 kmer_index 相同編碼）
+    offsets.npy    每條序列在 residues 的起點（int64，長度 n+1）
+    names.json     序列名稱（與 parse_fasta 的 name 一致）
+
+mme_pipline 的所有 backend 都接受這個目錄當 human 來源：
+packed / index / MEM 直接拿 memmap 的整數陣列，ac / sqlite / pandas 逐筆 decode（不再清理）。
+"""
+from __future__ import annotations
+from pathlib import Path
+from threading import Lock
+from typing import Iterable, Iterator, Optional, Tuple, Union
+import json
+
+import numpy as np
+
+from .kmer_index import _build_residues, _save_json, _sha256, _stat_fingerprint, decode_residues
+
+PROTEOME_SUFFIX = ".prot"
+PROTEOME_FORMAT = "mme-proteome"
+PROTEOME_VERSION = 1
+
+
+class CompiledProteome:
+    """唯讀：residues 是 memmap，names / offsets 整份讀進記憶體（都很小）"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / "meta.json").read_text(encoding="utf-8"))
+        self.names: list[str] = json.loads((self.path / "names.json").read_text(encoding="utf-8"))
+        self.residues = np.load(self.path / "residues.npy", mmap_mode="r")
+        self.offsets = np.load(self.path / "offsets.npy")
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def sequence(self, i: int) -> str:
+        return decode_residues(self.residues[self.offsets[i]:self.offsets[i + 1]])
+
+    def iter_records(self) -> Iterator[Tuple[str, str]]:
+        """與 parse_fasta 相同的 (name, seq)，但不用再清理字元"""
+        for i, name in enumerate(self.names):
+            yield name, self.sequence(i)
+
+
+def default_proteome_dir(fasta_path: Union[str, Path]) -> Path:
+    p = Path(fasta_path)
+    return p.with_name(p.name + PROTEOME_SUFFIX)
+
+def is_proteome(src) -> bool:
+    """src 是 CompiledProteome，或是含 meta.json（format = mme-proteome）的目錄"""
+    if isinstance(src, CompiledProteome):
+        return True
+    if not isinstance(src, (str, Path)):
+        return False
+    meta_path = Path(src) / "meta.json"
+    if not meta_path.is_file():
+        return False
+    try:
+        return json.loads(meta_path.read_text(encoding="utf-8")).get("format") == PROTEOME_FORMAT
+    except (OSError, ValueError):
+        return False
+
+
+def write_proteome(out_dir: Union[str, Path], records: Iterable[Tuple[str, str]], **meta) -> dict:
+    """records 是已正規化的 (name, seq)；meta.json 最後才寫，寫到一半中斷不會被當成完整的 proteome"""
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    n_records, n_residues = _build_residues(out, records)
+    meta = {"format": PROTEOME_FORMAT, "version": PROTEOME_VERSION,
+            "records": n_records, "residues": n_residues, **meta}
+    _save_json(out / "meta.json", meta)
+    return meta
+
+def compile_proteome(fasta_path: Union[str, Path], out_dir: Optional[Union[str, Path]] = None) -> Path:
+    """human.fasta → human.fasta.prot/（整份 FASTA 只在這裡 parse 一次）"""
+    from .mme_pipline import parse_fasta  # 避免循環 import
+
+    fasta = Path(fasta_path)
+    out = Path(out_dir) if out_dir is not None else default_proteome_dir(fasta)
+    meta_path = out / "meta.json"
+    if meta_path.exists():
+        meta_path.unlink()   # 先讓舊的失效，重寫中途不會被 is_proteome 誤認
+    write_proteome(out, parse_fasta(fasta), fasta=fasta.name, sha256=_sha256(fasta), **_stat_fingerprint(fasta))
+    return out
+
+
+def source_fingerprint(human_src: Union[str, Path]) -> dict:
+    """human 來源的指紋（size / mtime_ns）；compiled proteome 回傳它的來源 FASTA 的指紋，兩者互通"""
+    src = Path(human_src)
+    if is_proteome(src):
+        meta = json.loads((src / "meta.json").read_text(encoding="utf-8"))
+        return {"size": meta.get("size"), "mtime_ns": meta.get("mtime_ns")}
+    return _stat_fingerprint(src)
+
+
+# ---------- 快取 ----------
+_lock = Lock()
+_open: dict[str, tuple[int, CompiledProteome]] = {}
+
+def load_proteome(src: Union[str, Path, CompiledProteome]) -> CompiledProteome:
+    """同一個 process 內只開一次；meta.json 有更新（重新編譯過）才重開"""
+    if isinstance(src, CompiledProteome):
+        return src
+    path = Path(src)
+    stamp = (path / "meta.json").stat().st_mtime_ns
+    key = str(path.resolve())
+    with _lock:
+        cached = _open.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        prot = CompiledProteome(path)
+        _open[key] = (stamp, prot)
+        return prot
+
+def resolve_human_source(fasta_path: Union[str, Path]) -> Path:
+    """
+    FASTA 旁邊有編譯好、而且跟目前 FASTA 一致（size / mtime_ns 相同）的 proteome 就用它，
+    否則照舊回傳 FASTA 路徑。
+    """
+    fasta = Path(fasta_path)
+    prot = default_proteome_dir(fasta)
+    if not is_proteome(prot):
+        return fasta
+    if not fasta.exists():
+        return prot       # 只部署編譯好的 proteome、沒放原始 FASTA 也可以跑
+    try:
+        meta = json.loads((prot / "meta.json").read_text(encoding="utf-8"))
+        fp = _stat_fingerprint(fasta)
+    except (OSError, ValueError):
+        return fasta
+    if meta.get("size") == fp["size"] and meta.get("mtime_ns") == fp["mtime_ns"]:
+        return prot
+    print(f"⚠️ {prot.name} 與 {fasta.name} 不一致，請重新執行 manage.py compile_proteome", flush=True)
+    return fasta
@@ -0,0 +1,193 @@
+# web_tool/utils/result_cache.py
+# -*- coding: utf-8 -*-
+"""
+MME + IEDB 結果快取（content-addressed）。
+
+key = sha256(正規化後的 query records、k、human 參考指紋、IEDB CSV 指紋、RESULT_CACHE_VERSION)
+    - query 先經 parse_fasta（大寫、只留 A-Z、名稱去頭尾空白），換行 / 大小寫不同的同一份 FASTA 會命中
+    - human 指紋用來源 FASTA 的 size / mtime_ns（compiled proteome 記的就是它的來源 FASTA），
+      所以 FASTA 與它編譯出來的 proteome 共用快取
+結果不另外存一份：快取只登記「算出這份結果的 job」（result_cache.job_id），
+它的列本來就以 job_id 分區存在 iedb_result 裡（write_job_rows）。
+命中的 job 也不複製，job_artifacts.src_job_id 指向來源 job 的分區（link_cached_result）；
+超過筆數上限時依最後使用時間（LRU）刪登記就好，不搬也不刪任何列。
+來源 job 重跑（分區要被覆蓋）前，release_source 先把掛在它上面的 job 的列複製到它們自己的分區、
+並刪掉它的快取登記（write_job_rows 呼叫）。
+pipeline 輸出格式改了要把 RESULT_CACHE_VERSION 加一，舊快取就自然不會再命中。
+"""
+from __future__ import annotations
+from pathlib import Path
+from typing import Iterable, Optional, Tuple, Union
+import hashlib, json, sqlite3, time
+
+
+from .jobs import register_artifact
+from .kmer_index import _stat_fingerprint
+from .proteome import source_fingerprint
+
+DB_PATH = r"C:\Users\ethan\Desktop\碩班\暑假\web_hw\web_hw\hw1\hw1\iedb_result.sqlite3"
+
+CACHE_TABLE = "result_cache"
+JOB_ROWS_TABLE = "iedb_result"   # 結果列所在的表（以 job_id 分區）
+RESULT_CACHE_VERSION = 2     # 2：登記來源 job 的分區，不再另存 rcache_<key> 表
+MAX_ENTRIES = 200           # 最多留幾份結果
+
+_DDL = f"""
+CREATE TABLE IF NOT EXISTS {CACHE_TABLE} (
+    cache_key  TEXT PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    row_count  INTEGER NOT NULL,
+    params     TEXT,
+    created_at REAL NOT NULL,
+    last_used  REAL NOT NULL,
+    hits       INTEGER NOT NULL DEFAULT 0,
+    job_id     TEXT            -- 來源 job；RESULT_CACHE_VERSION 1 的登記沒有，指的是自己的 rcache_ 表
+);
+CREATE INDEX IF NOT EXISTS ix_{CACHE_TABLE}_lru ON {CACHE_TABLE}(last_used);
+"""
+
+
+# ---------- key ----------
+def query_digest(records: Iterable[Tuple[str, str]]) -> str:
+    """records 是 parse_fasta 的 (name, seq)；順序有差（輸出順序跟著 query）"""
+    h = hashlib.sha256()
+    for name, seq in records:
+        h.update(name.strip().encode("utf-8"))
+        h.update(b"\t")
+        h.update(seq.encode("ascii"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+def reference_fingerprint(human_src: Union[str, Path], iedb_csv: Union[str, Path]) -> dict:
+    return {"human": source_fingerprint(human_src), "iedb": _stat_fingerprint(Path(iedb_csv))}
+
+def result_key(records: Iterable[Tuple[str, str]], k, human_src: Union[str, Path],
+               iedb_csv: Union[str, Path]) -> str:
+    ks = sorted({int(x) for x in k}) if isinstance(k, (list, tuple)) else [int(k)]
+    payload = {
+        "v": RESULT_CACHE_VERSION,
+        "query": query_digest(records),
+        "k": ks,
+        "ref": reference_fingerprint(human_src, iedb_csv),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+# ---------- 讀 / 寫 ----------
+def _ensure_schema(conn: sqlite3.Connection) -> None:
+    conn.executescript(_DDL)
+    cols = {r[1] for r in conn.execute(f"PRAGMA table_info({CACHE_TABLE})")}
+    if "job_id" not in cols:
+        conn.execute(f"ALTER TABLE {CACHE_TABLE} ADD COLUMN job_id TEXT")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{CACHE_TABLE}_job ON {CACHE_TABLE}(job_id)")
+
+def _table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+def _source_rows(conn: sqlite3.Connection, src_job_id: str) -> Optional[int]:
+    """來源 job 的分區還在（job_artifacts 登記的是它自己在 iedb_result 的列）就回傳列數"""
+    if not _table_exists(conn, "job_artifacts"):
+        return None
+    row = conn.execute(
+        "SELECT row_count FROM job_artifacts WHERE job_id = ? AND iedb_table = ? AND src_job_id IS NULL",
+        (src_job_id, JOB_ROWS_TABLE)).fetchone()
+    return None if row is None else row[0]
+
+def cache_lookup(key: str, db_path: str = DB_PATH) -> Optional[str]:
+    """命中就回傳來源 job_id（並更新 LRU 時間），沒有就 None"""
+    with sqlite3.connect(db_path, timeout=30) as conn:
+        _ensure_schema(conn)
+        row = conn.execute(f"SELECT job_id FROM {CACHE_TABLE} WHERE cache_key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[0] is None or _source_rows(conn, row[0]) is None:
+            # 舊格式的登記，或來源 job 的結果已經不在：登記清掉，當作沒命中
+            conn.execute(f"DELETE FROM {CACHE_TABLE} WHERE cache_key = ?", (key,))
+            return None
+        conn.execute(f"UPDATE {CACHE_TABLE} SET last_used = ?, hits = hits + 1 WHERE cache_key = ?",
+                     (time.time(), key))
+        return row[0]
+
+def cache_store(key: str, job_id: str, row_count: int, params: Optional[dict] = None, db_path: str = DB_PATH,
+                max_entries: int = MAX_ENTRIES) -> None:
+    """把 job_id 在 iedb_result 的分區登記成 key 的結果（不複製列），最後做一次 LRU 淘汰"""
+    now = time.time()
+    with sqlite3.connect(db_path, timeout=30) as conn:
+        _ensure_schema(conn)
+        conn.execute(
+            f"INSERT OR REPLACE INTO {CACHE_TABLE} "
+            "(cache_key, table_name, job_id, row_count, params, created_at, last_used, hits) "
+            "VALUES (?,?,?,?,?,?,?,0)",
+            (key, JOB_ROWS_TABLE, job_id, row_count, json.dumps(params or {}, ensure_ascii=False), now, now),
+        )
+        evict(conn, max_entries=max_entries, keep=key)
+
+def link_cached_result(src_job_id: str, job_id: str, db_path: str = DB_PATH) -> Optional[int]:
+    """
+    快取命中：job_artifacts 指向來源 job 的分區（不複製），回傳列數。
+    拿寫鎖後確認來源的結果還在（可能剛好被重跑覆蓋）；已經不在就回傳 None，呼叫端照常重跑。
+    """
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        n = _source_rows(conn, src_job_id)
+        if n is None:
+            conn.execute("ROLLBACK")
+            return None
+        # 同一個 job 送出同一份 query：它自己就是來源，登記不變
+        register_artifact(conn, job_id, JOB_ROWS_TABLE, n, src_job_id=None if src_job_id == job_id else src_job_id)
+        conn.execute("COMMIT")
+        return n
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def release_source(conn: sqlite3.Connection, job_id: str) -> int:
+    """
+    job_id 的分區要被覆蓋前呼叫（跟覆蓋放在同一個交易裡）：
+    刪掉以它為來源的快取登記；指著它的 job 把目前的列複製到自己的分區。回傳複製了幾個 job。
+    """
+    if _table_exists(conn, CACHE_TABLE):
+        _ensure_schema(conn)
+        conn.execute(f"DELETE FROM {CACHE_TABLE} WHERE job_id = ?", (job_id,))
+    if not _table_exists(conn, "job_artifacts"):
+        return 0
+    linked = [r[0] for r in conn.execute(
+        "SELECT job_id FROM job_artifacts WHERE src_job_id = ? AND job_id <> ?", (job_id, job_id))]
+    if not linked:
+        return 0
+    cols = [r[1] for r in conn.execute(f'PRAGMA table_info("{JOB_ROWS_TABLE}")') if r[1] != "job_id"]
+    col_sql = ", ".join(f'"{c}"' for c in cols)
+    for dst in linked:
+        conn.execute(
+            f'INSERT INTO "{JOB_ROWS_TABLE}" ({col_sql}, job_id) '
+            f'SELECT {col_sql}, ? FROM "{JOB_ROWS_TABLE}" WHERE job_id = ? ORDER BY rowid',
+            (dst, job_id))
+        conn.execute("UPDATE job_artifacts SET src_job_id = NULL WHERE job_id = ?", (dst,))
+    return len(linked)
+
+def evict(conn: sqlite3.Connection, max_entries: int = MAX_ENTRIES, keep: Optional[str] = None) -> int:
+    """
+    從最久沒用的開始刪登記，直到筆數在上限內（keep 那筆不刪）；回傳刪掉幾筆。
+    結果列屬於來源 job，不動；只有舊格式（自己的 rcache_ 表）且沒有 job 指著的才 DROP。
+    """
+    rows = conn.execute(
+        f"SELECT cache_key, table_name, job_id FROM {CACHE_TABLE} ORDER BY last_used DESC"
+    ).fetchall()
+    n_entries = len(rows)
+    dropped = 0
+    for cache_key, table, job_id in reversed(rows):
+        if n_entries <= max_entries:
+            break
+        if cache_key == keep:
+            continue
+        conn.execute(f"DELETE FROM {CACHE_TABLE} WHERE cache_key = ?", (cache_key,))
+        if job_id is None and table != JOB_ROWS_TABLE and not (
+                _table_exists(conn, "job_artifacts") and conn.execute(
+                    "SELECT 1 FROM job_artifacts WHERE iedb_table = ?", (table,)).fetchone()):
+            conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        n_entries -= 1
+        dropped += 1
+    return dropped
@@ -0,0 +1,316 @@
+# web_tool/utils/summary_tables.py
+# -*- coding: utf-8 -*-
+"""
+View by Epitope / Query / Reference 的預先彙總表。
+
+作法：
+  1) 三張「去重基底表」(sum_*_base) 存各頁 SQL 裡 SELECT DISTINCT 的那一層，UNIQUE INDEX 去重；
+  2) 三張彙總表 (summary_by_*) 以 epitope / query / hit 為 key；
+  3) 以 iedb_result 的 rowid 當水位線（summary_state），每次只處理新寫入的列，
+     並只重算這批列碰到的 key —— 成本跟本批大小有關，跟歷史總量無關。
+  4) 刪列（同一個 job 重跑：bulk_load.replace_job_rows）時 SQLite 會重用 rowid，新列不一定在水位線之上，
+     舊列也不會自己從基底表消失；所以刪之前 / 寫完之後都把這個 job 碰到的 key 記進 summary_dirty，
+     下次 refresh 時這些 key 的基底列整組從來源表重新取，再重算彙總。
+全量重建：python manage.py rebuild_summaries
+單一 job 的彙總（?job_id=）不走這些表：job_summary_sql 直接從該 job 的列即時算，成本只跟 job 大小有關。
+"""
+from __future__ import annotations
+import sqlite3
+
+DB_PATH   = r"C:\Users\ethan\Desktop\碩班\暑假\web_hw\web_hw\hw1\hw1\iedb_result.sqlite3"
+TABLE_ENR = "iedb_result"
+
+SUM_EPITOPE   = "summary_by_epitope"
+SUM_QUERY     = "summary_by_query"
+SUM_REFERENCE = "summary_by_reference"
+
+_DDL = f"""
+CREATE TABLE IF NOT EXISTS summary_state (
+    src_table  TEXT PRIMARY KEY,
+    last_rowid INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summary_dirty (
+    src_table TEXT NOT NULL, kind TEXT NOT NULL, k TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_summary_dirty ON summary_dirty(src_table, kind, k);
+
+-- View by Epitope
+CREATE TABLE IF NOT EXISTS sum_epitope_base (
+    Epitope TEXT, hit_id TEXT, qname TEXT, substr_cnt INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_sum_epitope_base ON sum_epitope_base(Epitope, hit_id, qname, substr_cnt);
+CREATE INDEX IF NOT EXISTS ix_sum_epitope_base_q ON sum_epitope_base(qname, Epitope);
+CREATE TABLE IF NOT EXISTS {SUM_EPITOPE} (
+    Epitope TEXT PRIMARY KEY,
+    epitope_count INTEGER,
+    hit_human_protein_id_kind INTEGER,
+    query_protein_name_kind INTEGER,
+    epitope_length INTEGER,
+    IEDB_human_epitope_substring_count INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_{SUM_EPITOPE}_order ON {SUM_EPITOPE}(epitope_count DESC, Epitope ASC);
+
+-- View by Query
+CREATE TABLE IF NOT EXISTS sum_query_base (
+    query_protein_name TEXT, hit_human_protein_id TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_sum_query_base ON sum_query_base(query_protein_name, hit_human_protein_id);
+CREATE TABLE IF NOT EXISTS {SUM_QUERY} (
+    query_protein_name TEXT PRIMARY KEY,
+    hit_human_protein_id_kind INTEGER,
+    hit_human_protein_id_sequence_count INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_{SUM_QUERY}_order ON {SUM_QUERY}(hit_human_protein_id_kind DESC, query_protein_name ASC);
+
+-- View by Reference
+CREATE TABLE IF NOT EXISTS sum_reference_base (
+    hit_human_protein_id TEXT, query_protein_name TEXT, epitope TEXT,
+    data_count INTEGER, has_fully INTEGER, has_any INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_sum_reference_base
+    ON sum_reference_base(hit_human_protein_id, query_protein_name, epitope, data_count, has_fully, has_any);
+CREATE TABLE IF NOT EXISTS {SUM_REFERENCE} (
+    hit_human_protein_id TEXT,
+    query_protein_name_kind INTEGER,
+    epitope_count INTEGER,
+    IEDB_human_protein_data_count INTEGER,
+    IEDB_fully_contained_MME_count INTEGER,
+    IEDB_fully_or_partial_MME_count INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_{SUM_REFERENCE}_hit ON {SUM_REFERENCE}(hit_human_protein_id);
+"""
+
+# 去重基底列（sum_*_base 的內容）；{src} 是 FROM 子句：增量更新時是水位線之後的新列，job 彙總時是該 job 的列
+EPITOPE_BASE_SQL = """
+    SELECT DISTINCT
+        TRIM(COALESCE(mme_query,''))                   AS Epitope,
+        TRIM(COALESCE(hit_human_protein_id,''))        AS hit_id,
+        TRIM(COALESCE(query_protein_name,''))          AS qname,
+        COALESCE(iedb_human_epitope_substring_count,0) AS substr_cnt
+    {src}
+"""
+
+QUERY_BASE_SQL = """
+    SELECT DISTINCT
+        TRIM(COALESCE(query_protein_name,''))   AS query_protein_name,
+        TRIM(COALESCE(hit_human_protein_id,'')) AS hit_human_protein_id
+    {src}
+"""
+
+REFERENCE_BASE_SQL = """
+    SELECT DISTINCT
+        hit_human_protein_id,
+        query_protein_name,
+        TRIM(mme_query)                                            AS epitope,
+        iedb_human_protein_data_count                              AS data_count,
+        COALESCE(iedb_human_positional_fully_contained,0) != 0     AS has_fully,
+        COALESCE(iedb_human_positional_partial_overlap,0) != 0     AS has_any
+    {src}
+"""
+
+# 彙總 SQL（與原本各頁的 GROUP BY 口徑相同，只是來源換成去重基底表）
+EPITOPE_AGG_SQL = """
+    SELECT
+      Epitope,
+      COUNT(*)                 AS epitope_count,
+      COUNT(DISTINCT hit_id)   AS hit_human_protein_id_kind,
+      COUNT(DISTINCT qname)    AS query_protein_name_kind,
+      LENGTH(Epitope)          AS epitope_length,
+      MAX(substr_cnt)          AS IEDB_human_epitope_substring_count
+    FROM sum_epitope_base
+    {where}
+    GROUP BY Epitope
+"""
+
+QUERY_AGG_SQL = """
+    SELECT
+      query_protein_name,
+      COUNT(*)                             AS hit_human_protein_id_kind,
+      COUNT(DISTINCT hit_human_protein_id) AS hit_human_protein_id_sequence_count
+    FROM sum_query_base
+    {where}
+    GROUP BY query_protein_name
+"""
+
+REFERENCE_AGG_SQL = """
+    SELECT
+      hit_human_protein_id,
+      COUNT(DISTINCT query_protein_name)                            AS query_protein_name_kind,
+      COUNT(DISTINCT epitope)                                       AS epitope_count,
+      MIN(data_count)                                               AS IEDB_human_protein_data_count,
+      COUNT(DISTINCT CASE WHEN has_fully THEN epitope END)          AS IEDB_fully_contained_MME_count,
+      COUNT(DISTINCT CASE WHEN has_fully OR has_any THEN epitope END) AS IEDB_fully_or_partial_MME_count
+    FROM sum_reference_base
+    {where}
+    GROUP BY hit_human_protein_id
+"""
+
+
+_JOB_SUMMARY = {
+    "epitope":   ("sum_epitope_base",   EPITOPE_BASE_SQL,   EPITOPE_AGG_SQL),
+    "query":     ("sum_query_base",     QUERY_BASE_SQL,     QUERY_AGG_SQL),
+    "reference": ("sum_reference_base", REFERENCE_BASE_SQL, REFERENCE_AGG_SQL),
+}
+
+# 各彙總的 key：(基底表, 基底表上的 key 欄, 來源表上對應的運算式, 暫存表)
+_KEYS = {
+    "epitope":   ("sum_epitope_base",   "Epitope",              "TRIM(COALESCE(mme_query,''))",          "_touched_epi"),
+    "query":     ("sum_query_base",     "query_protein_name",   "TRIM(COALESCE(query_protein_name,''))", "_touched_q"),
+    "reference": ("sum_reference_base", "hit_human_protein_id", "hit_human_protein_id",                  "_touched_hit"),
+}
+
+def job_summary_sql(kind: str, src: str, where: str = "") -> str:
+    """
+    單一 job 的即時彙總（kind = epitope / query / reference），口徑與 summary_by_* 完全相同。
+    去重基底改用同名 CTE（SQLite 的 CTE 名稱優先於實體表），只掃 src 那些列；
+    src 例如 'FROM "iedb_result" WHERE job_id = ?'，where 套在基底列上（例如 'WHERE qname = ?'）。
+    """
+    base, base_sql, agg_sql = _JOB_SUMMARY[kind]
+    return f"WITH {base} AS ({base_sql.format(src=src)}) " + agg_sql.format(where=where)
+
+def ensure_summary_schema(conn: sqlite3.Connection) -> None:
+    conn.executescript(_DDL)
+
+def _src_exists(conn: sqlite3.Connection, src_table: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (src_table,)
+    ).fetchone() is not None
+
+def mark_summary_dirty(conn: sqlite3.Connection, src_table: str, where: str, params=()) -> int:
+    """
+    src_table 裡符合 where 的列碰到的 key 記成待重算（要刪 / 改這些列的前後各呼叫一次，
+    跟刪改放在同一個交易裡）。src_table 還沒有彙總（summary_state 沒記錄）時什麼都不做。
+    回傳記下的 key 數。
+    """
+    if not _src_exists(conn, "summary_state") or conn.execute(
+            "SELECT 1 FROM summary_state WHERE src_table=?", (src_table,)).fetchone() is None:
+        return 0
+    n = 0
+    for kind, (_, _, expr, _) in _KEYS.items():
+        n += conn.execute(
+            f"INSERT OR IGNORE INTO summary_dirty (src_table, kind, k) "
+            f'SELECT DISTINCT ?, ?, {expr} FROM "{src_table}" WHERE {where}', (src_table, kind, *params)
+        ).rowcount
+    return n
+
+def refresh_summaries(conn: sqlite3.Connection, src_table: str = TABLE_ENR) -> int:
+    """
+    把 src_table 中水位線之後的新列、以及 summary_dirty 記下的 key 併進彙總表；
+    兩者都沒有時只花一次 MAX(rowid)。回傳處理的新列數 + 重算的 dirty key 數。
+    水位線 / dirty 先不加鎖看一次（沒事做就直接回傳），要做時拿到寫鎖（BEGIN IMMEDIATE）之後
+    再重讀一次並快照 summary_dirty 的 rowid，最後只刪快照到的那些列 —— 拿鎖前後別的連線記下的 key 不會被吃掉。
+    """
+    if not _src_exists(conn, src_table):
+        return 0
+    ensure_summary_schema(conn)
+    if not _pending(conn, src_table):
+        return 0
+
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    with conn:
+        row = conn.execute("SELECT last_rowid FROM summary_state WHERE src_table=?", (src_table,)).fetchone()
+        last = row[0] if row else 0
+        top = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{src_table}"').fetchone()[0]
+        if top < last:
+            # 來源表被整個換掉（rowid 倒退）→ 只能全量重建
+            _clear(conn)
+            last = 0
+        new_rows = f'FROM "{src_table}" WHERE rowid > ? AND rowid <= ?'
+        rng = (last, top)
+
+        # 0) dirty key：持鎖後快照（連 rowid），基底表裡這些 key 的列整組丟掉，從來源表（目前的內容）重新取
+        conn.execute("DROP TABLE IF EXISTS temp._dirty_snap")
+        conn.execute("CREATE TEMP TABLE _dirty_snap AS SELECT rowid AS rid, kind, k FROM summary_dirty "
+                     "WHERE src_table=?", (src_table,))
+        n_dirty = conn.execute("SELECT COUNT(*) FROM _dirty_snap").fetchone()[0]
+        for kind in _KEYS:
+            conn.execute(f"DROP TABLE IF EXISTS temp._dirty_{kind}")
+            conn.execute(f"CREATE TEMP TABLE _dirty_{kind} AS SELECT k FROM _dirty_snap WHERE kind=?", (kind,))
+            conn.execute(f"CREATE INDEX temp.ix_dirty_{kind} ON _dirty_{kind}(k)")
+        if n_dirty:
+            for kind, (base, col, _, _) in _KEYS.items():
+                conn.execute(f"DELETE FROM {base} WHERE EXISTS "
+                             f"(SELECT 1 FROM _dirty_{kind} d WHERE d.k IS {base}.{col})")
+            dirty_src = {
+                kind: f'FROM "{src_table}" WHERE EXISTS (SELECT 1 FROM _dirty_{kind} d WHERE d.k IS {expr})'
+                for kind, (_, _, expr, _) in _KEYS.items()
+            }
+            conn.execute("INSERT OR IGNORE INTO sum_epitope_base (Epitope, hit_id, qname, substr_cnt) "
+                         + EPITOPE_BASE_SQL.format(src=dirty_src["epitope"]))
+            conn.execute("INSERT OR IGNORE INTO sum_query_base (query_protein_name, hit_human_protein_id) "
+                         + QUERY_BASE_SQL.format(src=dirty_src["query"]))
+            conn.execute("INSERT OR IGNORE INTO sum_reference_base "
+                         "(hit_human_protein_id, query_protein_name, epitope, data_count, has_fully, has_any) "
+                         + REFERENCE_BASE_SQL.format(src=dirty_src["reference"]))
+
+        # 1) 新列 → 去重基底表
+        conn.execute("INSERT OR IGNORE INTO sum_epitope_base (Epitope, hit_id, qname, substr_cnt) "
+                     + EPITOPE_BASE_SQL.format(src=new_rows), rng)
+        conn.execute("INSERT OR IGNORE INTO sum_query_base (query_protein_name, hit_human_protein_id) "
+                     + QUERY_BASE_SQL.format(src=new_rows), rng)
+        conn.execute("INSERT OR IGNORE INTO sum_reference_base "
+                     "(hit_human_protein_id, query_protein_name, epitope, data_count, has_fully, has_any) "
+                     + REFERENCE_BASE_SQL.format(src=new_rows), rng)
+
+        # 2) 本批碰到的 key（新列 + dirty）
+        for kind, (_, _, expr, touched) in _KEYS.items():
+            conn.execute(f"DROP TABLE IF EXISTS temp.{touched}")
+            conn.execute(f"CREATE TEMP TABLE {touched} AS SELECT DISTINCT {expr} AS k {new_rows} "
+                         f"UNION SELECT k FROM _dirty_{kind}", rng)
+
+        # 3) 只重算這些 key 的彙總
+        conn.execute(f"DELETE FROM {SUM_EPITOPE} WHERE Epitope IN (SELECT k FROM _touched_epi)")
+        conn.execute(f"INSERT INTO {SUM_EPITOPE} "
+                     + EPITOPE_AGG_SQL.format(where="WHERE Epitope IN (SELECT k FROM _touched_epi)"))
+        conn.execute(f"DELETE FROM {SUM_QUERY} WHERE query_protein_name IN (SELECT k FROM _touched_q)")
+        conn.execute(f"INSERT INTO {SUM_QUERY} "
+                     + QUERY_AGG_SQL.format(where="WHERE query_protein_name IN (SELECT k FROM _touched_q)"))
+        conn.execute(f"DELETE FROM {SUM_REFERENCE} WHERE EXISTS "
+                     f"(SELECT 1 FROM _touched_hit t WHERE t.k IS {SUM_REFERENCE}.hit_human_protein_id)")
+        conn.execute(f"INSERT INTO {SUM_REFERENCE} " + REFERENCE_AGG_SQL.format(
+            where="WHERE EXISTS (SELECT 1 FROM _touched_hit t WHERE t.k IS sum_reference_base.hit_human_protein_id)"))
+
+        conn.execute(
+            "INSERT OR REPLACE INTO summary_state (src_table, last_rowid) VALUES (?, ?)", (src_table, top)
+        )
+        conn.execute("DELETE FROM summary_dirty WHERE rowid IN (SELECT rid FROM _dirty_snap)")
+    return top - last + n_dirty
+
+def _pending(conn: sqlite3.Connection, src_table: str) -> bool:
+    """不加鎖的快速檢查：有沒有水位線之後的新列、rowid 倒退、或待重算的 dirty key"""
+    row = conn.execute("SELECT last_rowid FROM summary_state WHERE src_table=?", (src_table,)).fetchone()
+    last = row[0] if row else 0
+    top = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{src_table}"').fetchone()[0]
+    return top != last or conn.execute(
+        "SELECT 1 FROM summary_dirty WHERE src_table=? LIMIT 1", (src_table,)).fetchone() is not None
+
+def try_refresh_summaries(conn: sqlite3.Connection, src_table: str = TABLE_ENR) -> int:
+    """
+    讀取端（GET）用：寫鎖被別人佔著（等完 conn 的 timeout 仍是 locked / busy）就不刷新，
+    直接用現有的彙總表回應 —— 最多少了剛寫進來的那批，下一次請求會補上。
+    """
+    try:
+        return refresh_summaries(conn, src_table)
+    except sqlite3.OperationalError as e:
+        if "locked" not in str(e) and "busy" not in str(e):
+            raise
+        print(f"⚠️ 彙總表刷新略過（資料庫忙碌）：{e}", flush=True)
+        return 0
+
+def _clear(conn: sqlite3.Connection) -> None:
+    """清空彙總相關表（不自行 commit；呼叫端負責交易）"""
+    for t in ("sum_epitope_base", "sum_query_base", "sum_reference_base",
+              SUM_EPITOPE, SUM_QUERY, SUM_REFERENCE, "summary_state", "summary_dirty"):
+        conn.execute(f'DELETE FROM "{t}"')
+
+def rebuild_summaries(db_path: str = DB_PATH, src_table: str = TABLE_ENR) -> int:
+    """全量重建（離線用）：清空後從頭處理整張 src_table"""
+    with sqlite3.connect(db_path) as conn:
+        ensure_summary_schema(conn)
+        _clear(conn)
+        return refresh_summaries(conn, src_table)
+
+def refresh_summaries_at(db_path: str = DB_PATH, src_table: str = TABLE_ENR) -> int:
+    with sqlite3.connect(db_path, timeout=30) as conn:
+        return refresh_summaries(conn, src_table)
@@ -0,0 +1,59 @@
+# web_tool/utils/upload_stream.py
+# -*- coding: utf-8 -*-
+"""
+把上傳的 FASTA（Django UploadedFile 或任何 binary file-like）包成逐行讀的文字串流，
+不再 read() → decode() 整包放進記憶體；支援 .gz 上傳（看 magic bytes，不看副檔名）。
+"""
+from __future__ import annotations
+import gzip, io
+from typing import BinaryIO
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class _LimitedReader(io.RawIOBase):
+    """讀超過 max_bytes 就丟 UploadTooLarge（擋 gzip bomb：壓縮檔很小、解開很大）"""
+
+    def __init__(self, raw: BinaryIO, max_bytes: int | None):
+        self._raw = raw
+        self._left = max_bytes
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        data = self._raw.read(len(b))
+        if self._left is not None:
+            self._left -= len(data)
+            if self._left < 0:
+                raise UploadTooLarge("上傳的 FASTA 解壓後超過大小上限")
+        b[:len(data)] = data
+        return len(data)
+
+
+def is_gzip(f: BinaryIO) -> bool:
+    head = f.read(2)
+    f.seek(0)
+    return head == GZIP_MAGIC
+
+def open_upload_text(up, max_upload_bytes: int | None = None,
+                     max_text_bytes: int | None = None) -> io.TextIOWrapper:
+    """
+    up：Django UploadedFile（大檔已在暫存檔，小檔在記憶體）或 binary file-like。
+    max_upload_bytes 限制上傳本身的大小；max_text_bytes 限制（解壓後）實際讀進來的文字量。
+    UTF-8 解碼錯誤直接忽略（與原本 decode 失敗時的 errors="ignore" 相同）。
+    """
+    size = getattr(up, "size", None)
+    if max_upload_bytes is not None and size is not None and size > max_upload_bytes:
+        raise UploadTooLarge(f"上傳檔案 {size} bytes 超過上限 {max_upload_bytes} bytes")
+
+    raw = up.file if hasattr(up, "file") else up
+    raw.seek(0)
+    if is_gzip(raw):
+        raw = gzip.GzipFile(fileobj=raw, mode="rb")
+    limited = io.BufferedReader(_LimitedReader(raw, max_text_bytes))
+    return io.TextIOWrapper(limited, encoding="utf-8", errors="ignore", newline=None)
@@ -1,25 +1,40 @@
 # web_tool/views.py
 # -*- coding: utf-8 -*-
-import io, csv, re, sqlite3
+import io, csv, re, sqlite3, time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse, StreamingHttpResponse
+from django.conf import settings
 from django.shortcuts import render
 from django.views.decorators.http import require_POST, require_GET
 
 # MME 工具
-from .utils.mme_pipline import run_pipeline, save_append
+from .utils.mme_pipline import run_pipeline, save_append, parse_k_list, parse_fasta
 
 # IEDB 核心函式
-from .utils.IEDB_pipline import process as iedb_process
+from .utils.IEDB_pipline import process as iedb_process, load_reference, overlap_pairs
 
 # 分頁工具
-from .utils.View_by_Epitope import build_view_by_epitope
+from .utils.View_by_Epitope import append_view_by_epitope
 from web_tool.utils.view_by_query import build_summary_by_query, DB_PATH
-
-# 產生JOB_ID
-from .utils.jobs import create_job
+from .utils.summary_tables import (
+    try_refresh_summaries, refresh_summaries_at, job_summary_sql, EPITOPE_AGG_SQL, SUM_EPITOPE, SUM_QUERY, SUM_REFERENCE,
+)
+from .utils.datatables import datatables_query, is_datatables_request, source_columns
+from .utils.export_stream import stream_export, stream_frame, FORMATS as EXPORT_FORMATS
+from .utils.upload_stream import open_upload_text, UploadTooLarge
+from .utils.fasta_index import get_fasta_index
+from .utils.proteome import resolve_human_source
+from .utils.result_cache import result_key, cache_lookup, cache_store, link_cached_result
+
+# 產生JOB_ID / 背景 job queue
+from .utils.jobs import (
+    create_job, enqueue_job, get_job, start_inline_job, update_job, utc_now, worker_name, _assert_safe_table,
+)
+from .utils.job_worker import write_job_rows
 
 # ---------------------------------------------------------
 # 常數設定
@@ -40,6 +55,13 @@ VIEW_EPI_TABLE = "view_by_epitope"
 # Detail頁面
 TABLE_IEDB_PROOFED = "IEDB_human_correct"
 
+# 上傳 FASTA 的大小上限（可在 settings.py 覆寫）：上傳檔本身 / 解壓後的文字量
+MAX_UPLOAD_BYTES = getattr(settings, "MME_MAX_UPLOAD_BYTES", 50 * 1024 * 1024)
+MAX_FASTA_BYTES  = getattr(settings, "MME_MAX_FASTA_BYTES", 200 * 1024 * 1024)
+
+# 結果快取（同一份 query + k + 參考資料直接回舊結果）的淘汰上限
+RESULT_CACHE_MAX_ENTRIES = getattr(settings, "MME_RESULT_CACHE_MAX_ENTRIES", 200)
+
 # ---------------------------------------------------------
 # 首頁
 # ---------------------------------------------------------
@@ -54,41 +76,144 @@ def _sanitize_columns(df: pd.DataFrame) -> pd.DataFrame:
     out.columns = [re.sub(r'[^0-9a-zA-Z_]+', '_', c).strip('_').lower() for c in out.columns]
     return out
 
-def _save_iedb_enriched(df_enr: pd.DataFrame) -> int:
-    """寫入 TABLE_ENR（snake_case 欄位），回傳本次寫入筆數"""
-    sdf = _sanitize_columns(df_enr)
-    n_added = len(sdf)
-    Path(DB_PATH).parent.mkdir(parents=True, exist_ok=True)
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA synchronous=NORMAL;")
-        conn.execute("PRAGMA foreign_keys=ON;")
-        sdf.to_sql(TABLE_ENR, conn, if_exists="append", index=False)
-    return n_added
+def _job_rows(job: dict) -> tuple[str, list]:
+    """
+    job 結果列的 FROM 子句 + 參數：結果在共用的 iedb_result 裡以 job_id 分區（走 (job_id, …) 索引，只掃這個 job 的列）；
+    快取命中的 job 讀來源 job（src_job_id）的分區；舊資料的 job 登記的是自己的整張表。
+    """
+    table = job.get("iedb_table") or TABLE_ENR
+    if table == TABLE_ENR:
+        return f'FROM "{TABLE_ENR}" WHERE job_id = ?', [job.get("src_job_id") or job["job_id"]]
+    _assert_safe_table(table)
+    return f'FROM "{table}"', []
+
+def _job_from_request(request):
+    """?job_id=（job_id 或 short_id）→ (job, None)；沒帶 → (None, None)；查不到 / 還沒跑完 → (None, 錯誤回應)"""
+    job_ref = (request.GET.get("job_id") or "").strip()
+    if not job_ref:
+        return None, None
+    job = get_job(job_ref)
+    if job is None:
+        return None, JsonResponse({"error": "job 不存在"}, status=404)
+    if job["status"] != "done":
+        return None, JsonResponse({"status": job["status"], "progress": job["progress"],
+                                   "message": job["message"]}, status=409)
+    return job, None
+
+def _job_summary_response(request, sql: str, params: list, order: str, limit):
+    """單一 job 的即時彙總（job_summary_sql）→ DataTables server-side 一頁，或整份 {columns, data}"""
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            if is_datatables_request(request.GET):
+                return JsonResponse(datatables_query(
+                    conn, f"({sql}) AS src", None, request.GET, source_params=params, default_order=order,
+                ))
+            sql += f" ORDER BY {order}"
+            if limit is not None:
+                sql += " LIMIT ?"
+                params = params + [limit]
+            df = pd.read_sql(sql, conn, params=params)
+    except Exception as e:
+        return HttpResponseBadRequest(f"讀取/聚合 SQLite 失敗：{e}")
+    return JsonResponse({"columns": list(df.columns), "data": df.values.tolist()})
 
 # ---------------------------------------------------------
-# 後端 API：表單提交 → 跑 MME & IEDB → 存 DB → 從 DB 讀回當批 → 回 JSON/CSV
+# 背景寫庫：mme_form 的回應直接用記憶體裡的結果，DB 寫入交給單一 writer thread。
+# 只有一個 worker → 同一個 job 的原始 MME 一定先於 enriched 寫入，SQLite 也只有一個 writer 在排隊。
+# 送出時 job 已標成 running、owner 記成這個 web process（start_inline_job）；寫完才標 done。
+#   寫入失敗 → 在 writer thread 上退避重試幾次，還是失敗就標 failed（訊息寫在 job 上，不只記 log）；
+#   process 中途掛掉 → owner 的 pid 不在了，worker 啟動時 requeue_running 把它標成 failed。
+# settings.MME_ASYNC_DB_WRITES = False 時就地同步執行（測試 / 除錯用）
+# ---------------------------------------------------------
+ASYNC_DB_WRITES = getattr(settings, "MME_ASYNC_DB_WRITES", True)
+_db_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mme-db-writer")
+DB_WRITE_RETRIES = 3    # 結果寫入失敗（例如 database is locked）時重試的次數，間隔 1, 2, 4… 秒
+
+def _submit_db_write(fn, *args) -> None:
+    if ASYNC_DB_WRITES:
+        _db_writer.submit(fn, *args)
+    else:
+        fn(*args)
+
+def _persist_raw(df_raw: pd.DataFrame, job_id: str) -> None:
+    try:
+        save_append(df_raw, db_path=DB_PATH, table=TABLE_RAW, job_id=job_id)
+    except Exception as e:
+        # 原始 MME 表只是備查（worker 也一樣只記 log），job 的結果以 iedb_result 為準
+        print(f"⚠️ 寫入 {TABLE_RAW} 失敗：{e}", flush=True)
+
+def _persist_enriched(sdf: pd.DataFrame, job_id: str, cache_key, ks: list[int]) -> None:
+    """enriched 結果 → iedb_result（job 標 done）→ 結果快取 → view_by_epitope → 彙總表"""
+    for attempt in range(DB_WRITE_RETRIES + 1):
+        try:
+            n_added = write_job_rows(sdf, job_id, db_path=DB_PATH)
+            break
+        except Exception as e:
+            print(f"⚠️ 寫入 {TABLE_ENR} 失敗（第 {attempt + 1} 次）：{e}", flush=True)
+            if attempt < DB_WRITE_RETRIES:
+                time.sleep(2 ** attempt)
+                continue
+            try:
+                update_job(job_id, status="failed", finished_at=utc_now(), message=f"寫入結果失敗：{e}")
+            except Exception as e2:
+                print(f"⚠️ job {job_id} 無法標成 failed（重啟 worker 時 requeue_running 會處理）：{e2}", flush=True)
+            return
+    update_job(job_id, status="done", progress=1.0, finished_at=utc_now(),
+               message=f"完成：{n_added} 筆 → {TABLE_ENR}")
+
+    # 這次的結果放進結果快取
+    if cache_key:
+        try:
+            cache_store(cache_key, job_id, n_added, params={"k": ks}, db_path=DB_PATH,
+                        max_entries=RESULT_CACHE_MAX_ENTRIES)
+        except Exception as e:
+            print(f"⚠️ 寫入結果快取失敗：{e}", flush=True)
+
+    # ★ 增量更新 view_by_epitope（只合併本批；全量重建請用 rebuild_view_by_epitope 指令）
+    try:
+        append_view_by_epitope(sdf, DB_PATH, src_table=TABLE_ENR, dst_table=VIEW_EPI_TABLE)
+    except Exception as e:
+        print(f"⚠️ 更新 {VIEW_EPI_TABLE} 失敗：{e}", flush=True)
+
+    # 把本批併進 View by Epitope / Query / Reference 的彙總表
+    try:
+        refresh_summaries_at(DB_PATH, src_table=TABLE_ENR)
+    except Exception as e:
+        print(f"⚠️ 更新彙總表失敗：{e}", flush=True)
+
+def _download_response(chunks, fmt: str, gz: bool, filename: str) -> StreamingHttpResponse:
+    content_type, ext = EXPORT_FORMATS[fmt]
+    if gz:
+        content_type, ext = "application/gzip", ext + ".gz"
+    resp = StreamingHttpResponse(chunks, content_type=content_type)
+    resp["Content-Disposition"] = f'attachment; filename="{filename}.{ext}"'
+    return resp
+
+def _streaming_export(sql: str, params: list, fmt: str, gz: bool, filename: str) -> StreamingHttpResponse:
+    """SQLite 分批讀 → 逐批輸出 CSV / NDJSON（可選 gzip）的下載回應"""
+    return _download_response(stream_export(DB_PATH, sql, params, fmt=fmt, gzip=gz), fmt, gz, filename)
+
+# ---------------------------------------------------------
+# 後端 API：表單提交 → 跑 MME & IEDB → 回 JSON/CSV（同時在背景存 DB）
 # ---------------------------------------------------------
 @require_POST
 def mme_form(request):
     is_ajax = request.headers.get("x-requested-with") == "XMLHttpRequest"
 
-    # 1) 驗證 k
-    k_str = (request.POST.get("k_mer") or "").strip()
-    if not k_str:
-        return HttpResponseBadRequest("請輸入 k-mer 長度")
+    # 1) 驗證 k（可一次多個：'5,6,7' 或 '5-9'；多個時結果多一欄 k）
     try:
-        k = int(k_str)
-    except ValueError:
-        return HttpResponseBadRequest("k-mer 必須是整數")
-    if not (1 <= k <= 1000):
-        return HttpResponseBadRequest("k-mer 必須介於 1 到 1000 之間")
+        ks = parse_k_list(request.POST.get("k_mer") or "")
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    k = ks[0] if len(ks) == 1 else ks
+    k_tag = "-".join(map(str, ks))
 
     # 2) species 與 human fasta
     species = request.POST.get("species", "human")
     if species != "human":
         return HttpResponseBadRequest("目前僅支援 human 參考資料")
-    human_path = str(HUMAN_FASTA)
+    # 有編譯好的 proteome（manage.py compile_proteome）就直接 memmap，不 parse FASTA
+    human_path = str(resolve_human_source(HUMAN_FASTA))
     if not Path(human_path).exists():
         return HttpResponseBadRequest(f"參考 FASTA 不存在：{human_path}")
 
@@ -98,76 +223,115 @@ def mme_form(request):
     if not up and not txt:
         return HttpResponseBadRequest("請貼上 FASTA 或上傳檔案")
 
+    # 上傳檔：逐行串流解碼（可 .gz），不把整包 bytes / 字串同時留在記憶體；
+    # 要讀第二遍（先算快取 key、再跑 MME）就重新開一次，不先把 records 整份收進 list
     if up:
-        raw = up.read()
-        try:
-            q_text = raw.decode("utf-8")
-        except UnicodeDecodeError:
-            q_text = raw.decode("utf-8", errors="ignore")
+        def open_query():
+            return open_upload_text(up, MAX_UPLOAD_BYTES, MAX_FASTA_BYTES)
     else:
-        q_text = txt
-    q_file_like = io.StringIO(q_text)
+        def open_query():
+            return io.StringIO(txt)
+    try:
+        q_file_like = open_query()
+    except UploadTooLarge as e:
+        return HttpResponseBadRequest(str(e))
 
-    # 4) 跑 MME
+    # 3.1) mode=async：只排進 queue，交給 run_mme_worker 背景跑，馬上回 job id
+    if (request.POST.get("mode") or "").strip() == "async":
+        try:
+            q_text = q_file_like.read()
+        except UploadTooLarge as e:
+            return HttpResponseBadRequest(str(e))
+        job = enqueue_job({"k": k, "species": species}, q_text,
+                          job_ref=(request.POST.get("job_id") or "").strip() or None)
+        job["status_url"] = f"/api/jobs/{job['short_id']}/status/"
+        job["result_url"] = f"/api/jobs/{job['short_id']}/result/"
+        return JsonResponse(job, status=202)
+
+    # 3.2) 同步模式也歸到一個 job：前端先用 api_create_job 拿到的 job_id，沒帶就新建；
+    #      本批結果以 job_id 分區，之後讀回 / job 搜尋頁都只看這個 job 的列。
+    #      job 先標成 running、owner 是這個 process：結果寫進 DB 前出事，job 不會永遠卡在 running
+    job = start_inline_job({"k": k, "species": species}, worker=worker_name("web"),
+                           job_ref=(request.POST.get("job_id") or "").strip() or None)
+    job_id = job["job_id"]
+
+    # 3.3) 結果快取：正規化後的 query + k + 參考資料指紋都一樣就直接回上次的結果，
+    #      不重跑 MME / IEDB，也不再重複寫進 mme_result / iedb_result（job 直接指向來源 job 的分區）
+    cache_key = src_job = None
     try:
-        df_raw = run_pipeline(q_file_like, human_path, k=k)
+        # 邊 parse 邊 hash：records 不留在記憶體
+        cache_key = result_key(parse_fasta(q_file_like), k, human_path, IEDB_CSV)
+        src_job = cache_lookup(cache_key, DB_PATH)
+        if src_job and link_cached_result(src_job, job_id, db_path=DB_PATH) is None:
+            src_job = None     # 來源剛好被覆蓋：照常重跑
+    except UploadTooLarge as e:
+        return HttpResponseBadRequest(str(e))
     except Exception as e:
-        return HttpResponseBadRequest(f"運行失敗：{e}")
+        print(f"⚠️ 讀取結果快取失敗：{e}", flush=True)
+        src_job = None
+    if src_job:
+        update_job(job_id, status="done", progress=1.0, finished_at=utc_now(), message="完成（結果快取）")
+        # 欄位與沒命中時的回應相同：不帶分區欄 job_id
+        with sqlite3.connect(DB_PATH) as conn:
+            col_sql = ", ".join(f'"{c}"' for c in source_columns(conn, f'"{TABLE_ENR}"') if c != "job_id")
+        cached_sql = f'SELECT {col_sql} FROM "{TABLE_ENR}" WHERE job_id = ? ORDER BY rowid'
+        if not is_ajax:
+            return _streaming_export(cached_sql, [src_job], "csv", False, f"iedb_enriched_k{k_tag}")
+        with sqlite3.connect(DB_PATH) as conn:
+            df_show = pd.read_sql(cached_sql, conn, params=[src_job])
+        return JsonResponse({
+            "source": "iedb_enriched",
+            "cached": True,
+            "job_id": job_id,
+            "short_id": job["short_id"],
+            "db_path": DB_PATH,
+            "table": TABLE_ENR,
+            "columns": list(df_show.columns),
+            "records": df_show.to_dict(orient="records"),
+        }, safe=False)
 
-    # 5) （可選）存原始 MME
+    # 4) 跑 MME
     try:
-        save_append(df_raw, db_path=DB_PATH, table=TABLE_RAW)
+        # 逐蛋白快取：之前 job 算過的序列直接重用，只算新的
+        df_raw = run_pipeline(open_query(), human_path, k=k, memo_db=DB_PATH)
+    except UploadTooLarge as e:
+        return HttpResponseBadRequest(str(e))
     except Exception as e:
-        # 寫庫失敗不影響回應 IEDB 結果
-        print(f"⚠️ 寫入 {TABLE_RAW} 失敗：{e}", flush=True)
+        return HttpResponseBadRequest(f"運行失敗：{e}")
+
+    # 5) （可選）存原始 MME：丟給背景 writer，跟下面的 IEDB enrich 同時進行
+    _submit_db_write(_persist_raw, df_raw, job_id)
 
     # 6) 跑 IEDB enrich
     try:
-        iedb_df = pd.read_csv(IEDB_CSV, encoding="utf-8-sig")
+        iedb_ref = load_reference(IEDB_CSV)   # process 內快取，CSV 沒變就不重讀
     except Exception as e:
         return HttpResponseBadRequest(f"讀取 IEDB CSV 失敗：{e}")
     try:
-        df_enr = iedb_process(df_raw.copy(), iedb_df)
+        df_enr = iedb_process(df_raw.copy(), iedb_ref)
     except Exception as e:
         return HttpResponseBadRequest(f"IEDB 運行失敗：{e}")
 
-    # 7) 存 IEDB enriched（不加 batch_id）
-    n_added = _save_iedb_enriched(df_enr)
+    # 7) 存 IEDB enriched（以 job_id 分區）+ 結果快取 + view_by_epitope + 彙總表：全部在背景寫，
+    #    寫完 job 才標成 done（job 搜尋頁 / ?job_id= 在那之前回 409，不會看到寫一半的結果）
+    sdf = _sanitize_columns(df_enr)
+    _submit_db_write(_persist_enriched, sdf, job_id, cache_key, ks)
 
-    # 7.1) ★ 自動重建 view_by_epitope（若工具支援）
-    try:
-        build_view_by_epitope(DB_PATH, src_table=TABLE_ENR, dst_table=VIEW_EPI_TABLE)
-    except Exception as e:
-        print(f"⚠️ 重建 {VIEW_EPI_TABLE} 失敗：{e}", flush=True)
-        
-    # 8) 從 DB 讀回「本批」資料：用 rowid 倒序取最新 n_added 筆，再反轉回原順序
-    with sqlite3.connect(DB_PATH) as conn:
-        df_show = pd.read_sql(
-            f'SELECT * FROM "{TABLE_ENR}" ORDER BY rowid DESC LIMIT ?',
-            conn, params=[n_added]
-        )
-    
-    # 🔹把 batch_id 從回傳結果移除（舊資料立刻不顯示）
-    df_show = df_show.drop(columns=["batch_id"], errors="ignore")
-    
-    # 反轉回寫入順序（可選）
-    if not df_show.empty:
-        df_show = df_show.iloc[::-1].reset_index(drop=True)
-
-    # 9) 回傳
-    if is_ajax:
-        return JsonResponse({
-            "source": "iedb_enriched",
-            "db_path": DB_PATH,
-            "table": TABLE_ENR,
-            "columns": list(df_show.columns),
-            "records": df_show.to_dict(orient="records"),
-        }, safe=False)
+    # 8) 回傳：直接用記憶體裡的本批結果，不再寫完又從 DB 讀回來
+    if not is_ajax:
+        # 非 AJAX：分批串流 CSV 下載，不先組成整個字串
+        return _download_response(stream_frame(sdf, "csv"), "csv", False, f"iedb_enriched_k{k_tag}")
 
-    csv_text = df_show.to_csv(index=False)
-    resp = HttpResponse(csv_text, content_type="text/csv; charset=utf-8")
-    resp["Content-Disposition"] = f'attachment; filename="iedb_enriched_k{k}.csv"'
-    return resp
+    return JsonResponse({
+        "source": "iedb_enriched",
+        "job_id": job_id,
+        "short_id": job["short_id"],
+        "status_url": f"/api/jobs/{job['short_id']}/status/",
+        "db_path": DB_PATH,
+        "table": TABLE_ENR,
+        "columns": list(sdf.columns),
+        "records": sdf.astype(object).where(sdf.notna(), None).to_dict(orient="records"),
+    }, safe=False)
 
 # ---------------------------------------------------------
 # JOB_ID
@@ -181,6 +345,48 @@ def api_create_job(request):
     job = create_job(params={})  # 你要放什麼預設參數都可以
     return JsonResponse(job)
 
+@require_GET
+def api_job_status(request, job_ref):
+    """輪詢 job 狀態；job_ref 可以是 job_id 或 short_id"""
+    job = get_job(job_ref)
+    if job is None:
+        return JsonResponse({"error": "job 不存在"}, status=404)
+    job.pop("params", None)
+    return JsonResponse(job)
+
+@require_GET
+def api_job_result(request, job_ref):
+    """取 job 的結果（自己的 iedb_<id> 表，或 iedb_result 裡 job_id 那一區）→ {columns, records}；可帶 ?limit=&offset="""
+    job = get_job(job_ref)
+    if job is None:
+        return JsonResponse({"error": "job 不存在"}, status=404)
+    if job["status"] != "done":
+        return JsonResponse({"status": job["status"], "progress": job["progress"],
+                             "message": job["message"]}, status=409)
+
+    table = job["iedb_table"] or TABLE_ENR
+    rows, params = _job_rows(job)
+    lim = (request.GET.get("limit") or "").strip()
+    off = (request.GET.get("offset") or "").strip()
+    sql = f"SELECT * {rows}"
+    if lim.isdigit():
+        sql += " LIMIT ? OFFSET ?"
+        params += [int(lim), int(off) if off.isdigit() else 0]
+    try:
+        with sqlite3.connect(DB_PATH) as conn:
+            df = pd.read_sql(sql, conn, params=params)
+    except Exception as e:
+        return HttpResponseBadRequest(f"讀取 SQLite 失敗：{e}")
+
+    return JsonResponse({
+        "job_id": job["job_id"],
+        "short_id": job["short_id"],
+        "table": table,
+        "row_count": job["row_count"],
+        "columns": list(df.columns),
+        "records": df.to_dict(orient="records"),
+    }, safe=False)
+
 def job_id_search(request):
     return render(request, "job_id_search.html")
 # ---------------------------------------------------------
@@ -205,17 +411,41 @@ def reference_detail(request, id):
 # ---------------------------------------------------------
 @require_GET
 def iedb_from_sqlite(request):
-    """讀 DB 的 IEDB enriched（TABLE_ENR）→ 回 {columns, records}"""
+    """
+    讀 DB 的 IEDB enriched（TABLE_ENR）→ 回 {columns, records}；帶 ?job_id= 只讀該 job 的列
+    帶 draw 參數時走 DataTables server-side 協定，只回一頁 {draw, recordsTotal, recordsFiltered, columns, data}
+    """
+    job, err = _job_from_request(request)
+    if err is not None:
+        return err
+    rows, params = _job_rows(job) if job else (f'FROM "{TABLE_ENR}"', [])
+
+    if is_datatables_request(request.GET):
+        try:
+            with sqlite3.connect(DB_PATH) as conn:
+                if job is None:
+                    return JsonResponse(datatables_query(
+                        conn, f'"{TABLE_ENR}"', None, request.GET, default_order="rowid ASC"
+                    ))
+                # 子查詢沒有 rowid：帶出來當預設排序（寫入順序），但不回給前端
+                source = f"(SELECT rowid AS _rid, * {rows}) AS src"
+                cols = [c for c in source_columns(conn, source, params) if c not in ("_rid", "job_id")]
+                return JsonResponse(datatables_query(
+                    conn, source, cols, request.GET, source_params=params, default_order="_rid ASC"
+                ))
+        except Exception as e:
+            return HttpResponseBadRequest(f"讀取 SQLite 失敗：{e}")
+
     limit = request.GET.get("limit")
     limit = int(limit) if (limit and str(limit).isdigit()) else None
 
-    sql = f'SELECT * FROM "{TABLE_ENR}"'
+    sql = f"SELECT * {rows}"
     if limit is not None:
         sql += f" LIMIT {limit}"
 
     try:
         with sqlite3.connect(DB_PATH) as conn:
-            df = pd.read_sql(sql, conn)
+            df = pd.read_sql(sql, conn, params=params)
     except Exception as e:
         return HttpResponseBadRequest(f"讀取 SQLite 失敗：{e}")
 
@@ -224,6 +454,68 @@ def iedb_from_sqlite(request):
         "records": df.to_dict(orient="records")
     }, safe=False)
 
+# 可匯出的表（白名單）；job 的結果表另由 job_artifacts 查出
+EXPORT_TABLES = (TABLE_ENR, TABLE_RAW, VIEW_EPI_TABLE, SUM_EPITOPE, SUM_QUERY, SUM_REFERENCE)
+# ?view= 匯出頁面上那張彙總表（跟 View_by_Query_data 同口徑，整份而不是當前那一頁）
+EXPORT_VIEWS = {"query": SUM_QUERY}
+
+@require_GET
+def export_results(request):
+    """
+    串流匯出（constant memory）：
+      - ?format=csv | ndjson（預設 csv）
+      - ?gzip=1            輸出 .gz
+      - ?job=<job_id 或 short_id>  匯出該 job 的結果表；否則 ?table=（預設 iedb_result）
+      - ?view=query        改匯出 View by Query 的彙總（帶 job 時只彙總該 job）
+      - ?q=                只取某個 query_protein_name
+    """
+    fmt = (request.GET.get("format") or "csv").strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponseBadRequest(f"format 只支援：{', '.join(EXPORT_FORMATS)}")
+    gz = (request.GET.get("gzip") or "").strip().lower() in ("1", "true", "yes")
+    view = (request.GET.get("view") or "").strip().lower()
+    if view and view not in EXPORT_VIEWS:
+        return HttpResponseBadRequest(f"view 只支援：{', '.join(EXPORT_VIEWS)}")
+    q = (request.GET.get("q") or "").strip()
+
+    job_ref = (request.GET.get("job") or "").strip()
+    if job_ref:
+        job = get_job(job_ref)
+        if job is None:
+            return JsonResponse({"error": "job 不存在"}, status=404)
+        if job["status"] != "done":
+            return JsonResponse({"status": job["status"], "progress": job["progress"],
+                                 "message": job["message"]}, status=409)
+        rows, params = _job_rows(job)
+        if view:
+            table = f"{EXPORT_VIEWS[view]}_{job['short_id']}"
+            sql = job_summary_sql(view, rows, "WHERE query_protein_name = ?" if q else "")
+            params = params + ([q] if q else [])
+            q = ""
+        else:
+            table = f"iedb_{job['short_id']}"
+            sql = f"SELECT * {rows}"
+    else:
+        table = EXPORT_VIEWS[view] if view else (request.GET.get("table") or TABLE_ENR).strip()
+        if table not in EXPORT_TABLES:
+            return HttpResponseBadRequest(f"table 只支援：{', '.join(EXPORT_TABLES)}")
+        if view:
+            try:
+                with sqlite3.connect(DB_PATH, timeout=30) as conn:
+                    try_refresh_summaries(conn, TABLE_ENR)
+            except Exception as e:
+                return HttpResponseBadRequest(f"更新彙總表失敗：{e}")
+        sql, params = f'SELECT * FROM "{table}"', []
+
+    if q:
+        sql += (" AND" if " WHERE " in sql else " WHERE") + " query_protein_name = ?"
+        params.append(q)
+
+    try:
+        return _streaming_export(sql, params, fmt, gz, table)
+    except Exception as e:
+        return HttpResponseBadRequest(f"讀取 SQLite 失敗：{e}")
+
 @require_GET
 def View_by_Epitope_data(request):
     # 可選：依 query_protein_name / epitope 篩
@@ -231,58 +523,66 @@ def View_by_Epitope_data(request):
     epi = (request.GET.get("epitope") or "").strip()
     lim = (request.GET.get("limit") or "").strip()
     limit = int(lim) if lim.isdigit() else None
+    job, err = _job_from_request(request)
+    if err is not None:
+        return err
+    if job is not None:
+        # 指定 job：只彙總這個 job 的列（口徑同 summary_by_epitope）
+        rows, params = _job_rows(job)
+        where_parts = []
+        if q:
+            where_parts.append("qname = ?")
+            params.append(q)
+        if epi:
+            where_parts.append("Epitope = ?")
+            params.append(epi)
+        where = ("WHERE " + " AND ".join(where_parts)) if where_parts else ""
+        return _job_summary_response(request, job_summary_sql("epitope", rows, where), params,
+                                     "epitope_count DESC, Epitope ASC", limit)
 
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            # 這裡改查「真實表」TABLE_ENR（= iedb_result），不要用 VIEW_EPI_TABLE
-            # 因為我們要的欄位與正確的聚合口徑都在真實表裡。
+        with sqlite3.connect(DB_PATH, timeout=30) as conn:
+            # 彙總表由「真實表」TABLE_ENR（= iedb_result）增量產生，先確認它的欄位齊全
             cols = [r[1] for r in conn.execute(f'PRAGMA table_info("{TABLE_ENR}")')]
             needed = {"mme_query", "query_protein_name", "hit_human_protein_id", "iedb_human_epitope_substring_count"}
             missing = sorted(list(needed - set(cols)))
             if missing:
                 return HttpResponseBadRequest(f"表 '{TABLE_ENR}' 缺少欄位：{missing}。目前欄位：{cols}")
 
-            # WHERE（僅作為前置篩選，不影響粒度）
-            where_parts, params = [], []
-            if q:
-                where_parts.append("query_protein_name = ?")
-                params.append(q)
-            if epi:
-                where_parts.append("mme_query = ?")
-                params.append(epi)
-            where_sql = "WHERE " + " AND ".join(where_parts) if where_parts else ""
+            # 先把尚未彙總的新列併進 summary_by_epitope（沒有新列時幾乎零成本）
+            try_refresh_summaries(conn, TABLE_ENR)
 
-            # 以「epitope（mme_query）」為唯一粒度的聚合
-            # epitope_count                   = 該 epitope 的列數（或想更嚴格可改 DISTINCT hit+pos）
+            # 以「epitope（mme_query）」為唯一粒度的聚合，已預先算好在 summary_by_epitope：
+            # epitope_count                   = 該 epitope 去重後的 (hit, query, substring) 組數
             # hit_human_protein_id_kind      = 該 epitope 命中的不同蛋白數
             # query_protein_name_kind        = 該 epitope 來自幾個不同的 query 名稱
             # epitope_length                 = epitope 長度
-            # IEDB_human_epitope_substring_count = 對應 IEDB 的 substring 計數（此欄對同一 epitope 通常相同，取 MAX/MIN 都可）
-            
-            sql = f"""
-            WITH base AS (
-            SELECT DISTINCT
-                TRIM(COALESCE(mme_query,''))                 AS Epitope,
-                TRIM(COALESCE(hit_human_protein_id,''))      AS hit_id,
-                TRIM(COALESCE(query_protein_name,''))        AS qname,
-                COALESCE(iedb_human_epitope_substring_count,0) AS substr_cnt
-            FROM "{TABLE_ENR}"
-            {where_sql}
-            )
-            SELECT
-            Epitope,
-            -- 這裡的 COUNT(*) 就是以 base 的「去重結果」計數，不會被 *15 放大
-            COUNT(*)                                       AS epitope_count,
-            COUNT(DISTINCT hit_id)                         AS hit_human_protein_id_kind,
-            COUNT(DISTINCT qname)                          AS query_protein_name_kind,
-            LENGTH(Epitope)                                AS epitope_length,
-            MAX(substr_cnt)                                AS IEDB_human_epitope_substring_count
-            FROM base
-            GROUP BY Epitope
-            ORDER BY epitope_count DESC, Epitope ASC
-            { "LIMIT ?" if limit is not None else "" }
-            """
+            # IEDB_human_epitope_substring_count = 對應 IEDB 的 substring 計數
+            params = []
+            if q:
+                # 有指定 query：只聚合該 query 的去重基底列（qname 有索引）
+                where_parts = ["qname = ?"]
+                params.append(q)
+                if epi:
+                    where_parts.append("Epitope = ?")
+                    params.append(epi)
+                sql = EPITOPE_AGG_SQL.format(where="WHERE " + " AND ".join(where_parts))
+            else:
+                sql = f'SELECT * FROM "{SUM_EPITOPE}"'
+                if epi:
+                    sql += " WHERE Epitope = ?"
+                    params.append(epi)
+
+            if is_datatables_request(request.GET):
+                # server-side：翻頁 / 排序 / 搜尋都在 SQL 做，只回一頁
+                return JsonResponse(datatables_query(
+                    conn, f"({sql}) AS src", None, request.GET, source_params=params,
+                    default_order="epitope_count DESC",
+                ))
+
+            sql += " ORDER BY epitope_count DESC, Epitope ASC"
             if limit is not None:
+                sql += " LIMIT ?"
                 params.append(limit)
 
             print("[View_by_Epitope_data] SQL:\n", sql)
@@ -301,14 +601,40 @@ def View_by_Query_data(request):
     GET 參數：
       - ?q= 某個 query_protein_name（可選）
       - ?limit= 2000（可選，對聚合後結果加 LIMIT）
+      - ?job_id= 只彙總某個 job 的結果（可選）
     回傳 {columns, data} 給 DataTables。
     """
     q = (request.GET.get("q") or "").strip()
     lim = request.GET.get("limit")
     limit = int(lim) if (lim and lim.isdigit()) else None
+    job, err = _job_from_request(request)
+    if err is not None:
+        return err
+    if job is not None:
+        rows, params = _job_rows(job)
+        where = ""
+        if q:
+            where = "WHERE query_protein_name = ?"
+            params.append(q)
+        return _job_summary_response(request, job_summary_sql("query", rows, where), params,
+                                     "hit_human_protein_id_kind DESC, query_protein_name ASC", limit)
 
     # 診斷（可留著幫你確認是不是同一顆 DB）
     print("[View_by_Query_data] DB exists?", Path(DB_PATH).exists(), DB_PATH)
+    if is_datatables_request(request.GET):
+        source, params = f'"{SUM_QUERY}"', []
+        if q:
+            source, params = f'(SELECT * FROM "{SUM_QUERY}" WHERE query_protein_name = ?) AS src', [q]
+        try:
+            with sqlite3.connect(DB_PATH, timeout=30) as conn:
+                try_refresh_summaries(conn, TABLE_ENR)
+                return JsonResponse(datatables_query(
+                    conn, source, None, request.GET, source_params=params,
+                    default_order="hit_human_protein_id_kind DESC",
+                ))
+        except Exception as e:
+            return HttpResponseBadRequest(f"讀取/聚合 SQLite 失敗：{e}")
+
     try:
         df = build_summary_by_query(filter_query=q if q else None, limit=limit)
     except Exception as e:
@@ -331,43 +657,48 @@ def View_by_Reference_data(request):
     hit_id = (request.GET.get("id") or "").strip()
     limit  = request.GET.get("limit")
     limit  = int(limit) if (limit and str(limit).isdigit()) else None
+    job, err = _job_from_request(request)
+    if err is not None:
+        return err
 
     params = []
     where  = ""
     if hit_id:
         where = "WHERE hit_human_protein_id = ?"
         params.append(hit_id)
+    if job is not None:
+        # 只彙總這個 job 的列（口徑同 summary_by_reference）
+        rows, job_params = _job_rows(job)
+        return _job_summary_response(request, job_summary_sql("reference", rows, where), job_params + params,
+                                     "hit_human_protein_id ASC", limit)
+
+    if is_datatables_request(request.GET):
+        source = f'(SELECT * FROM "{SUM_REFERENCE}" {where}) AS src' if where else f'"{SUM_REFERENCE}"'
+        try:
+            with sqlite3.connect(DB_PATH, timeout=30) as conn:
+                try_refresh_summaries(conn, TABLE_ENR)
+                return JsonResponse(datatables_query(
+                    conn, source, None, request.GET, source_params=params,
+                ))
+        except Exception as e:
+            return HttpResponseBadRequest(f"讀取/聚合 SQLite 失敗：{e}")
 
     limit_clause = ""
     if limit is not None:
         limit_clause = " LIMIT ?"
         params.append(limit)
 
+    # 彙總已預先算好在 summary_by_reference（口徑見 summary_tables.REFERENCE_AGG_SQL）
     sql = f"""
-        SELECT
-          hit_human_protein_id,
-          COUNT(DISTINCT query_protein_name) AS query_protein_name_kind,
-          COUNT(DISTINCT TRIM(mme_query))    AS epitope_count,
-          MIN(iedb_human_protein_data_count) AS IEDB_human_protein_data_count,
-          COUNT(DISTINCT CASE
-                  WHEN COALESCE(iedb_human_positional_fully_contained,0) != 0
-                  THEN TRIM(mme_query) END)  AS IEDB_fully_contained_MME_count,
-          COUNT(DISTINCT CASE
-                  WHEN COALESCE(iedb_human_positional_fully_contained,0) != 0
-                       OR COALESCE(iedb_human_positional_partial_overlap,0) != 0
-                  THEN TRIM(mme_query) END)  AS IEDB_fully_or_partial_MME_count
-        FROM "{TABLE_ENR}"
+        SELECT * FROM "{SUM_REFERENCE}"
         {where}
-        GROUP BY hit_human_protein_id
         ORDER BY hit_human_protein_id ASC
         {limit_clause}
     """
 
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            # 也可先檢查欄位是否存在，避免打錯欄位名：
-            # cols = [r[1] for r in conn.execute(f'PRAGMA table_info("{TABLE_ENR}")')]
-            # print("columns:", cols)
+        with sqlite3.connect(DB_PATH, timeout=30) as conn:
+            try_refresh_summaries(conn, TABLE_ENR)
             df = pd.read_sql(sql, conn, params=params)
     except Exception as e:
         return HttpResponseBadRequest(f"讀取/聚合 SQLite 失敗：{e}")
@@ -377,6 +708,26 @@ def View_by_Reference_data(request):
 # ---------------------------------------------------------
 # Reference 的 detail頁
 # ---------------------------------------------------------
+_detail_indexed: set[str] = set()
+
+def _ensure_detail_indexes(conn) -> None:
+    """detail 頁都是「某個蛋白 + 座標」的查詢；索引每個 process 建一次即可"""
+    if DB_PATH in _detail_indexed:
+        return
+    for ddl in (
+        f'CREATE INDEX IF NOT EXISTS ix_{TABLE_ENR}_hit_pos ON "{TABLE_ENR}"'
+        f'(hit_human_protein_id, mme_hit__start, mme_hit__end)',
+        f'CREATE INDEX IF NOT EXISTS ix_{TABLE_IEDB_PROOFED}_uid_pos ON "{TABLE_IEDB_PROOFED}"'
+        f'("UniProt_ID", "Starting Position")',
+    ):
+        try:
+            conn.execute(ddl)
+        except sqlite3.OperationalError as e:
+            # 表或欄位還不存在（例如還沒跑過任何 job）→ 下次再試
+            print(f"⚠️ 建立 detail 索引失敗：{e}", flush=True)
+            return
+    _detail_indexed.add(DB_PATH)
+
 @require_GET
 def view_by_ref_detail(request):
     hp_id = (request.GET.get("id") or "").strip()   # hit_human_protein_id
@@ -384,6 +735,8 @@ def view_by_ref_detail(request):
         return HttpResponseBadRequest("缺少 id")
 
     with sqlite3.connect(DB_PATH) as conn:
+        _ensure_detail_indexes(conn)
+
         # 表1：最上面的 Human Protein 基本資訊
         sql_basic = """
             SELECT 
@@ -403,6 +756,13 @@ def view_by_ref_detail(request):
             "Ensembl": "N/A"
         }
 
+        # 蛋白序列：用 .fai 索引直接從 human.fasta 切出這一條，不 parse 整個檔
+        protein_seq = ""
+        try:
+            protein_seq = get_fasta_index(HUMAN_FASTA).fetch_accession(hp_id) or ""
+        except OSError as e:
+            print(f"⚠️ 讀取 human FASTA 失敗：{e}", flush=True)
+
         # 表2：IEDB proofed Epitope in Human Protein
         sql_proofed = f'''
             SELECT 
@@ -443,35 +803,29 @@ def view_by_ref_detail(request):
         for col in ["IEDB_start", "IEDB_end"]:
             proofed_min[col] = pd.to_numeric(proofed_min[col], errors="coerce").astype("Int64")
 
-        overlap_records = []
+        # 區間索引找重疊（與 IEDB pipeline 共用 overlap_pairs），成本跟結果數同階
+        overlap_df = pd.DataFrame()
         if not mme_df.empty and not proofed_min.empty:
-            for _, m in mme_df.iterrows():
-                start = m["mme_start"]; end = m["mme_end"]
-                if pd.isna(start) or pd.isna(end):
-                    continue
-                for _, p in proofed_min.iterrows():
-                    s_pos = p["IEDB_start"]; e_pos = p["IEDB_end"]
-                    if pd.isna(s_pos) or pd.isna(e_pos):
-                        continue
-                    # 是否重疊
-                    if not ((start <= e_pos) and (end >= s_pos)):
-                        continue
-                    # 完全包含 or 部分重疊
-                    perfect = (start >= s_pos) and (end <= e_pos)
-                    pos_rel = "IEDB includes Perfect_Match" if perfect else "partial overlap"
-                    overlap_records.append({
-                        "IEDB_IRI":              p["IEDB_IRI"],
-                        "IEDB_human_protein_id": hp_id,
-                        "IEDB_epitope":          p["IEDB_epitope"],
-                        "IEDB_start":            int(s_pos),
-                        "IEDB_end":              int(e_pos),
-                        "mme_hit":               m["mme_hit"],
-                        "mme_hit__start":        int(start),
-                        "mme_hit__end":          int(end),
-                        "position_relationship": pos_rel,
-                    })
-
-        overlap_df = pd.DataFrame(overlap_records)
+            s_pos = proofed_min["IEDB_start"].astype("float64").to_numpy()
+            e_pos = proofed_min["IEDB_end"].astype("float64").to_numpy()
+            start = mme_df["mme_start"].to_numpy(dtype=float)
+            end   = mme_df["mme_end"].to_numpy(dtype=float)
+            mi, pi = overlap_pairs(start, end, s_pos, e_pos)
+            if mi.size:
+                # 完全包含 or 部分重疊
+                perfect = (start[mi] >= s_pos[pi]) & (end[mi] <= e_pos[pi])
+                overlap_df = pd.DataFrame({
+                    "IEDB_IRI":              proofed_min["IEDB_IRI"].to_numpy(dtype=object)[pi],
+                    "IEDB_human_protein_id": hp_id,
+                    "IEDB_epitope":          proofed_min["IEDB_epitope"].to_numpy(dtype=object)[pi],
+                    "IEDB_start":            s_pos[pi].astype(int),
+                    "IEDB_end":              e_pos[pi].astype(int),
+                    "mme_hit":               mme_df["mme_hit"].to_numpy(dtype=object)[mi],
+                    "mme_hit__start":        start[mi].astype(int),
+                    "mme_hit__end":          end[mi].astype(int),
+                    "position_relationship": np.where(perfect, "IEDB includes Perfect_Match", "partial overlap"),
+                })
+
         if not overlap_df.empty:
             overlap_df = overlap_df.drop_duplicates()
 
@@ -530,6 +884,8 @@ def view_by_ref_detail(request):
 
         # 表1
         "basic_info": basic_info,
+        "protein_seq": protein_seq,
+        "protein_length": len(protein_seq),
 
         # 表2（Proofed）
         "columns": list(proofed_df.columns),